@@ -1,27 +1,49 @@
+import csv
+import hashlib
+import io
+import json
 import os
+import time
+from contextlib import asynccontextmanager
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Annotated, Optional
 
 import psycopg2
-from db_setup import get_connection
-from fastapi import FastAPI, HTTPException
-from db import (
-    get_all_customers_db,
-    get_customer_db,
-    add_customer_db,
-    delete_customer_db,
-    patch_customer_db,
-    update_customer_db,
+from db_setup import get_pool, init_pool, close_pool, PoolTimeout, connection_kwargs
+from db_setup import DATABASE_REPLICA_URLS
+from fastapi import (
+    Body,
+    Depends,
+    FastAPI,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
 )
-from db import get_all_ads_db, get_ad_db, add_ad_db, delete_ad_db, update_ad_db
-from db import add_realtor_db, delete_realtor_db, update_realtor_db
-from db import add_real_estate_db, delete_real_estate_db, update_real_estate_db
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import bulk_export
+import cache
+import db_async
+import lookups
+import metrics
+import prepared
+import replicas
+from bulk_import import import_listings
+from market_stats import start_refresher, stop_refresher
+from slow_queries import start_explainer, stop_explainer
+from notifications import start_listener, stop_listener
+from db import parse_include
+from db import AD_FIELDS, CUSTOMER_FIELDS, parse_names, project
 from db import (
-    add_realtor_review_db,
-    delete_realtor_review_db,
-    update_realtor_review_db,
-    get_all_realtor_reviews_db,
+    add_ads_batch_db,
+    update_ads_batch_db,
+    add_real_estates_batch_db,
+    update_real_estates_batch_db,
 )
 from psycopg2.extras import RealDictCursor
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 from schemas import (
     CustomerCreate,
@@ -29,17 +51,215 @@ from schemas import (
     CustomerPatch,
     AdCreate,
     AdUpdate,
+    AdSearch,
+    AdBatchUpdate,
+    AdFullResponse,
+    FavoriteCreate,
     RealtorCreate,
     RealtorUpdate,
     RealestateCreate,
     RealestateUpdate,
+    RealestateBatchUpdate,
     RealtorReviewCreate,
     RealtorReviewUpdate,
 )
 from psycopg2 import errors
 from psycopg2 import sql
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one pool per worker process, opened on startup and closed on shutdown,
+    # its connections time their statements for /metrics
+    init_pool(**connection_kwargs(), connection_factory=metrics.TimedConnection)
+    await db_async.init_async_pool()
+    # GETs read from these when configured, see replicas.py
+    await replicas.init_replicas(DATABASE_REPLICA_URLS)
+    with get_pool().connection() as con:
+        lookups.load_lookups(con)
+    # keeps the cached lookups and entities up to date when another worker or script changes them
+    start_listener(
+        {
+            lookups.CHANNEL: lookups.on_lookup_changed,
+            cache.CHANNEL: cache.on_entity_invalidated,
+        }
+    )
+    start_refresher(get_pool())
+    start_explainer(get_pool())
+    yield
+    stop_explainer()
+    stop_refresher()
+    stop_listener()
+    await replicas.close_replicas()
+    await db_async.close_async_pool()
+    close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(replicas.ReadYourWritesMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+def get_db():
+    """Dependency that borrows a pooled connection for the duration of a request"""
+    start = time.perf_counter()
+    with get_pool().connection() as con:
+        metrics.record_wait(time.perf_counter() - start)
+        yield con
+
+
+async def get_async_db(request: Request):
+    """
+    Dependency that borrows a connection from the async pool, used by the async endpoints,
+    or from the pool of a replica for the reads that may use one (see replicas.py)
+    """
+    start = time.perf_counter()
+    con, replica = None, None
+    if replicas.routable(request):
+        con, replica = await replicas.acquire_read()
+    if replica is None:
+        con = await db_async.acquire()
+    request.state.replica = replica
+    metrics.record_wait(time.perf_counter() - start)
+    try:
+        yield metrics.TimedAsyncConnection(con)
+    finally:
+        if replica is None:
+            await db_async.release(con)
+        else:
+            await replica.release(con)
+
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": "database busy, try again"})
+
+
+def on_replica(request):
+    """Whether get_async_db gave the request a connection of a replica"""
+    return request is not None and getattr(request.state, "replica", None) is not None
+
+
+async def cached_read(kind, id, load, con, request=None, probe=None):
+    """
+    Serves an ad/customer from the entity cache, loading (and caching) it on a miss.
+    Returns (rows, headers) with the ETag/Last-Modified of the entity in headers.
+    For a conditional request rows is None when the client's copy is still current,
+    which is checked against the cached copy or else `probe` (a version-only query),
+    so the full query doesn't run when nothing changed
+    """
+    id = int(id)  # raises ValueError for ids that can't exist
+    entity_cache = cache.caches[kind]
+    found = entity_cache.get(id)
+    current = found[0] if found else None
+    if current is None and probe is not None and is_conditional(request):
+        current = await probe(con, id)
+        if current is not None:
+            headers = validators(entity_etag(kind, id, current), current["updated_at"])
+            if not_modified(request, headers):
+                return None, headers
+    if found is None:
+        token = entity_cache.token()
+        found = await load(con, id)
+        if found:
+            # a replica may not have replayed a change invalidated just before the read yet
+            stale_for = (
+                replicas.MAX_LAG + replicas.CHECK_INTERVAL if on_replica(request) else 0
+            )
+            entity_cache.put(id, found, token, stale_for=stale_for)
+    if not found:
+        return found, {}
+    headers = validators(entity_etag(kind, id, found[0]), found[0]["updated_at"])
+    if request is not None and not_modified(request, headers):
+        return None, headers
+    return found, headers
+
+
+# --- Conditional GET ---
+# ETags are built from the row versions (migrations/0003_row_versions.sql) so they can be
+# compared without the body: against a cached copy or the result of a version probe.
+
+
+def is_conditional(request):
+    return request is not None and (
+        "if-none-match" in request.headers or "if-modified-since" in request.headers
+    )
+
+
+def entity_etag(kind, id, row):
+    return f'"{kind}-{id}-{row["version"]}"'
+
+
+def page_etag(kind, rows, next_cursor):
+    """ETag of a page of a list endpoint: its ids and versions, and whether there is a next page"""
+    versions = [[row["id"], str(row["version"])] for row in rows]
+    payload = json.dumps([versions, next_cursor is not None]).encode()
+    return f'"{kind}-{hashlib.sha1(payload).hexdigest()}"'
+
+
+def validators(etag, updated_at=None):
+    headers = {"ETag": etag}
+    if updated_at is not None:
+        headers["Last-Modified"] = format_datetime(
+            updated_at.astimezone(timezone.utc), usegmt=True
+        )
+    return headers
+
+
+def not_modified(request, headers):
+    """
+    True if the client's copy is still current. If-None-Match takes precedence
+    over If-Modified-Since, which only has a one second resolution
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or headers["ETag"] in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since or "Last-Modified" not in headers:
+        return False
+    try:
+        return parsedate_to_datetime(headers["Last-Modified"]) <= parsedate_to_datetime(
+            if_modified_since
+        )
+    except (TypeError, ValueError):
+        return False
+
+
+def not_modified_response(headers):
+    return Response(status_code=304, headers=headers)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Return per route latency, time in SQL and waiting for a connection (histograms),
+    and request, query and row counts, in Prometheus text format
+    """
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """Return hits, misses and evictions of the ad and customer caches"""
+    return cache.stats()
+
+
+@app.get("/pool/stats")
+def get_pool_stats():
+    """
+    Return connection pool usage (in use, idle, wait time) to help sizing it,
+    and how many statements the pooled connections have prepared
+    """
+    return {
+        "sync": get_pool().stats(),
+        "async": db_async.async_pool_stats(),
+        "prepared": prepared.stats(),
+        "replicas": replicas.stats(),
+    }
+
 
 """
 ADD ENDPOINTS FOR FASTAPI HERE
@@ -58,60 +278,322 @@ but will have different HTTP-verbs.
 
 
 @app.get("/customers/")
-def get_all_customers(limit: int = 20):
-    """Return all customers"""
-    con = get_connection()
-    customers = get_all_customers_db(con, limit)
-    return {"customers": customers}
+async def get_all_customers(
+    request: Request,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    con=Depends(get_async_db),
+):
+    """
+    Return all customers, one page at a time. Pass next_cursor as cursor to get the next page.
+    fields=id,name,... returns only those fields (id is always returned).
+    Answers 304 if the page didn't change since the client's ETag
+    """
+    try:
+        # pages have no Last-Modified (a deleted row doesn't change it), only an ETag.
+        # A page of some fields might not have the version, so those pages get none
+        if "if-none-match" in request.headers and not fields:
+            versions, next_cursor = await db_async.get_customers_versions_db(
+                con, limit, cursor
+            )
+            headers = validators(page_etag("customers", versions, next_cursor))
+            if not_modified(request, headers):
+                return not_modified_response(headers)
+        customers, next_cursor = await db_async.get_all_customers_db(
+            con, limit, cursor, fields
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not fields:
+        response.headers.update(
+            validators(page_etag("customers", customers, next_cursor))
+        )
+    return {"customers": customers, "next_cursor": next_cursor}
 
 
 @app.get("/customers/{customer_id}")
-def get_customer(customer_id):
-    """Return customer info"""
-    con = get_connection()
+async def get_customer(
+    customer_id,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = None,
+    con=Depends(get_async_db),
+):
+    """
+    Return customer info, or 304 if the client's ETag/Last-Modified is still current.
+    fields=name,email,... returns only those fields
+    """
+    try:
+        fields = parse_names(fields, CUSTOMER_FIELDS, "field")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
-        customer = get_customer_db(con, customer_id)
-        return {"customer": customer}
+        customer, headers = await cached_read(
+            "customer",
+            customer_id,
+            db_async.get_customer_db,
+            con,
+            request,
+            db_async.get_customer_version_db,
+        )
     except ValueError:
         raise HTTPException(status_code=404, detail="customer not found")
+    if customer is None:
+        return not_modified_response(headers)
+    response.headers.update(headers)
+    return {"customer": [project(row, fields) for row in customer]}
+
+
+@app.get("/customers/{customer_id}/favorites")
+async def get_favorites(
+    customer_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    con=Depends(get_async_db),
+):
+    """Return the ads a customer favorited, one page at a time like GET /ads/"""
+    try:
+        ads, next_cursor = await db_async.get_favorite_ads_db(
+            con, customer_id, limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ads": ads, "next_cursor": next_cursor}
+
+
+@app.post("/customers/{customer_id}/favorites", status_code=201)
+async def create_favorite(
+    customer_id: int,
+    favorite: FavoriteCreate,
+    response: Response,
+    con=Depends(get_async_db),
+):
+    """
+    Favorite an ad. Returns the ad's favorite count, with 201 if the favorite was added
+    and 200 if the ad already was a favorite (which changes nothing)
+    """
+    try:
+        favorite_count, added = await db_async.add_favorite_db(
+            con, customer_id, favorite.ad
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not added:
+        response.status_code = 200
+    return {"ad": favorite.ad, "favorite_count": favorite_count}
+
+
+@app.delete("/customers/{customer_id}/favorites/{ad_id}")
+async def delete_favorite(customer_id: int, ad_id: int, con=Depends(get_async_db)):
+    """Remove an ad from a customer's favorites. Returns the ad's favorite count"""
+    try:
+        favorite_count = await db_async.remove_favorite_db(con, customer_id, ad_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"ad": ad_id, "favorite_count": favorite_count}
 
 
 @app.get("/ads/")
-def get_all_ads(limit: int = 20):
-    """Return all customers"""
-    con = get_connection()
-    ads = get_all_ads_db(con, limit)
+async def get_all_ads(
+    request: Request,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    sort: str = "id",
+    cursor: Optional[str] = None,
+    include: Optional[str] = None,
+    fields: Optional[str] = None,
+    con=Depends(get_async_db),
+):
+    """
+    Return all ads, one page at a time. Pass next_cursor as cursor to get the next page.
+    sort can be id, publish_date or price, prefixed with - for descending order.
+    include=images,real_estates adds the ads' images and real estates to every ad.
+    fields=id,price,... returns only those fields (id and the sort key are always returned),
+    and the query skips the joins no requested field needs.
+    Answers 304 if the page didn't change since the client's ETag
+    """
+    try:
+        include = parse_include(include)
+        # pages have no Last-Modified (a deleted row doesn't change it), only an ETag.
+        # The row versions don't cover included relations, and a page of some fields
+        # might not have them, so those pages get none
+        etag = not include and not fields
+        if "if-none-match" in request.headers and etag:
+            versions, next_cursor = await db_async.get_ads_versions_db(
+                con, limit, sort, cursor
+            )
+            headers = validators(page_etag("ads", versions, next_cursor))
+            if not_modified(request, headers):
+                return not_modified_response(headers)
+        ads, next_cursor = await db_async.get_all_ads_db(
+            con, limit, sort, cursor, fields
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await db_async.get_ads_related_db(con, ads, include)
+    if etag:
+        response.headers.update(validators(page_etag("ads", ads, next_cursor)))
+    return {"ads": ads, "next_cursor": next_cursor}
+
+
+@app.get("/ads/export")
+def export_ads(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    itersize: int = Query(bulk_export.ITERSIZE, ge=100, le=50000),
+):
+    """
+    Stream every ad as NDJSON or CSV, fetched `itersize` rows at a time through a
+    server-side cursor, so memory stays flat however many ads there are
+    """
+    pool = get_pool()
+
+    def stream():
+        # borrowed by the stream rather than through get_db, so it is held until the
+        # stream ends, and a response that is never sent (the client left before the
+        # body) never borrows one: an unstarted generator's finally would never run
+        con = pool.getconn()
+        broken = False
+        try:
+            yield from bulk_export.export_ads(con, format, itersize)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            pool.putconn(con, broken=broken)
+
+    return StreamingResponse(
+        stream(),
+        media_type=bulk_export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="ads.{format}"'},
+    )
+
+
+@app.get("/ads/trending")
+async def get_trending_ads(
+    limit: int = Query(20, ge=1, le=100), con=Depends(get_async_db)
+):
+    """Return the most favorited ads, with their favorite_count"""
+    ads = await db_async.get_trending_ads_db(con, limit)
     return {"ads": ads}
 
 
+@app.get("/ads/search")
+async def search_ads(search: Annotated[AdSearch, Query()], con=Depends(get_async_db)):
+    """
+    Search ads by municipal, real estate type, price, number of rooms, living space and status,
+    and by words in the description with q (ranked, with highlighted snippets in headline).
+    Paginated and sortable like GET /ads/, searches on q can also be sorted by -rank (the default).
+    Takes include like GET /ads/
+    """
+    try:
+        include = parse_include(search.include)
+        ads, next_cursor = await db_async.search_ads_db(con, search)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await db_async.get_ads_related_db(con, ads, include)
+    return {"ads": ads, "next_cursor": next_cursor}
+
+
 @app.get("/ads/{ad_id}")
-def get_ad(ad_id):
-    """Return customer info"""
-    con = get_connection()
+async def get_ad(
+    ad_id,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = None,
+    con=Depends(get_async_db),
+):
+    """Return ad info, fields=price,status,... returns only those fields"""
+    try:
+        fields = parse_names(fields, AD_FIELDS, "field")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
-        ad = get_ad_db(con, ad_id)
-        return {"ad": ad}
+        ad, headers = await cached_read(
+            "ad", ad_id, db_async.get_ad_db, con, request, db_async.get_ad_version_db
+        )
     except ValueError:
         raise HTTPException(status_code=404, detail="ad not found")
+    if ad is None:
+        return not_modified_response(headers)
+    response.headers.update(headers)
+    return {"ad": [project(row, fields) for row in ad]}
+
+
+@app.get("/ads/{ad_id}/full", response_model=AdFullResponse)
+async def get_ad_full(ad_id: int, con=Depends(get_async_db)):
+    """
+    Return everything a listing page shows in one response: the ad, its customer and
+    realtor, its real estates with adress, house/apartment profile and images, and its images
+    """
+    ad = await db_async.get_ad_full_db(con, ad_id)
+    if ad is None:
+        raise HTTPException(status_code=404, detail="ad not found")
+    return {"ad": ad}
+
+
+@app.get("/realtors/top")
+async def get_top_realtors(
+    limit: int = Query(10, ge=1, le=100),
+    min_reviews: int = Query(3, ge=1),
+    con=Depends(get_async_db),
+):
+    """Return the best rated realtors, only counting realtors with at least min_reviews reviews"""
+    realtors = await db_async.get_top_realtors_db(con, limit, min_reviews)
+    return {"realtors": realtors}
+
+
+@app.get("/realtors/{realtor_id}/stats")
+async def get_realtor_stats(realtor_id: int, con=Depends(get_async_db)):
+    """Return the number of reviews, average score and score histogram of a realtor"""
+    stats = await db_async.get_realtor_stats_db(con, realtor_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="realtor not found")
+    return {"stats": stats}
+
+
+@app.get("/stats/municipals/{municipal_id}")
+async def get_municipal_stats(
+    municipal_id: int,
+    months: int = Query(12, ge=1, le=600),
+    con=Depends(get_async_db),
+):
+    """
+    Return the number of listings and sold ads, median asking and sold price and median
+    sold/asking ratio of a municipal per month, for the last `months` months.
+    Served from rollups refreshed in the background, see market_stats.py
+    """
+    if not lookups.id_exists("municipals", municipal_id):
+        raise HTTPException(status_code=404, detail="municipal not found")
+    stats = await db_async.get_municipal_stats_db(con, municipal_id, months)
+    return {"municipal": municipal_id, "months": stats}
 
 
 @app.get("/realtor_reviews/")
-def get_all_realtor_reviews(limit: int = 20):
-    """Return all reviews"""
-    con = get_connection()
-    customers = get_all_realtor_reviews_db(con, limit)
-    return {"customers": customers}
+async def get_all_realtor_reviews(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    con=Depends(get_async_db),
+):
+    """Return all reviews, one page at a time. Pass next_cursor as cursor to get the next page"""
+    try:
+        customers, next_cursor = await db_async.get_all_realtor_reviews_db(
+            con, limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"customers": customers, "next_cursor": next_cursor}
 
 
 @app.post("/customers")
-def create_customer(user_input: CustomerCreate):
+async def create_customer(user_input: CustomerCreate, con=Depends(get_async_db)):
     """
     Create a new customer in the 'users' table.
     Returns the newly created user object with its ID.
     """
-    con = get_connection()
     try:
-        inserted = add_customer_db(con, user_input)
+        inserted = await db_async.add_customer_db(con, user_input)
     except ValueError:
         raise HTTPException(status_code=409, detail="username or email already exists")
     except psycopg2.errors.ForeignKeyViolation:
@@ -122,14 +604,13 @@ def create_customer(user_input: CustomerCreate):
 
 
 @app.post("/realtors")
-def create_realtor(user_input: RealtorCreate):
+async def create_realtor(user_input: RealtorCreate, con=Depends(get_async_db)):
     """
     Create a new realtor in the 'users' table.
     Returns the newly created user object with its ID.
     """
-    con = get_connection()
     try:
-        inserted = add_realtor_db(con, user_input)
+        inserted = await db_async.add_realtor_db(con, user_input)
     except ValueError:
         raise HTTPException(status_code=409, detail="username or email already exists")
     except psycopg2.errors.ForeignKeyViolation:
@@ -140,14 +621,15 @@ def create_realtor(user_input: RealtorCreate):
 
 
 @app.post("/realtor_reviews")
-def create_realtor_review(user_input: RealtorReviewCreate):
+async def create_realtor_review(
+    user_input: RealtorReviewCreate, con=Depends(get_async_db)
+):
     """
     Create a new realtor review in the 'users' table.
     Returns the newly created realtor review object with its ID.
     """
-    con = get_connection()
     try:
-        inserted = add_realtor_review_db(con, user_input)
+        inserted = await db_async.add_realtor_review_db(con, user_input)
     except ValueError:
         raise HTTPException(status_code=409, detail="username or email already exists")
     except psycopg2.errors.ForeignKeyViolation:
@@ -158,14 +640,13 @@ def create_realtor_review(user_input: RealtorReviewCreate):
 
 
 @app.post("/real_estates")
-def create_real_estates(user_input: RealestateCreate):
+async def create_real_estates(user_input: RealestateCreate, con=Depends(get_async_db)):
     """
     Create a new realtor in the 'users' table.
     Returns the newly created user object with its ID.
     """
-    con = get_connection()
     try:
-        inserted = add_real_estate_db(con, user_input)
+        inserted = await db_async.add_real_estate_db(con, user_input)
     except ValueError:
         raise HTTPException(status_code=409, detail="username or email already exists")
     except psycopg2.errors.ForeignKeyViolation:
@@ -176,14 +657,13 @@ def create_real_estates(user_input: RealestateCreate):
 
 
 @app.post("/ads")
-def create_ad(user_input: AdCreate):
+async def create_ad(user_input: AdCreate, con=Depends(get_async_db)):
     """
     Create a new ad in the 'ads' table.
     Returns the newly created ad object with its ID.
     """
-    con = get_connection()
     try:
-        inserted = add_ad_db(con, user_input)
+        inserted = await db_async.add_ad_db(con, user_input)
     except ValueError:
         raise HTTPException(status_code=409, detail="username or email already exists")
     except psycopg2.errors.ForeignKeyViolation:
@@ -196,34 +676,134 @@ def create_ad(user_input: AdCreate):
     }
 
 
+# at most this many rejected rows are listed in the response of POST /imports
+MAX_REPORTED_REJECTIONS = 1000
+
+
+@app.post("/imports", status_code=201)
+def import_listings_file(
+    file: UploadFile, format: Optional[str] = None, con=Depends(get_db)
+):
+    """
+    Bulk import listings (real estate + ad per row) from a CSV or NDJSON file.
+    The format is taken from the file extension unless given.
+    Returns the number of imported and rejected rows, and why rows were rejected.
+    """
+    if format is None:
+        name = (file.filename or "").lower()
+        format = "ndjson" if name.endswith((".ndjson", ".jsonl")) else "csv"
+    rejections = []
+
+    def on_reject(row_no, error):
+        if len(rejections) < MAX_REPORTED_REJECTIONS:
+            rejections.append({"row": row_no, "error": error})
+
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    try:
+        report = import_listings(con, stream, format, on_reject=on_reject)
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"could not read file: {e}")
+    return {**report, "rejections": rejections}
+
+
+# --- Batch endpoints ---
+# Every item is validated on its own, the valid ones are written with one multi-row
+# statement in one transaction and the response lists the id or error of every item.
+
+MAX_BATCH_SIZE = 1000
+
+
+def run_batch(items, model, write):
+    """Validates every item against `model` and writes the valid ones with `write(valid_items)`"""
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"at most {MAX_BATCH_SIZE} items per batch"
+        )
+    results = [None] * len(items)
+    valid = []
+    seen_ids = set()
+    for index, item in enumerate(items):
+        try:
+            parsed = model.model_validate(item)
+        except ValidationError as e:
+            results[index] = {
+                "index": index,
+                "error": e.errors(
+                    include_url=False, include_input=False, include_context=False
+                ),
+            }
+            continue
+        item_id = getattr(parsed, "id", None)
+        if item_id is not None:
+            if item_id in seen_ids:
+                results[index] = {"index": index, "error": "duplicate id in batch"}
+                continue
+            seen_ids.add(item_id)
+        valid.append((index, parsed))
+    if valid:
+        outcomes = write([parsed for _, parsed in valid])
+        for (index, _), outcome in zip(valid, outcomes):
+            results[index] = {"index": index, **outcome}
+    return {"results": results}
+
+
+@app.post("/ads/batch")
+def create_ads_batch(items: list[dict] = Body(...), con=Depends(get_db)):
+    """Create many ads (AdCreate) at once. Returns the id or the error of every item"""
+    return run_batch(items, AdCreate, lambda ads: add_ads_batch_db(con, ads))
+
+
+@app.put("/ads/batch")
+def update_ads_batch(items: list[dict] = Body(...), con=Depends(get_db)):
+    """Update many ads (AdUpdate with id) at once. Returns the id or the error of every item"""
+    return run_batch(items, AdBatchUpdate, lambda ads: update_ads_batch_db(con, ads))
+
+
+@app.post("/real_estates/batch")
+def create_real_estates_batch(items: list[dict] = Body(...), con=Depends(get_db)):
+    """Create many real estates (RealestateCreate) at once. Returns the id or the error of every item"""
+    return run_batch(
+        items,
+        RealestateCreate,
+        lambda real_estates: add_real_estates_batch_db(con, real_estates),
+    )
+
+
+@app.put("/real_estates/batch")
+def update_real_estates_batch(items: list[dict] = Body(...), con=Depends(get_db)):
+    """Update many real estates (RealestateUpdate with id) at once. Returns the id or the error of every item"""
+    return run_batch(
+        items,
+        RealestateBatchUpdate,
+        lambda real_estates: update_real_estates_batch_db(con, real_estates),
+    )
+
+
 @app.delete("/customers/{customer_id}")
-def delete_user(customer_id: int):
+async def delete_user(customer_id: int, con=Depends(get_async_db)):
     """Delete a user by ID."""
-    con = get_connection()
     try:
-        delete_customer_db(con, customer_id)
+        await db_async.delete_customer_db(con, customer_id)
     except ValueError:
         raise HTTPException(status_code=404, detail="customer not found")
     return {"message": f"User with ID {customer_id} deleted successfully."}
 
 
 @app.delete("/realtors/{realtor_id}")
-def delete_realtor(realtor_id: int):
+async def delete_realtor(realtor_id: int, con=Depends(get_async_db)):
     """Delete a realtor by ID."""
-    con = get_connection()
     try:
-        delete_realtor_db(con, realtor_id)
+        await db_async.delete_realtor_db(con, realtor_id)
     except ValueError:
         raise HTTPException(status_code=404, detail="real estate not found")
     return {"message": f"Realtor with ID {realtor_id} deleted successfully."}
 
 
 @app.delete("/realtor_reviews/{realtor_review_id}")
-def delete_realtor_review(realtor_review_id: int):
+async def delete_realtor_review(realtor_review_id: int, con=Depends(get_async_db)):
     """Delete a realtor by ID."""
-    con = get_connection()
     try:
-        delete_realtor_review_db(con, realtor_review_id)
+        await db_async.delete_realtor_review_db(con, realtor_review_id)
     except ValueError:
         raise HTTPException(status_code=404, detail="real review not found")
     return {
@@ -232,36 +812,35 @@ def delete_realtor_review(realtor_review_id: int):
 
 
 @app.delete("/real_estates/{real_estate_id}")
-def delete_real_estate(real_estate_id: int):
+async def delete_real_estate(real_estate_id: int, con=Depends(get_async_db)):
     """Delete a real estate by ID."""
-    con = get_connection()
     try:
-        delete_real_estate_db(con, real_estate_id)
+        await db_async.delete_real_estate_db(con, real_estate_id)
     except ValueError:
         raise HTTPException(status_code=404, detail="real estate not found")
     return {"message": f"Real restate with ID {real_estate_id} deleted successfully."}
 
 
 @app.delete("/ads/{ad_id}")
-def delete_ad(ad_id: int):
+async def delete_ad(ad_id: int, con=Depends(get_async_db)):
     """Delete a ad by ID."""
-    con = get_connection()
     try:
-        delete_ad_db(con, ad_id)
+        await db_async.delete_ad_db(con, ad_id)
     except ValueError:
         raise HTTPException(status_code=404, detail="Ad not found")
     return {"message": f"Ad with ID {ad_id} deleted successfully."}
 
 
 @app.put("/customers/{customer_id}")
-def update_customer(customer_id: int, customer_update: CustomerUpdate):
+async def update_customer(
+    customer_id: int, customer_update: CustomerUpdate, con=Depends(get_async_db)
+):
     """
     updates customer's data. all fields must be included and updated.
     Returns the updated customer object.
     """
-    con = get_connection()
     try:
-        result = update_customer_db(con, customer_id, customer_update)
+        result = await db_async.update_customer_db(con, customer_id, customer_update)
     except psycopg2.errors.ForeignKeyViolation:
         raise HTTPException(status_code=409, detail="Foreign Key error")
     except psycopg2.errors.UniqueViolation:
@@ -272,14 +851,15 @@ def update_customer(customer_id: int, customer_update: CustomerUpdate):
 
 
 @app.put("/realtors/{realtor_id}")
-def update_realtor(realtor_id: int, realtor_update: RealtorUpdate):
+async def update_realtor(
+    realtor_id: int, realtor_update: RealtorUpdate, con=Depends(get_async_db)
+):
     """
     updates realtor's data. all fields must be included and updated.
     Returns the updated customer object.
     """
-    con = get_connection()
     try:
-        result = update_realtor_db(con, realtor_id, realtor_update)
+        result = await db_async.update_realtor_db(con, realtor_id, realtor_update)
     except psycopg2.errors.ForeignKeyViolation:
         raise HTTPException(status_code=409, detail="Foreign Key error")
     except psycopg2.errors.UniqueViolation:
@@ -290,16 +870,19 @@ def update_realtor(realtor_id: int, realtor_update: RealtorUpdate):
 
 
 @app.put("/realtor_reviews/{realtor_review_id}")
-def update_realtor_review(
-    realtor_review_id: int, realtor_review_update: RealtorReviewUpdate
+async def update_realtor_review(
+    realtor_review_id: int,
+    realtor_review_update: RealtorReviewUpdate,
+    con=Depends(get_async_db),
 ):
     """
     updates realtor's data. all fields must be included and updated.
     Returns the updated customer object.
     """
-    con = get_connection()
     try:
-        result = update_realtor_review_db(con, realtor_review_id, realtor_review_update)
+        result = await db_async.update_realtor_review_db(
+            con, realtor_review_id, realtor_review_update
+        )
     except psycopg2.errors.ForeignKeyViolation:
         raise HTTPException(status_code=409, detail="Foreign Key error")
     except psycopg2.errors.UniqueViolation:
@@ -310,14 +893,17 @@ def update_realtor_review(
 
 
 @app.put("/real_estates/{real_estate_id}")
-def update_real_estate(real_estate_id: int, real_estate_update: RealestateUpdate):
+async def update_real_estate(
+    real_estate_id: int, real_estate_update: RealestateUpdate, con=Depends(get_async_db)
+):
     """
     updates real estate's data. all fields must be included and updated.
     Returns the updated customer object.
     """
-    con = get_connection()
     try:
-        result = update_real_estate_db(con, real_estate_id, real_estate_update)
+        result = await db_async.update_real_estate_db(
+            con, real_estate_id, real_estate_update
+        )
     except psycopg2.errors.ForeignKeyViolation:
         raise HTTPException(status_code=409, detail="Foreign Key error")
     except psycopg2.errors.UniqueViolation:
@@ -328,14 +914,13 @@ def update_real_estate(real_estate_id: int, real_estate_update: RealestateUpdate
 
 
 @app.put("/ads/{ad_id}")
-def update_ad(ad_id: int, ad_update: AdUpdate):
+async def update_ad(ad_id: int, ad_update: AdUpdate, con=Depends(get_async_db)):
     """
     updates ad's data. all fields must be included and updated.
     Returns the updated ad object.
     """
-    con = get_connection()
     try:
-        result = update_ad_db(con, ad_id, ad_update)
+        result = await db_async.update_ad_db(con, ad_id, ad_update)
     except psycopg2.errors.ForeignKeyViolation:
         raise HTTPException(status_code=409, detail="Foreign Key error")
     except psycopg2.errors.UniqueViolation:
@@ -346,7 +931,9 @@ def update_ad(ad_id: int, ad_update: AdUpdate):
 
 
 @app.patch("/customers/{customer_id}")
-def patch_customer(customer_id: int, customer_patch: CustomerPatch):
+async def patch_customer(
+    customer_id: int, customer_patch: CustomerPatch, con=Depends(get_async_db)
+):
     """
     Partially updates customer's data. Not all fields must be included and updated in the request.
     Returns the updated customer object.
@@ -354,9 +941,8 @@ def patch_customer(customer_id: int, customer_patch: CustomerPatch):
     update_data = customer_patch.model_dump(exclude_unset=True)  # only provided fields
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
-    con = get_connection()
     try:
-        result = patch_customer_db(con, customer_id, update_data)
+        result = await db_async.patch_customer_db(con, customer_id, update_data)
     except ValueError:
         raise HTTPException(status_code=404, detail="customer not found")
     except Exception as e:
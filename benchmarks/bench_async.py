@@ -0,0 +1,101 @@
+"""
+Compares the sync query path (db.py on the threaded pool, the way FastAPI runs `def` endpoints
+in its threadpool) with the async path (db_async.py on the aiopg pool, the way the `async def`
+endpoints run) for the same read query.
+
+Usage (from the repository root, with the database from db_setup.py running):
+    python benchmarks/bench_async.py --requests 5000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import db_async  # noqa: E402
+from db_setup import ConnectionPool, POOL_MAX_SIZE  # noqa: E402
+
+# FastAPI (anyio) runs sync endpoints on a threadpool of 40 threads by default
+THREADPOOL_SIZE = 40
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summary(name, latencies, elapsed):
+    return {
+        "path": name,
+        "requests": len(latencies),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def run_sync(requests, ad_id):
+    pool = ConnectionPool(max_size=POOL_MAX_SIZE)
+
+    def one_request(_):
+        start = time.perf_counter()
+        with pool.connection() as con:
+            db.get_ad_db(con, ad_id)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADPOOL_SIZE) as executor:
+        latencies = list(executor.map(one_request, range(requests)))
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return summary("sync (threadpool)", latencies, elapsed)
+
+
+async def run_async(requests, concurrency, ad_id):
+    await db_async.init_async_pool()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one_request():
+        async with slots:
+            start = time.perf_counter()
+            con = await db_async.acquire()
+            try:
+                await db_async.get_ad_db(con, ad_id)
+            finally:
+                await db_async.release(con)
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one_request() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    await db_async.close_async_pool()
+    return summary("async (event loop)", latencies, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--ad-id", type=int, default=1)
+    args = parser.parse_args()
+
+    results = [
+        run_sync(args.requests, args.ad_id),
+        asyncio.run(run_async(args.requests, args.concurrency, args.ad_id)),
+    ]
+    print(f"{'path':<22}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(
+            f"{r['path']:<22}{r['requests_per_sec']:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
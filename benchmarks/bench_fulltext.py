@@ -0,0 +1,149 @@
+"""
+Measures GET /ads/search?q= (the full-text query, GIN index on ads.description_tsv)
+against the ILIKE over ads.description it replaces, for a few common search words.
+
+--populate adds synthetic ads with descriptions built from a swedish word list, in
+batches, so it can build the 1M+ ads the numbers are meant for; --cleanup removes them.
+
+Usage (from the repository root, with the database from db_setup.py running):
+    python benchmarks/bench_fulltext.py --populate 1000000
+    python benchmarks/bench_fulltext.py --repeat 50
+    python benchmarks/bench_fulltext.py --cleanup
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import ad_search_sort, build_ad_search_query  # noqa: E402
+from db_setup import get_connection  # noqa: E402
+from schemas import AdSearch  # noqa: E402
+
+# marks the ads inserted by --populate
+AGREEMENT = "bench-fulltext"
+BATCH_SIZE = 100_000
+
+WORDS = """
+    balkong sjöutsikt havsutsikt renoverat kök badrum ljus lägenhet villa radhus trädgård
+    garage centralt lugnt område nära skola kommunikationer hiss takterrass öppen spis
+    planlösning parkett kakelugn bastu brygga uteplats förråd balkongen rymlig charmig
+    nyproduktion sekelskifte altan pool utsikt sovrum vardagsrum matplats
+""".split()
+
+SEARCHES = ["balkong", "sjöutsikt", "kakelugn bastu", '"öppen spis"', "villa -pool"]
+
+POPULATE_QUERY = """
+    WITH customers AS (SELECT array_agg(id) AS ids FROM customer_profiles),
+         realtors AS (SELECT array_agg(id) AS ids FROM realtor_profiles)
+    INSERT INTO ads (agreement, customer, publish_date, end_date, realtor, description, price, status)
+    SELECT %(agreement)s,
+           customers.ids[1 + floor(random() * cardinality(customers.ids))::int],
+           now() - random() * interval '365 days',
+           now() + random() * interval '90 days',
+           realtors.ids[1 + floor(random() * cardinality(realtors.ids))::int],
+           -- 10 to 39 random words, the reference to g makes it run for every row
+           (SELECT string_agg((%(words)s::text[])[1 + floor(random() * cardinality(%(words)s::text[]))::int], ' ')
+            FROM generate_series(1, 10 + g %% 30)),
+           round((500000 + random() * 9500000)::numeric, -3),
+           CASE WHEN random() < 0.7 THEN 'for sale' ELSE 'sold' END
+    FROM generate_series(1, %(count)s) AS g, customers, realtors;
+"""
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def populate(con, count):
+    done = 0
+    while done < count:
+        batch = min(BATCH_SIZE, count - done)
+        with con, con.cursor() as cursor:
+            cursor.execute(
+                POPULATE_QUERY,
+                {"agreement": AGREEMENT, "words": WORDS, "count": batch},
+            )
+        done += batch
+        print(f"{done}/{count} ads inserted")
+    with con, con.cursor() as cursor:
+        cursor.execute("ANALYZE ads;")
+
+
+def cleanup(con):
+    with con, con.cursor() as cursor:
+        cursor.execute("DELETE FROM ads WHERE agreement = %s;", (AGREEMENT,))
+        print(f"{cursor.rowcount} ads deleted")
+
+
+def timed(con, query, params, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with con, con.cursor() as cursor:
+            cursor.execute(query, params)
+            cursor.fetchall()
+        latencies.append(time.perf_counter() - start)
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--populate", type=int, metavar="N", help="insert N ads first")
+    parser.add_argument(
+        "--cleanup", action="store_true", help="delete the inserted ads"
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument(
+        "--no-baseline", action="store_true", help="skip the (slow) ILIKE queries"
+    )
+    args = parser.parse_args()
+
+    con = get_connection()
+    if args.cleanup:
+        cleanup(con)
+        con.close()
+        return
+    if args.populate:
+        populate(con, args.populate)
+
+    with con, con.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM ads;")
+        print(f"{cursor.fetchone()[0]} ads\n")
+
+    print(f"{'search':<20}{'path':<12}{'p50 ms':>10}{'p99 ms':>10}")
+    for q in SEARCHES:
+        search = AdSearch(q=q, limit=args.limit)
+        query, params = build_ad_search_query(search, ad_search_sort(search))
+        results = [("full-text", timed(con, query, params, args.repeat))]
+        if not args.no_baseline:
+            # the closest ILIKE can get: every word has to occur, no ranking or stemming
+            words = [w.strip('"') for w in q.split() if not w.startswith("-")]
+            ilike = " and ".join(["description ilike %s"] * len(words))
+            results.append(
+                (
+                    "ilike",
+                    timed(
+                        con,
+                        f"select id from ads where {ilike} order by id limit %s;",
+                        [f"%{w}%" for w in words] + [args.limit],
+                        args.repeat,
+                    ),
+                )
+            )
+        for path, r in results:
+            print(f"{q:<20}{path:<12}{r['p50_ms']:>10}{r['p99_ms']:>10}")
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Compares plain queries with the prepared statements of prepared.py for the hot queries
+of db.py: GET /ads/{ad_id}, GET /customers/{customer_id} and the INSERT of POST /ads/
+(rolled back, nothing is written).
+
+Reports the client side latency of both paths, and the planning time postgres reports
+for one more run of each (EXPLAIN ANALYZE), which is what a prepared statement saves.
+
+Usage (from the repository root, with the database from db_setup.py running):
+    python benchmarks/bench_prepared.py --repeat 2000
+"""
+
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prepared  # noqa: E402
+from db import (  # noqa: E402
+    AD_QUERY,
+    CUSTOMER_QUERY,
+    INSERT_AD_QUERY,
+)
+from db_setup import get_connection  # noqa: E402
+
+PLANNING_TIME = re.compile(r"Planning Time: ([\d.]+) ms")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def queries(con):
+    """(name, query, params, write) of the benchmarked queries, for ids that exist"""
+    with con, con.cursor() as cursor:
+        cursor.execute("SELECT min(id), min(customer), min(realtor) FROM ads;")
+        ad, customer, realtor = cursor.fetchone()
+    if ad is None:
+        sys.exit("no ads, run `python db_setup.py seed` first")
+    now = datetime.now()
+    insert = ("bench-prepared", customer, now, now, realtor, "", 1.0, None, "for sale")
+    return [
+        ("get_ad", AD_QUERY, (ad,), False),
+        ("get_customer", CUSTOMER_QUERY, (customer,), False),
+        ("add_ad", INSERT_AD_QUERY, insert, True),
+    ]
+
+
+def timed(con, run, query, params, write, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with con.cursor() as cursor:
+            run(cursor, query, params)
+            cursor.fetchall()
+        if write:
+            con.rollback()
+        else:
+            con.commit()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def planning_ms(con, query, params, use_prepared):
+    """The planning time postgres reports for the query, run (and rolled back) once more"""
+    if use_prepared:
+        _, _, run = prepared.statement(query)
+        explained = "EXPLAIN (ANALYZE) " + run
+    else:
+        explained = "EXPLAIN (ANALYZE) " + query
+    with con.cursor() as cursor:
+        cursor.execute(explained, params)
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+    con.rollback()
+    return float(PLANNING_TIME.search(plan).group(1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    con = get_connection()
+    print(
+        f"{'query':<14}{'path':<10}{'p50 ms':>10}{'p99 ms':>10}"
+        f"{'mean ms':>10}{'planning ms':>13}"
+    )
+    for name, query, params, write in queries(con):
+        for path, run in (
+            ("plain", lambda cursor, q, p: cursor.execute(q, p)),
+            ("prepared", prepared.execute),
+        ):
+            # warm up, for the prepared path this also prepares the statement
+            timed(con, run, query, params, write, 10)
+            latencies = timed(con, run, query, params, write, args.repeat)
+            planning = planning_ms(con, query, params, path == "prepared")
+            print(
+                f"{name:<14}{path:<10}"
+                f"{statistics.median(latencies) * 1000:>10.3f}"
+                f"{percentile(latencies, 99) * 1000:>10.3f}"
+                f"{statistics.mean(latencies) * 1000:>10.3f}"
+                f"{planning:>13.3f}"
+            )
+    print(f"\n{prepared.stats()}")
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""
+Load test of the api: starts app.py under uvicorn (or uses a running server with --url),
+drives it with an asyncio HTTP client at a fixed concurrency with a mix of read and write
+requests, and reports throughput and p50/p95/p99 latency per endpoint.
+
+Every run is saved as JSON (with the commit it ran on) so runs can be compared across
+commits with --compare. Ids are sampled from the database, ads and customers created
+by the run are marked and deleted afterwards (--keep keeps them).
+
+Usage (from the repository root, with the database from db_setup.py running):
+    python benchmarks/loadtest.py --mix read --concurrency 50 --duration 30
+    python benchmarks/loadtest.py --mix mixed --workers 4 --compare benchmarks/results/<earlier run>.json
+    python benchmarks/loadtest.py --mix get_ad=80,create_ad=20 --url http://localhost:8000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import date, datetime
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import cache  # noqa: E402
+from db import (  # noqa: E402
+    DELETE_CUSTOMER_PROFILE_QUERY,
+    DELETE_USER_QUERY,
+    NOTIFY_INVALIDATED_QUERY,
+    REMOVE_FAVORITES_QUERY,
+)
+from db_setup import get_connection  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+# marks the ads and customers created by a run
+MARKER = "loadtest"
+SAMPLE_SIZE = 1000
+
+# weights of the endpoints in each named mix
+MIXES = {
+    "read": {"list_ads": 30, "get_ad": 40, "list_customers": 10, "get_customer": 20},
+    "mixed": {
+        "list_ads": 25,
+        "get_ad": 35,
+        "list_customers": 10,
+        "get_customer": 15,
+        "create_ad": 12,
+        "create_customer": 3,
+    },
+    "write": {"create_ad": 60, "create_customer": 10, "get_ad": 30},
+}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def parse_mix(mix):
+    """A named mix, or weights given as endpoint=weight,..."""
+    if mix in MIXES:
+        return MIXES[mix]
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in REQUESTS:
+            raise SystemExit(
+                f"unknown endpoint {name}, choose from {', '.join(REQUESTS)}"
+            )
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def sample_ids():
+    """Random ids of ads, customers, realtors and adresses to build requests from"""
+    con = get_connection()
+    ids = {}
+    with con, con.cursor() as cursor:
+        for name, table in (
+            ("ads", "ads"),
+            ("customers", "customer_profiles"),
+            ("realtors", "realtor_profiles"),
+            ("adresses", "adresses"),
+        ):
+            cursor.execute(
+                f"SELECT id FROM {table} ORDER BY random() LIMIT %s;", (SAMPLE_SIZE,)
+            )
+            ids[name] = [row[0] for row in cursor.fetchall()]
+    con.close()
+    missing = [name for name, values in ids.items() if not values]
+    if missing:
+        raise SystemExit(f"no {', '.join(missing)} in the database, seed it first")
+    return ids
+
+
+def cleanup():
+    """Deletes the ads and customers created by load tests, returns how many"""
+    con = get_connection()
+    with con, con.cursor() as cursor:
+        cursor.execute("DELETE FROM ads WHERE agreement = %s;", (MARKER,))
+        ads = cursor.rowcount
+        cursor.execute(
+            "SELECT id FROM users WHERE user_name LIKE %s;", (f"{MARKER}-%",)
+        )
+        customers = [row[0] for row in cursor.fetchall()]
+        for customer_id in customers:
+            cursor.execute(REMOVE_FAVORITES_QUERY, (customer_id, None, None))
+            cursor.execute(DELETE_CUSTOMER_PROFILE_QUERY, (customer_id,))
+            cursor.execute(DELETE_USER_QUERY, (customer_id,))
+        # a server still running drops them from its entity cache
+        entities = [f"customer:{customer_id}" for customer_id in customers]
+        cursor.execute(NOTIFY_INVALIDATED_QUERY, (cache.CHANNEL, entities + ["ad:*"]))
+    con.close()
+    return ads, len(customers)
+
+
+# endpoint name -> function(rng, ids) returning the method, path and request options
+REQUESTS = {
+    "list_ads": lambda rng, ids: ("GET", "/ads/", {"params": {"limit": 20}}),
+    "get_ad": lambda rng, ids: ("GET", f"/ads/{rng.choice(ids['ads'])}", {}),
+    "list_customers": lambda rng, ids: (
+        "GET",
+        "/customers/",
+        {"params": {"limit": 20}},
+    ),
+    "get_customer": lambda rng, ids: (
+        "GET",
+        f"/customers/{rng.choice(ids['customers'])}",
+        {},
+    ),
+    "create_ad": lambda rng, ids: (
+        "POST",
+        "/ads",
+        {
+            "json": {
+                "agreement": MARKER,
+                "customer": rng.choice(ids["customers"]),
+                "publish_date": date.today().isoformat(),
+                "end_date": date.today().isoformat(),
+                "realtor": rng.choice(ids["realtors"]),
+                "description": "load test",
+                "price": rng.randrange(500_000, 10_000_000, 1000),
+                "sold_price": 0,
+                "status": "for sale",
+            }
+        },
+    ),
+    "create_customer": lambda rng, ids: (
+        "POST",
+        "/customers",
+        {
+            "json": {
+                "username": f"{MARKER}-{uuid.UUID(int=rng.getrandbits(128)).hex[:16]}",
+                "email": f"{uuid.UUID(int=rng.getrandbits(128)).hex[:16]}@example.com",
+                "password": "loadtest-password",
+                "name": "Load Test",
+                "adress": rng.choice(ids["adresses"]),
+            }
+        },
+    ),
+}
+
+
+async def worker(client, rng, weights, ids, stop_at, budget, samples):
+    """Sends requests back to back until stop_at, or until the budget is used up"""
+    names = list(weights)
+    values = list(weights.values())
+    while time.perf_counter() < stop_at:
+        if budget is not None:
+            if budget[0] <= 0:
+                return
+            budget[0] -= 1
+        name = rng.choices(names, values)[0]
+        method, path, options = REQUESTS[name](rng, ids)
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, **options)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        samples.append((name, time.perf_counter() - start, ok))
+
+
+async def run_load(url, weights, ids, concurrency, duration, requests, seed):
+    """Runs the load and returns (elapsed seconds, [(endpoint, latency, ok), ...])"""
+    samples = []
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        stop_at = start + duration if duration else float("inf")
+        budget = [requests] if requests else None
+        await asyncio.gather(
+            *(
+                worker(
+                    client,
+                    random.Random(seed * 1000 + n),
+                    weights,
+                    ids,
+                    stop_at,
+                    budget,
+                    samples,
+                )
+                for n in range(concurrency)
+            )
+        )
+        elapsed = time.perf_counter() - start
+    return elapsed, samples
+
+
+def summarize(samples, elapsed):
+    """Throughput and latency percentiles (ms) per endpoint and for all requests"""
+
+    def summary(latencies, errors):
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "requests_per_sec": round(len(latencies) / elapsed, 1),
+            "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(max(latencies) * 1000, 2),
+        }
+
+    endpoints = {}
+    for name in sorted({name for name, _, _ in samples}):
+        mine = [(latency, ok) for n, latency, ok in samples if n == name]
+        endpoints[name] = summary(
+            [latency for latency, _ in mine], sum(1 for _, ok in mine if not ok)
+        )
+    total = summary(
+        [latency for _, latency, _ in samples], sum(1 for *_, ok in samples if not ok)
+    )
+    return endpoints, total
+
+
+def print_report(endpoints, total, baseline=None):
+    columns = ("requests", "errors", "requests_per_sec", "p50_ms", "p95_ms", "p99_ms")
+    header = ("endpoint", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms")
+    print(f"{header[0]:<18}" + "".join(f"{h:>12}" for h in header[1:]))
+    rows = list(endpoints.items()) + [("total", total)]
+    for name, result in rows:
+        print(f"{name:<18}" + "".join(f"{result[c]:>12}" for c in columns))
+        if baseline is None:
+            continue
+        before = (
+            baseline["total"] if name == "total" else baseline["endpoints"].get(name)
+        )
+        if before:
+            changes = [
+                (
+                    f"{(result[c] - before[c]) / before[c] * 100:+.1f}%"
+                    if before[c]
+                    else "-"
+                )
+                for c in columns[2:]
+            ]
+            print(f"{'  vs baseline':<42}" + "".join(f"{c:>12}" for c in changes))
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_server(port, workers):
+    """Starts app.py under uvicorn and waits until it answers"""
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ],
+        cwd=ROOT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("uvicorn exited, is the database running?")
+        try:
+            if httpx.get(f"{url}/pool/stats", timeout=1).status_code == 200:
+                return server, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("uvicorn didn't start within 30s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--mix",
+        default="read",
+        help=f"{', '.join(MIXES)} or weights like get_ad=80,create_ad=20",
+    )
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument(
+        "--requests", type=int, help="stop after this many requests instead"
+    )
+    parser.add_argument("--warmup", type=float, default=3, help="seconds, not measured")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="use a running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--output", help="where to save the results (json)")
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the ads and customers created"
+    )
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    ids = sample_ids()
+
+    started_at = datetime.now().isoformat(timespec="seconds")
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_server(args.port, args.workers)
+    try:
+        if args.warmup:
+            asyncio.run(
+                run_load(
+                    url, weights, ids, args.concurrency, args.warmup, None, args.seed
+                )
+            )
+        duration = None if args.requests else args.duration
+        elapsed, samples = asyncio.run(
+            run_load(
+                url, weights, ids, args.concurrency, duration, args.requests, args.seed
+            )
+        )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if not args.keep:
+            ads, customers = cleanup()
+            print(f"deleted {ads} ads and {customers} customers created by the run\n")
+
+    endpoints, total = summarize(samples, elapsed)
+    print_report(endpoints, total, baseline)
+
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "started_at": started_at,
+        "config": {
+            "mix": weights,
+            "concurrency": args.concurrency,
+            "duration": duration,
+            "requests": args.requests,
+            "elapsed": round(elapsed, 2),
+            "workers": None if args.url else args.workers,
+            "url": args.url,
+            "seed": args.seed,
+        },
+        "endpoints": endpoints,
+        "total": total,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"loadtest-{commit or 'nogit'}-{stamp}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nresults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
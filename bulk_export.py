@@ -0,0 +1,65 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from psycopg2 import sql
+
+from db import ALL_ADS_SELECT
+
+"""
+Export of every ad as NDJSON or CSV, the counterpart of bulk_import.py.
+
+The rows are read through a server-side (named) cursor, so postgres hands them over
+`itersize` rows at a time instead of the whole result set being loaded into memory,
+and every batch is serialized and yielded before the next one is fetched. Memory use
+only depends on itersize, and the first rows go out before the query has finished.
+"""
+
+ITERSIZE = 2000
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+EXPORT_ADS_QUERY = sql.SQL("{} order by ads.id").format(ALL_ADS_SELECT)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def export_ads(con, format="ndjson", itersize=ITERSIZE):
+    """
+    Yields the ads as chunks of text in ndjson or csv format (one chunk per fetched batch,
+    a csv starts with a header). It is a single query, so the export is a consistent
+    snapshot even if ads change while it is streamed
+    """
+    if format not in FORMATS:
+        raise ValueError("format must be csv or ndjson")
+    with con:
+        with con.cursor(name="export_ads") as cursor:
+            cursor.execute(EXPORT_ADS_QUERY)
+            columns = None
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if columns is None:
+                    # a named cursor only knows its columns after the first fetch
+                    columns = [c.name for c in cursor.description]
+                    if format == "csv":
+                        yield _csv_lines([columns])
+                if not rows:
+                    break
+                if format == "csv":
+                    yield _csv_lines(rows)
+                else:
+                    yield "".join(
+                        json.dumps(dict(zip(columns, row)), default=_json_default)
+                        + "\n"
+                        for row in rows
+                    )
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
@@ -0,0 +1,343 @@
+import csv
+import io
+import json
+from collections import OrderedDict
+
+import psycopg2
+from psycopg2.extras import execute_values
+from pydantic import ValidationError
+
+from schemas import ListingImport
+
+"""
+Bulk import of listings (a real estate together with its ad) from CSV or NDJSON.
+
+The input is read as a stream and handled in chunks: every chunk is validated, its
+municipals, adresses and real estate types are resolved (and created when missing)
+through cached lookups, and the rows are COPY'd into a temporary staging table from
+which real_estates, ads and ads_real_estates are filled with one INSERT ... SELECT each.
+Memory use only depends on the chunk size, not on the size of the file.
+
+Every chunk is committed on its own, so an interrupted import keeps the chunks that
+were done. Rows that fail validation or reference an unknown customer/realtor are
+rejected and reported (row number + reason) without affecting the rest of the chunk.
+When postgres refuses a value the checks let through (an integer out of range, a name
+longer than its column), the chunk is rolled back and loaded again one row at a time,
+each in a savepoint, so only the rows it refuses are rejected, with its error.
+"""
+
+CHUNK_SIZE = 5000
+# adresses are the only lookup that grows with the data, so its cache is bounded
+ADRESS_CACHE_SIZE = 100_000
+
+STAGING_COLUMNS = (
+    "row_no",
+    "real_estate_type",
+    "municipal",
+    "adress",
+    "living_space",
+    "no_of_rooms",
+    "agreement",
+    "customer",
+    "publish_date",
+    "end_date",
+    "realtor",
+    "description",
+    "price",
+    "sold_price",
+    "status",
+)
+
+CREATE_STAGING_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS listing_staging (
+        row_no BIGINT PRIMARY KEY,
+        real_estate_type INT,
+        municipal INT,
+        adress INT,
+        living_space INT,
+        no_of_rooms INT,
+        agreement VARCHAR(255),
+        customer INT,
+        publish_date TIMESTAMPTZ,
+        end_date TIMESTAMPTZ,
+        realtor INT,
+        description TEXT,
+        price FLOAT,
+        sold_price FLOAT,
+        status VARCHAR(50),
+        real_estate_id INT,
+        ad_id INT
+    );
+    TRUNCATE listing_staging;
+"""
+
+# rows pointing at customers/realtors that don't exist are removed (and reported)
+# before the inserts, so one bad row doesn't fail its whole chunk
+REJECT_UNKNOWN_REFERENCES = """
+    DELETE FROM listing_staging s
+    WHERE NOT EXISTS (SELECT 1 FROM customer_profiles c WHERE c.id = s.customer)
+       OR NOT EXISTS (SELECT 1 FROM realtor_profiles r WHERE r.id = s.realtor)
+    RETURNING row_no,
+        CASE WHEN NOT EXISTS (SELECT 1 FROM customer_profiles c WHERE c.id = s.customer)
+             THEN 'unknown customer' ELSE 'unknown realtor' END AS error;
+"""
+
+LOAD_STAGED_LISTINGS = """
+    UPDATE listing_staging
+    SET real_estate_id = nextval(pg_get_serial_sequence('real_estates', 'id')),
+        ad_id = nextval(pg_get_serial_sequence('ads', 'id'));
+
+    INSERT INTO real_estates (id, real_estate_type, municipal, adress, living_space, no_of_rooms)
+    SELECT real_estate_id, real_estate_type, municipal, adress, living_space, no_of_rooms
+    FROM listing_staging;
+
+    INSERT INTO ads (id, agreement, customer, publish_date, end_date, realtor, description, price, sold_price, status)
+    SELECT ad_id, agreement, customer, publish_date, end_date, realtor, description, price, sold_price, status
+    FROM listing_staging;
+
+    INSERT INTO ads_real_estates (ad, real_estate)
+    SELECT ad_id, real_estate_id FROM listing_staging;
+
+    TRUNCATE listing_staging;
+"""
+
+
+class LookupCache:
+    """Caches the ids of municipals, real estate types and adresses, creating the missing ones"""
+
+    def __init__(self, adress_cache_size=ADRESS_CACHE_SIZE):
+        self.municipals = {}
+        self.real_estate_types = {}
+        self.adresses = OrderedDict()
+        self.adress_cache_size = adress_cache_size
+
+    def clear(self):
+        # ids created in a transaction that was rolled back must not be reused
+        self.municipals.clear()
+        self.real_estate_types.clear()
+        self.adresses.clear()
+
+    def resolve(self, cursor, listings):
+        """
+        Makes sure the municipals and real estate types of a chunk of listings are cached
+        and returns the adress ids of the chunk, keyed by adress_key()
+        """
+        self._resolve_names(
+            cursor,
+            self.municipals,
+            {listing.municipal for listing in listings},
+            "municipals",
+            "municipal",
+        )
+        self._resolve_names(
+            cursor,
+            self.real_estate_types,
+            {listing.real_estate_type for listing in listings},
+            "real_estate_types",
+            "type",
+        )
+        return self._resolve_adresses(cursor, listings)
+
+    def _resolve_names(self, cursor, cache, names, table, column):
+        missing = [name for name in names if name not in cache]
+        if not missing:
+            return
+        execute_values(
+            cursor,
+            f"INSERT INTO {table} ({column}) VALUES %s ON CONFLICT ({column}) DO NOTHING;",
+            [(name,) for name in missing],
+            page_size=len(missing),
+        )
+        cursor.execute(
+            f"SELECT id, {column} FROM {table} WHERE {column} = ANY(%s);", (missing,)
+        )
+        for row in cursor.fetchall():
+            cache[row[1]] = row[0]
+
+    def adress_key(self, listing):
+        return (listing.street, listing.street_no, self.municipals[listing.municipal])
+
+    def _resolve_adresses(self, cursor, listings):
+        adress_ids = {}
+        missing = {}
+        for listing in listings:
+            key = self.adress_key(listing)
+            if key in self.adresses:
+                self.adresses.move_to_end(key)
+                adress_ids[key] = self.adresses[key]
+            else:
+                missing[key] = (
+                    listing.street,
+                    listing.street_no,
+                    listing.postal_code,
+                    listing.postal_area,
+                    key[2],
+                )
+        if missing:
+            execute_values(
+                cursor,
+                """INSERT INTO adresses (street, street_no, postal_code, postal_area, municipal)
+                   VALUES %s ON CONFLICT (street, street_no, municipal) DO NOTHING;""",
+                list(missing.values()),
+                page_size=len(missing),
+            )
+            found = execute_values(
+                cursor,
+                """SELECT a.id, a.street, a.street_no, a.municipal FROM adresses a
+                   JOIN (VALUES %s) v(street, street_no, municipal)
+                   ON a.street = v.street AND a.street_no = v.street_no AND a.municipal = v.municipal;""",
+                list(missing),
+                page_size=len(missing),
+                fetch=True,
+            )
+            for adress_id, street, street_no, municipal in found:
+                adress_ids[(street, street_no, municipal)] = adress_id
+                self.adresses[(street, street_no, municipal)] = adress_id
+        while len(self.adresses) > self.adress_cache_size:
+            self.adresses.popitem(last=False)
+        return adress_ids
+
+
+def read_listings(stream, format):
+    """Yields the raw listings (dicts) of a text stream in csv or ndjson format"""
+    if format == "csv":
+        for row in csv.DictReader(stream):
+            # empty csv cells mean "no value"
+            yield {
+                k: v for k, v in row.items() if k is not None and v not in ("", None)
+            }
+    elif format == "ndjson":
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None  # rejected as invalid by import_listings()
+    else:
+        raise ValueError("format must be csv or ndjson")
+
+
+def _staging_rows(listings, cache, adress_ids):
+    for row_no, listing in listings:
+        yield (
+            row_no,
+            cache.real_estate_types[listing.real_estate_type],
+            cache.municipals[listing.municipal],
+            adress_ids[cache.adress_key(listing)],
+            listing.living_space,
+            listing.no_of_rooms,
+            listing.agreement,
+            listing.customer,
+            listing.publish_date.isoformat(),
+            listing.end_date.isoformat(),
+            listing.realtor,
+            listing.description,
+            listing.price,
+            listing.sold_price,
+            listing.status,
+        )
+
+
+def _stage_and_load(cursor, cache, listings):
+    """Loads (row_no, ListingImport) through the staging table, returns the rejected (row_no, error)"""
+    buffer = io.StringIO()
+    cursor.execute(CREATE_STAGING_TABLE)
+    adress_ids = cache.resolve(cursor, [listing for _, listing in listings])
+    csv.writer(buffer).writerows(_staging_rows(listings, cache, adress_ids))
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY listing_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+    cursor.execute(REJECT_UNKNOWN_REFERENCES)
+    rejected = cursor.fetchall()
+    cursor.execute(LOAD_STAGED_LISTINGS)
+    return rejected
+
+
+def _load_chunk(con, cache, listings):
+    """Loads one chunk of (row_no, ListingImport) and returns the rejected (row_no, error)"""
+    try:
+        with con:
+            with con.cursor() as cursor:
+                return _stage_and_load(cursor, cache, listings)
+    except (psycopg2.DataError, psycopg2.IntegrityError):
+        # a value postgres refuses (an integer out of range, a too long name, ...),
+        # the chunk was rolled back and is loaded again row by row to find it
+        cache.clear()
+        return _load_rows(con, cache, listings)
+    except Exception:
+        cache.clear()
+        raise
+
+
+def _load_rows(con, cache, listings):
+    """
+    _load_chunk() one row at a time, each in a savepoint, so the rows postgres refuses are
+    rejected with its error and the others are still loaded
+    """
+    rejected = []
+    try:
+        with con:
+            with con.cursor() as cursor:
+                for row_no, listing in listings:
+                    cursor.execute("SAVEPOINT listing;")
+                    try:
+                        rejected += _stage_and_load(cursor, cache, [(row_no, listing)])
+                    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                        cursor.execute("ROLLBACK TO SAVEPOINT listing;")
+                        # lookups created since the savepoint are gone
+                        cache.clear()
+                        rejected.append((row_no, e.diag.message_primary or str(e)))
+                    else:
+                        cursor.execute("RELEASE SAVEPOINT listing;")
+    except Exception:
+        cache.clear()
+        raise
+    return rejected
+
+
+def import_listings(
+    con, stream, format="csv", chunk_size=CHUNK_SIZE, on_reject=None, cache=None
+):
+    """
+    Imports the listings of a text stream. `on_reject(row_no, error)` is called for every
+    rejected row (row numbers start at 1, not counting a csv header).
+    Returns {"rows": ..., "imported": ..., "rejected": ...}
+    """
+    cache = cache or LookupCache()
+    report = {"rows": 0, "imported": 0, "rejected": 0}
+
+    def reject(row_no, error):
+        report["rejected"] += 1
+        if on_reject:
+            on_reject(row_no, error)
+
+    def flush(chunk):
+        rejected = _load_chunk(con, cache, chunk)
+        for row_no, error in rejected:
+            reject(row_no, error)
+        report["imported"] += len(chunk) - len(rejected)
+
+    chunk = []
+    for row_no, raw in enumerate(read_listings(stream, format), start=1):
+        report["rows"] += 1
+        if not isinstance(raw, dict):
+            reject(row_no, "not a valid listing object")
+            continue
+        try:
+            chunk.append((row_no, ListingImport(**raw)))
+        except ValidationError as e:
+            reject(row_no, "; ".join(_describe(error) for error in e.errors()))
+            continue
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    return report
+
+
+def _describe(error):
+    location = ".".join(str(part) for part in error["loc"])
+    return f"{location}: {error['msg']}" if location else error["msg"]
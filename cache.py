@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+"""
+Read-through cache of the ad and customer details served by GET /ads/{ad_id} and
+GET /customers/{customer_id}.
+
+Entries are evicted when the cache is full (least recently used first) or older than the
+TTL, and invalidated by the db.py functions that change them. Those also send a NOTIFY
+on the entity_invalidated channel so the other workers drop their copy (see
+notifications.py), the TTL bounds the staleness if a notification is ever lost.
+Payloads look like "ad:12", or "ad:*" to drop every cached ad.
+"""
+
+CHANNEL = "entity_invalidated"
+CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("ENTITY_CACHE_TTL", "60"))  # seconds
+# invalidations older than this (seconds) are forgotten, longer than any acceptable replica lag
+INVALIDATION_MEMORY = 300
+
+
+class LRUCache:
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        # bumped on every invalidation, see token()
+        self._generation = 0
+        # key -> when it was last invalidated (None: everything), for put(stale_for=)
+        self._invalidated_at = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def token(self):
+        """
+        Take a token before loading a value and pass it to put(): if anything was
+        invalidated in between, the loaded value might predate the change and isn't cached
+        """
+        return self._generation
+
+    def get(self, key):
+        """The cached value, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, token, stale_for=0):
+        """
+        Caches a value loaded after token() was taken. A value read from a replica
+        lagging up to `stale_for` seconds might predate an invalidation that happened
+        that long before the token, so it isn't cached either
+        """
+        with self._lock:
+            if token != self._generation:
+                return
+            if stale_for:
+                now = time.monotonic()
+                invalidated = max(
+                    self._invalidated_at.get(key, float("-inf")),
+                    self._invalidated_at.get(None, float("-inf")),
+                )
+                if now - invalidated < stale_for:
+                    return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Drops one key, or everything when key is None"""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            now = time.monotonic()
+            self._invalidated_at[key] = now
+            if len(self._invalidated_at) > self.max_size:
+                # only recent invalidations matter, see put()
+                self._invalidated_at = {
+                    k: at
+                    for k, at in self._invalidated_at.items()
+                    if now - at < INVALIDATION_MEMORY
+                }
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+caches = {"ad": LRUCache(), "customer": LRUCache()}
+
+
+def invalidate(kind, key="*"):
+    """Drops an entity (or with key "*" every entity of that kind) from this worker's cache"""
+    caches[kind].invalidate(None if key == "*" else int(key))
+
+
+def on_entity_invalidated(con, payload):
+    """Listener callback for the entity_invalidated channel, None means drop everything"""
+    if payload is None:
+        for cache in caches.values():
+            cache.invalidate()
+        return
+    kind, _, key = payload.partition(":")
+    if kind in caches:
+        invalidate(kind, key or "*")
+
+
+def stats():
+    return {kind: cache.stats() for kind, cache in caches.items()}
@@ -0,0 +1,597 @@
+import csv
+import io
+import math
+import random
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from itertools import chain
+
+from market_stats import refresh_market_stats
+
+"""
+Generator of a large synthetic dataset, for validating performance work at production size
+(insert_base_dataset.sql has a handful of rows, which hides every scaling problem).
+
+Everything is derived from the number of ads and a seed, so the same arguments on the same
+starting database give the same rows. The distributions are skewed the way real listings are:
+a few municipals have most of the real estates (and the highest prices), a few realtors most
+of the ads and reviews, and a few ads most of the favorites (Zipf distributions).
+
+Rows get explicit ids after the largest existing ones (so it can run on top of the base
+dataset) and are streamed to postgres with COPY in batches, generated as they are sent, so
+memory stays flat apart from a few compact arrays per real estate. Triggers and foreign key
+checks are skipped during the load when the user may (session_replication_role), and what
+they maintain is computed afterwards in bulk: favorite counts, realtor_stats and the market
+statistics.
+
+Run it with `python db_setup.py generate --ads 1000000 --seed 1` on a migrated database.
+"""
+
+BATCH_SIZE = 50_000
+# ads are published over the last YEARS years, a few are still to come
+YEARS = 3
+
+MUNICIPALS = 290
+# per ad
+REAL_ESTATES_PER_AD = 0.85
+CUSTOMERS_PER_AD = 0.5
+FAVORITES_PER_AD = 2.0
+REVIEWS_PER_AD = 0.1
+ADS_PER_REALTOR = 500
+REALTORS_PER_AGENCY = 20
+# share of ads that sell two real estates together (e.g. a house and a plot)
+TWO_ESTATE_ADS = 0.03
+IMAGES_PER_REAL_ESTATE = (2, 12)
+IMAGES_PER_AD = 5
+
+# Zipf exponents, higher is more skewed
+MUNICIPAL_SKEW = 1.1
+REALTOR_SKEW = 0.9
+FAVORITE_SKEW = 1.2
+
+PLACE_PREFIXES = """
+    Sol Vall Berg Lin Sund Ny Öster Väster Norr Söder Ek Björk Gran Lunde Strand Al Hög
+    Sjö Fors Mal Kungs Fal Tor Hammar Ulrike Ljung Hag Rosen Mark Vik
+""".split()
+PLACE_SUFFIXES = "köping holm by stad vik berg dal hamn sund ås torp näs".split()
+STREET_PREFIXES = """
+    Kyrk Skol Stor Ring Park Björk Ek Lind Gran Tall Sjö Strand Kvarn Smedje Mölle Torg
+    Trädgårds Järnvägs Hamn Prästgårds Skogs Ängs Berg Dal Bruks Fabriks Station Post
+""".split()
+STREET_SUFFIXES = "gatan vägen stigen backen allén gränd".split()
+FIRST_NAMES = """
+    Anna Eva Maria Karin Sara Emma Elin Lisa Ida Hanna Johan Erik Lars Karl Anders Per
+    Mikael Jonas Oskar Lukas Fredrik Nils Maja Elsa Alice Wilma Astrid Linnea Ebba Olle
+""".split()
+LAST_NAMES = """
+    Andersson Johansson Karlsson Nilsson Eriksson Larsson Olsson Persson Svensson Gustafsson
+    Pettersson Jonsson Jansson Hansson Bengtsson Lindberg Lindström Lindqvist Berg Bergström
+""".split()
+WORDS = """
+    balkong sjöutsikt havsutsikt renoverat kök badrum ljus lägenhet villa radhus trädgård
+    garage centralt lugnt område nära skola kommunikationer hiss takterrass öppen spis
+    planlösning parkett kakelugn bastu brygga uteplats förråd rymlig charmig nyproduktion
+    sekelskifte altan pool utsikt sovrum vardagsrum matplats
+""".split()
+COMMENTS = [
+    "Mycket professionell och trevlig.",
+    "Bra kommunikation och tydlig process.",
+    "Helt okej bemötande, men kunde varit snabbare.",
+    "Fick ett bra pris, rekommenderas.",
+    "Svår att nå under budgivningen.",
+]
+# real estate type -> (living space range, price factor, has a house profile)
+TYPES = {
+    "Villa": ((80, 250), 0.8, True),
+    "Bostadsrätt": ((25, 120), 1.0, False),
+    "Radhus": ((70, 160), 0.85, True),
+}
+SERIAL_TABLES = (
+    "municipals",
+    "adresses",
+    "broker_agencies",
+    "users",
+    "real_estates",
+    "real_estate_images",
+    "ads",
+    "realtor_reviews",
+)
+
+
+def zipf_weights(n, skew):
+    """Cumulative weights of n items where item i is 1/(i+1)^skew as likely as the first"""
+    total = 0.0
+    cumulative = []
+    for i in range(n):
+        total += 1 / (i + 1) ** skew
+        cumulative.append(total)
+    return cumulative
+
+
+def rounded(rng, value):
+    """value rounded up or down at random, so the rounded values keep the mean"""
+    return int(value + rng.random())
+
+
+def copy_rows(cursor, table, columns, rows, batch_size=BATCH_SIZE):
+    """COPYs rows (any iterable, consumed as it goes) into table in batches, returns the count"""
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % batch_size == 0:
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+    return count
+
+
+class Generator:
+    """Generates and loads the dataset, see generate()"""
+
+    def __init__(self, con, ads, seed=1, log=print):
+        self.con = con
+        self.ads = ads
+        self.seed = seed
+        self.log = log
+        self.real_estates = max(1, math.ceil(ads * REAL_ESTATES_PER_AD))
+        self.customers = max(1, math.ceil(ads * CUSTOMERS_PER_AD))
+        self.realtors = max(1, math.ceil(ads / ADS_PER_REALTOR))
+        self.agencies = max(1, math.ceil(self.realtors / REALTORS_PER_AGENCY))
+        # a fixed date, so the seed alone decides the rows
+        self.today = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    def rng(self, name):
+        """An independent random stream per table, so changing one doesn't shift the others"""
+        return random.Random(f"{self.seed}:{name}")
+
+    def load(self, cursor, table, columns, rows):
+        start = time.perf_counter()
+        count = copy_rows(cursor, table, columns, rows)
+        self.log(f"{table}: {count} rows in {time.perf_counter() - start:.1f}s")
+
+    def run(self):
+        with self.con:
+            with self.con.cursor() as cursor:
+                self.prepare(cursor)
+                self.load_places(cursor)
+                self.load_users(cursor)
+                self.load_real_estates(cursor)
+                self.load_ads(cursor)
+                self.load_favorites_and_reviews(cursor)
+                self.finish(cursor)
+        # every month of the generated ads is marked dirty by finish()
+        start = time.perf_counter()
+        refreshed = refresh_market_stats(self.con)
+        self.log(
+            f"market statistics: {refreshed} municipal months in {time.perf_counter() - start:.1f}s"
+        )
+        self.con.autocommit = True
+        with self.con.cursor() as cursor:
+            cursor.execute("ANALYZE;")
+        self.con.autocommit = False
+
+    def prepare(self, cursor):
+        cursor.execute("SELECT current_setting('is_superuser') = 'on';")
+        if cursor.fetchone()[0]:
+            # no triggers or foreign key checks (the rows are consistent by construction)
+            cursor.execute("SET LOCAL session_replication_role = replica;")
+        else:
+            self.log("not a superuser, loading with triggers and foreign key checks")
+        self.first = {}
+        for table in SERIAL_TABLES:
+            cursor.execute(f"SELECT coalesce(max(id), 0) + 1 FROM {table};")
+            self.first[table] = cursor.fetchone()[0]
+        cursor.execute("SELECT type, id FROM user_types;")
+        self.user_types = dict(cursor.fetchall())
+        cursor.execute("SELECT type, id FROM real_estate_types;")
+        self.real_estate_types = dict(cursor.fetchall())
+        missing = {"Kund", "Mäklare"} - set(self.user_types)
+        missing |= set(TYPES) - set(self.real_estate_types)
+        if missing:
+            raise ValueError(f"run `python db_setup.py seed` first, {missing} missing")
+
+    def load_places(self, cursor):
+        first = self.first["municipals"]
+        names = [p + s.lower() for p in PLACE_PREFIXES for s in PLACE_SUFFIXES]
+        self.rng("municipals").shuffle(names)
+        self.municipal_names = [
+            f"{names[i % len(names)]}{'' if i < len(names) else i // len(names) + 1}"
+            for i in range(MUNICIPALS)
+        ]
+        cursor.execute(
+            "SELECT count(*) FROM municipals WHERE municipal = ANY(%s);",
+            (self.municipal_names,),
+        )
+        if cursor.fetchone()[0]:
+            raise ValueError(
+                "a dataset was generated already, reset the database first"
+            )
+        # the bigger the municipal (lower rank), the higher the price per m2
+        self.price_per_m2 = [
+            round(15_000 + 60_000 / math.sqrt(rank + 1)) for rank in range(MUNICIPALS)
+        ]
+        self.load(
+            cursor,
+            "municipals",
+            ["id", "municipal"],
+            ((first + i, name) for i, name in enumerate(self.municipal_names)),
+        )
+
+        # one adress per real estate (in its municipal), then one per customer
+        rng = self.rng("real_estate_municipals")
+        weights = zipf_weights(MUNICIPALS, MUNICIPAL_SKEW)
+        self.estate_municipal = array(
+            "h",
+            rng.choices(range(MUNICIPALS), cum_weights=weights, k=self.real_estates),
+        )
+        customer_municipals = rng.choices(
+            range(MUNICIPALS), cum_weights=weights, k=self.customers
+        )
+        streets = [p + s for p in STREET_PREFIXES for s in STREET_SUFFIXES]
+        rng = self.rng("adresses")
+
+        def adresses():
+            municipals = chain(self.estate_municipal, customer_municipals)
+            for i, municipal in enumerate(municipals):
+                # unique (street, street_no), so unique per municipal too
+                street_no = f"{i // len(streets) + 1}{rng.choice(['', '', 'A', 'B'])}"
+                yield (
+                    self.first["adresses"] + i,
+                    streets[i % len(streets)],
+                    street_no,
+                    f"{10000 + municipal * 300 + rng.randrange(300)}",
+                    self.municipal_names[municipal],
+                    first + municipal,
+                )
+
+        self.load(
+            cursor,
+            "adresses",
+            ["id", "street", "street_no", "postal_code", "postal_area", "municipal"],
+            adresses(),
+        )
+
+    def load_users(self, cursor):
+        rng = self.rng("users")
+        first_agency = self.first["broker_agencies"]
+        self.load(
+            cursor,
+            "broker_agencies",
+            ["id", "name", "email", "adress"],
+            (
+                (
+                    first_agency + i,
+                    f"{rng.choice(LAST_NAMES)} Fastighetsbyrå {first_agency + i}",
+                    f"kontakt{first_agency + i}@byra.example.com",
+                    self.first["adresses"] + rng.randrange(self.real_estates),
+                )
+                for i in range(self.agencies)
+            ),
+        )
+        # realtors first, then customers
+        self.first_realtor = self.first["users"]
+        self.first_customer = self.first_realtor + self.realtors
+
+        def users():
+            for i in range(self.realtors + self.customers):
+                id = self.first_realtor + i
+                realtor = i < self.realtors
+                yield (
+                    id,
+                    self.user_types["Mäklare" if realtor else "Kund"],
+                    f"gen_{id}",
+                    "generated",
+                    f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                    f"gen_{id}@{'maklare.' if realtor else ''}example.com",
+                )
+
+        self.load(
+            cursor,
+            "users",
+            ["id", "type", "user_name", "user_psw", "name", "email"],
+            users(),
+        )
+        self.load(
+            cursor,
+            "realtor_profiles",
+            ["id", "agency"],
+            (
+                (self.first_realtor + i, first_agency + rng.randrange(self.agencies))
+                for i in range(self.realtors)
+            ),
+        )
+        customer_adresses = self.first["adresses"] + self.real_estates
+        self.load(
+            cursor,
+            "customer_profiles",
+            ["id", "adress"],
+            (
+                (self.first_customer + i, customer_adresses + i)
+                for i in range(self.customers)
+            ),
+        )
+
+    def load_real_estates(self, cursor):
+        rng = self.rng("real_estates")
+        first = self.first["real_estates"]
+        first_municipal = self.first["municipals"]
+        names = list(TYPES)
+        self.estate_type = array("b")
+        self.estate_space = array("h")
+
+        def real_estates():
+            for i, municipal in enumerate(self.estate_municipal):
+                type = rng.choices(range(len(names)), weights=(35, 50, 15))[0]
+                low, high = TYPES[names[type]][0]
+                space = rng.randint(low, high)
+                self.estate_type.append(type)
+                self.estate_space.append(space)
+                yield (
+                    first + i,
+                    self.real_estate_types[names[type]],
+                    first_municipal + municipal,
+                    self.first["adresses"] + i,
+                    space,
+                    max(1, space // 25 + rng.randint(-1, 1)),
+                )
+
+        self.load(
+            cursor,
+            "real_estates",
+            [
+                "id",
+                "real_estate_type",
+                "municipal",
+                "adress",
+                "living_space",
+                "no_of_rooms",
+            ],
+            real_estates(),
+        )
+        houses = (i for i, type in enumerate(self.estate_type) if TYPES[names[type]][2])
+        self.load(
+            cursor,
+            "house_profiles",
+            ["id", "building_plot"],
+            ((first + i, rng.randrange(300, 3000, 10)) for i in houses),
+        )
+        apartments = (
+            i for i, type in enumerate(self.estate_type) if not TYPES[names[type]][2]
+        )
+        self.load(
+            cursor,
+            "apartment_profiles",
+            ["id", "apartment_id", "floor"],
+            (
+                (
+                    first + i,
+                    f"{rng.randint(1, 9)}{rng.randint(1, 30):02d}",
+                    rng.randint(0, 12),
+                )
+                for i in apartments
+            ),
+        )
+
+        # images of a real estate have consecutive ids, remembered as (first, count)
+        self.estate_images = array("b")
+        first_image = self.first["real_estate_images"]
+
+        def images():
+            image = first_image
+            for i in range(self.real_estates):
+                count = rng.randint(*IMAGES_PER_REAL_ESTATE)
+                self.estate_images.append(count)
+                for n in range(count):
+                    yield image, first + i, f"gen/{first + i}/{n + 1}.jpg"
+                    image += 1
+
+        self.load(
+            cursor,
+            "real_estate_images",
+            ["id", "real_estate", "picture_link"],
+            images(),
+        )
+        # first image id of every real estate
+        self.estate_first_image = array("l")
+        image = first_image
+        for count in self.estate_images:
+            self.estate_first_image.append(image)
+            image += count
+
+    def load_ads(self, cursor):
+        rng = self.rng("ads")
+        first = self.first["ads"]
+        realtor_weights = zipf_weights(self.realtors, REALTOR_SKEW)
+        names = list(TYPES)
+        # every real estate is listed once, the remaining ads relist random ones;
+        # the few second real estates of an ad are kept apart
+        self.ad_estate = array("l")
+        self.ad_second_estate = {}
+
+        def ads():
+            for i in range(self.ads):
+                estate = (
+                    i if i < self.real_estates else rng.randrange(self.real_estates)
+                )
+                self.ad_estate.append(estate)
+                if rng.random() < TWO_ESTATE_ADS:
+                    second = rng.randrange(self.real_estates)
+                    if second != estate:
+                        self.ad_second_estate[i] = second
+                type = names[self.estate_type[estate]]
+                price = (
+                    self.estate_space[estate]
+                    * self.price_per_m2[self.estate_municipal[estate]]
+                    * TYPES[type][1]
+                    * rng.lognormvariate(0, 0.15)
+                )
+                publish = self.today - timedelta(
+                    days=rng.uniform(-14, YEARS * 365), seconds=rng.randrange(86400)
+                )
+                end = publish + timedelta(days=rng.randint(30, 120))
+                sold_price = None
+                if publish > self.today:
+                    status = "coming"
+                elif end < self.today and rng.random() < 0.8:
+                    status = "sold"
+                    sold_price = round(price * rng.gauss(1.03, 0.06), -3)
+                else:
+                    status = "for sale"
+                yield (
+                    first + i,
+                    rng.choice(["Förmedlingsavtal", "Säljuppdrag"]),
+                    self.first_customer + rng.randrange(self.customers),
+                    publish.isoformat(),
+                    end.isoformat(),
+                    self.first_realtor
+                    + rng.choices(range(self.realtors), cum_weights=realtor_weights)[0],
+                    f"{type} i {self.municipal_names[self.estate_municipal[estate]]}. "
+                    + " ".join(rng.choices(WORDS, k=rng.randint(10, 40))),
+                    round(price, -3),
+                    sold_price,
+                    status,
+                )
+
+        self.load(
+            cursor,
+            "ads",
+            [
+                "id",
+                "agreement",
+                "customer",
+                "publish_date",
+                "end_date",
+                "realtor",
+                "description",
+                "price",
+                "sold_price",
+                "status",
+            ],
+            ads(),
+        )
+        first_estate = self.first["real_estates"]
+
+        def ad_estates():
+            for i, estate in enumerate(self.ad_estate):
+                yield i, estate
+                if i in self.ad_second_estate:
+                    yield i, self.ad_second_estate[i]
+
+        self.load(
+            cursor,
+            "ads_real_estates",
+            ["ad", "real_estate"],
+            ((first + i, first_estate + estate) for i, estate in ad_estates()),
+        )
+        self.load(
+            cursor,
+            "ad_images",
+            ["ad", "picture"],
+            (
+                (first + i, self.estate_first_image[estate] + n)
+                for i, estate in ad_estates()
+                for n in range(min(IMAGES_PER_AD, self.estate_images[estate]))
+            ),
+        )
+
+    def load_favorites_and_reviews(self, cursor):
+        # per customer, so duplicates only have to be looked for among its own rows
+        rng = self.rng("favorites")
+        weights = zipf_weights(self.ads, FAVORITE_SKEW)
+        per_customer = FAVORITES_PER_AD / CUSTOMERS_PER_AD
+
+        def favorites():
+            for i in range(self.customers):
+                count = min(self.ads, rounded(rng, rng.expovariate(1 / per_customer)))
+                ads = rng.choices(range(self.ads), cum_weights=weights, k=count)
+                for ad in sorted(set(ads)):
+                    yield self.first_customer + i, self.first["ads"] + ad
+
+        self.load(cursor, "customer_favorites", ["customer", "ad"], favorites())
+
+        rng = self.rng("reviews")
+        weights = zipf_weights(self.realtors, REALTOR_SKEW)
+        per_customer = REVIEWS_PER_AD / CUSTOMERS_PER_AD
+
+        def reviews():
+            id = self.first["realtor_reviews"]
+            for i in range(self.customers):
+                count = min(
+                    self.realtors, rounded(rng, rng.expovariate(1 / per_customer))
+                )
+                realtors = rng.choices(
+                    range(self.realtors), cum_weights=weights, k=count
+                )
+                for realtor in sorted(set(realtors)):
+                    yield (
+                        id,
+                        self.first_customer + i,
+                        self.first_realtor + realtor,
+                        rng.choices(range(1, 6), weights=(5, 5, 15, 35, 40))[0],
+                        rng.choice(COMMENTS),
+                    )
+                    id += 1
+
+        self.load(
+            cursor,
+            "realtor_reviews",
+            ["id", "originator", "realtor", "score", "comment"],
+            reviews(),
+        )
+
+    def finish(self, cursor):
+        """Moves the sequences past the generated ids and fills what triggers and db.py maintain"""
+        start = time.perf_counter()
+        for table in SERIAL_TABLES:
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), max(id)) FROM {table};"
+            )
+        cursor.execute(
+            """UPDATE ads SET favorite_count = f.n
+            FROM (SELECT ad, count(*) AS n FROM customer_favorites WHERE ad >= %s GROUP BY ad) f
+            WHERE ads.id = f.ad;""",
+            (self.first["ads"],),
+        )
+        cursor.execute(
+            """INSERT INTO realtor_stats (realtor, review_count, score_sum, histogram)
+            SELECT realtor, sum(n), sum(score * n), jsonb_object_agg(score::text, n)
+            FROM (
+                SELECT realtor, score, count(*) AS n FROM realtor_reviews
+                WHERE realtor >= %s AND score IS NOT NULL
+                GROUP BY realtor, score
+            ) per_score
+            GROUP BY realtor;""",
+            (self.first_realtor,),
+        )
+        cursor.execute(
+            """INSERT INTO municipal_stats_dirty (municipal, month)
+            SELECT DISTINCT re.municipal, date_trunc('month', a.publish_date)::date
+            FROM ads a
+            JOIN ads_real_estates ar ON ar.ad = a.id
+            JOIN real_estates re ON re.id = ar.real_estate
+            WHERE a.id >= %s
+            ON CONFLICT (municipal, month) DO UPDATE SET marked_at = now();""",
+            (self.first["ads"],),
+        )
+        self.log(
+            f"sequences, favorite counts, realtor stats: {time.perf_counter() - start:.1f}s"
+        )
+
+
+def generate(con, ads, seed=1, log=print):
+    """
+    Adds a synthetic dataset of `ads` ads (and the real estates, images, users,
+    favorites and reviews that go with them) to the database, in one transaction
+    """
+    start = time.perf_counter()
+    Generator(con, ads, seed, log).run()
+    log(f"done in {time.perf_counter() - start:.1f}s")
@@ -1,7 +1,12 @@
+import base64
+import json
+from datetime import datetime
+
+import cache
+import prepared
 import psycopg2
-from fastapi import FastAPI, HTTPException
-from psycopg2 import errors, sql
-from psycopg2.extras import RealDictCursor
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor, execute_values
 
 """
 This file is responsible for making database queries, which your fastapi endpoints/routes can use.
@@ -19,15 +24,331 @@ start with a connection parameter.
 - E.g, if you decide to use psycopg3, you'd be able to directly use pydantic models with the cursor, these examples are however using psycopg2 and RealDictCursor
 """
 
+# Queries and query builders run by db_async.py (the endpoints) and the sync functions below
+USER_TYPE_QUERY = "SELECT * FROM user_types WHERE type = %s;"
+
+# An ad's version covers the users it shows the names of, so renaming them changes its ETag
+AD_VERSION_COLUMNS = """concat_ws('.', ads.version, cust_users.version, realt_users.version) as version,
+                            greatest(ads.updated_at, cust_users.updated_at, realt_users.updated_at) as updated_at"""
+
+ALL_CUSTOMERS_SELECT = sql.SQL(
+    """select users.id, user_name, email,street, street_no, users.version, users.updated_at from users
+                            join customer_profiles on users.id=customer_profiles.id
+                            join adresses on customer_profiles.adress=adresses.id"""
+)
+
+CUSTOMER_QUERY = """select users.id, user_name, email,street, street_no, users.version, users.updated_at from users
+                            join customer_profiles on users.id=customer_profiles.id
+                            join adresses on customer_profiles.adress=adresses.id
+                            where users.id=%s;"""
+
+AD_COLUMNS = f"""ads.id, agreement, cust_users.name as customer, publish_date, end_date, realt_users.name as realtor, description, price, sold_price, status,
+                            {AD_VERSION_COLUMNS}"""
+
+ADS_FROM = """from ads
+                            join users cust_users on ads.customer = cust_users.id
+                            join users realt_users on ads.realtor = realt_users.id"""
+
+ALL_ADS_SELECT = sql.SQL(f"select {AD_COLUMNS} {ADS_FROM}")
+
+# --- Favorites ---
+# ads.favorite_count (migrations/0007_ad_favorite_counts.sql) is changed in the same statement
+# that adds or removes the favorite, only if that actually changed a row, as an in-place
+# increment: concurrent favorites of one ad queue on its row lock instead of losing updates
+
+FAVORITE_ADS_SELECT = sql.SQL(f"""select {AD_COLUMNS} from customer_favorites
+                            join ads on ads.id = customer_favorites.ad
+                            join users cust_users on ads.customer = cust_users.id
+                            join users realt_users on ads.realtor = realt_users.id""")
+
+TRENDING_ADS_QUERY = f"""select {AD_COLUMNS}, ads.favorite_count {ADS_FROM}
+                            order by ads.favorite_count desc, ads.id desc limit %s;"""
+
+ADD_FAVORITE_QUERY = """WITH added AS (
+        INSERT INTO customer_favorites (customer, ad) VALUES (%s, %s) ON CONFLICT DO NOTHING RETURNING ad
+    )
+    UPDATE ads SET favorite_count = favorite_count + 1 FROM added WHERE ads.id = added.ad
+    RETURNING ads.favorite_count;"""
+
+REMOVE_FAVORITES_QUERY = """WITH removed AS (
+        DELETE FROM customer_favorites WHERE customer = %s AND (%s::int IS NULL OR ad = %s) RETURNING ad
+    )
+    UPDATE ads SET favorite_count = favorite_count - 1 FROM removed WHERE ads.id = removed.ad
+    RETURNING ads.id, ads.favorite_count;"""
+
+AD_FAVORITE_COUNT_QUERY = "SELECT favorite_count FROM ads WHERE id = %s;"
+
+AD_QUERY = f"""select ads.id, agreement, cust_users.name as customer, publish_date, end_date, realt_users.name as realtor, description, price, sold_price, status,
+                            {AD_VERSION_COLUMNS} from ads
+                            join users cust_users on ads.customer = cust_users.id
+                            join users realt_users on ads.realtor = realt_users.id where ads.id=%s;"""
+
+# The whole listing as one json document: the ad, its customer and realtor, every real
+# estate with its adress, house/apartment profile and images, and the images picked for
+# the ad. Lateral subqueries aggregate each one-to-many relation, so it takes one round trip
+AD_FULL_QUERY = """select json_build_object(
+        'id', ads.id, 'agreement', ads.agreement, 'publish_date', ads.publish_date, 'end_date', ads.end_date,
+        'description', ads.description, 'price', ads.price, 'sold_price', ads.sold_price, 'status', ads.status,
+        'customer', case when cust_users.id is not null then
+            json_build_object('id', cust_users.id, 'name', cust_users.name, 'email', cust_users.email) end,
+        'realtor', case when realt_users.id is not null then
+            json_build_object('id', realt_users.id, 'name', realt_users.name, 'email', realt_users.email, 'agency', broker_agencies.name) end,
+        'real_estates', coalesce(estates.items, '[]'),
+        'images', coalesce(images.items, '[]')
+    ) as ad
+    from ads
+    left join users cust_users on ads.customer = cust_users.id
+    left join users realt_users on ads.realtor = realt_users.id
+    left join realtor_profiles on realtor_profiles.id = ads.realtor
+    left join broker_agencies on broker_agencies.id = realtor_profiles.agency
+    cross join lateral (
+        select json_agg(json_build_object(
+            'id', real_estates.id, 'real_estate_type', real_estate_types.type, 'municipal', municipals.municipal,
+            'living_space', real_estates.living_space, 'no_of_rooms', real_estates.no_of_rooms,
+            'adress', case when adresses.id is not null then json_build_object(
+                'street', adresses.street, 'street_no', adresses.street_no,
+                'postal_code', adresses.postal_code, 'postal_area', adresses.postal_area) end,
+            'house', case when house_profiles.id is not null then
+                json_build_object('building_plot', house_profiles.building_plot) end,
+            'apartment', case when apartment_profiles.id is not null then
+                json_build_object('apartment_id', apartment_profiles.apartment_id, 'floor', apartment_profiles.floor) end,
+            'images', coalesce((
+                select json_agg(json_build_object('id', real_estate_images.id, 'picture_link', real_estate_images.picture_link)
+                                order by real_estate_images.id)
+                from real_estate_images where real_estate_images.real_estate = real_estates.id), '[]')
+        ) order by real_estates.id) as items
+        from ads_real_estates
+        join real_estates on real_estates.id = ads_real_estates.real_estate
+        left join real_estate_types on real_estate_types.id = real_estates.real_estate_type
+        left join municipals on municipals.id = real_estates.municipal
+        left join adresses on adresses.id = real_estates.adress
+        left join house_profiles on house_profiles.id = real_estates.id
+        left join apartment_profiles on apartment_profiles.id = real_estates.id
+        where ads_real_estates.ad = ads.id
+    ) estates
+    cross join lateral (
+        select json_agg(json_build_object('id', real_estate_images.id, 'picture_link', real_estate_images.picture_link)
+                        order by real_estate_images.id) as items
+        from ad_images
+        join real_estate_images on real_estate_images.id = ad_images.picture
+        where ad_images.ad = ads.id
+    ) images
+    where ads.id = %s;"""
+
+# Relations a page of ads can include (GET /ads/?include=images,real_estates). Each one is
+# fetched for the whole page with one query and stitched onto the ads by include_related(),
+# so a page costs 1 + (number of included relations) queries whatever its size
+AD_RELATED_QUERIES = {
+    "images": """select ad_images.ad, real_estate_images.id, real_estate_images.picture_link from ad_images
+                            join real_estate_images on real_estate_images.id = ad_images.picture
+                            where ad_images.ad = any(%s)
+                            order by ad_images.ad, real_estate_images.id;""",
+    "real_estates": """select ads_real_estates.ad, real_estates.id, real_estate_types.type as real_estate_type,
+                            municipals.municipal, real_estates.living_space, real_estates.no_of_rooms from ads_real_estates
+                            join real_estates on real_estates.id = ads_real_estates.real_estate
+                            left join real_estate_types on real_estate_types.id = real_estates.real_estate_type
+                            left join municipals on municipals.id = real_estates.municipal
+                            where ads_real_estates.ad = any(%s)
+                            order by ads_real_estates.ad, real_estates.id;""",
+}
+
+
+def parse_names(value, allowed, what):
+    """'a, b,a' -> ["a", "b"], raises ValueError for names that aren't allowed"""
+    names = [name.strip() for name in (value or "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ValueError(
+            f"unknown {what} {', '.join(unknown)}, allowed are {', '.join(allowed)}"
+        )
+    return list(dict.fromkeys(names))
+
+
+def parse_include(include):
+    """'images,real_estates' -> ["images", "real_estates"], raises ValueError for unknown relations"""
+    return parse_names(include, AD_RELATED_QUERIES, "include")
+
+
+def include_related(ads, name, rows):
+    """Puts the related rows (with an `ad` column) in a list under `name` of their ad"""
+    by_ad = {}
+    for row in rows:
+        by_ad.setdefault(row.pop("ad"), []).append(row)
+    for ad in ads:
+        ad[name] = by_ad.get(ad["id"], [])
+    return ads
+
+
+# Version probes for conditional GETs: the same rows as the queries above, but only
+# what an ETag is computed from (plus the sort keys a page cursor needs)
+ALL_CUSTOMERS_VERSIONS_SELECT = sql.SQL(
+    """select users.id, users.version, users.updated_at from users
+                            join customer_profiles on users.id=customer_profiles.id
+                            join adresses on customer_profiles.adress=adresses.id"""
+)
+
+CUSTOMER_VERSION_QUERY = """select users.version, users.updated_at from users
+                            join customer_profiles on users.id=customer_profiles.id
+                            where users.id=%s;"""
+
+ALL_ADS_VERSIONS_SELECT = sql.SQL(
+    f"""select ads.id, ads.publish_date, ads.price, {AD_VERSION_COLUMNS} from ads
+                            join users cust_users on ads.customer = cust_users.id
+                            join users realt_users on ads.realtor = realt_users.id"""
+)
+
+AD_VERSION_QUERY = f"""select {AD_VERSION_COLUMNS} from ads
+                            join users cust_users on ads.customer = cust_users.id
+                            join users realt_users on ads.realtor = realt_users.id where ads.id=%s;"""
+
+ALL_REALTOR_REVIEWS_SELECT = sql.SQL(
+    """select realtor_reviews.id, cust_users.name as customer, realt_users.name as realtor, score, comment from realtor_reviews
+                            join users cust_users on realtor_reviews.originator = cust_users.id
+                            join users realt_users on realtor_reviews.realtor = realt_users.id"""
+)
+
+INSERT_AD_QUERY = "INSERT INTO ads (agreement, customer, publish_date, end_date, realtor, description, price, sold_price, status) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s) RETURNING id;"
+INSERT_USER_QUERY = "INSERT INTO users (type, user_name, user_psw, email) VALUES (%s,%s,%s,%s) RETURNING id;"
+INSERT_CUSTOMER_PROFILE_QUERY = (
+    "INSERT INTO customer_profiles (id,adress) VALUES (%s,%s) RETURNING id;"
+)
+INSERT_REALTOR_PROFILE_QUERY = (
+    "INSERT INTO realtor_profiles (id,agency) VALUES (%s,%s) RETURNING id;"
+)
+INSERT_REAL_ESTATE_QUERY = "INSERT INTO real_estates (real_estate_type, municipal, adress, living_space, no_of_rooms) VALUES (%s,%s,%s,%s,%s) RETURNING id;"
+INSERT_REALTOR_REVIEW_QUERY = "INSERT INTO realtor_reviews (originator, realtor, score, comment) VALUES (%s,%s,%s,%s) RETURNING id;"
+
+DELETE_USER_QUERY = "DELETE FROM users WHERE id = %s RETURNING id;"
+DELETE_CUSTOMER_PROFILE_QUERY = (
+    "DELETE FROM customer_profiles WHERE id = %s RETURNING id;"
+)
+DELETE_REALTOR_PROFILE_QUERY = (
+    "DELETE FROM realtor_profiles WHERE id = %s RETURNING id;"
+)
+DELETE_REALTOR_REVIEW_QUERY = (
+    "DELETE FROM realtor_reviews WHERE id = %s RETURNING id, realtor, score;"
+)
+DELETE_REAL_ESTATE_QUERY = "DELETE FROM real_estates WHERE id = %s RETURNING id;"
+DELETE_AD_QUERY = "DELETE FROM ads WHERE id = %s RETURNING id;"
+
+UPDATE_USER_QUERY = "UPDATE users SET type=%s, user_name=%s, user_psw=%s, email=%s, name=%s, version=version + 1, updated_at=now() WHERE id=%s RETURNING *;"
+# the review as it was, locked until the stats are adjusted
+REALTOR_REVIEW_FOR_UPDATE_QUERY = (
+    "SELECT realtor, score FROM realtor_reviews WHERE id=%s FOR UPDATE;"
+)
+UPDATE_REALTOR_REVIEW_QUERY = "UPDATE realtor_reviews SET originator=%s, realtor=%s, score=%s, comment=%s WHERE id=%s RETURNING *;"
+UPDATE_REAL_ESTATE_QUERY = "UPDATE real_estates SET real_estate_type=%s, municipal=%s, adress=%s, living_space=%s, no_of_rooms=%s, version=version + 1, updated_at=now() WHERE id=%s RETURNING *;"
+UPDATE_AD_QUERY = "UPDATE ads SET agreement=%s, customer=%s, publish_date=%s, end_date=%s, realtor=%s, description=%s, price=%s, sold_price=%s, status=%s, version=version + 1, updated_at=now() WHERE id=%s RETURNING *;"
+
+
+def ad_params(ad_input):
+    """The ad columns of an AdCreate/AdUpdate in the order used by the queries"""
+    return (
+        ad_input.agreement,
+        ad_input.customer,
+        ad_input.publish_date,
+        ad_input.end_date,
+        ad_input.realtor,
+        ad_input.description,
+        ad_input.price,
+        ad_input.sold_price,
+        ad_input.status,
+    )
+
+
+def real_estate_params(real_estate_input):
+    """The real estate columns of a RealestateCreate/RealestateUpdate in the order used by the queries"""
+    return (
+        real_estate_input.real_estate_type,
+        real_estate_input.municipal,
+        real_estate_input.adress,
+        real_estate_input.living_space,
+        real_estate_input.no_of_rooms,
+    )
+
+
+# Multi-row writes used by the batch endpoints. The templates cast every column,
+# so a column that is NULL in every row of a VALUES list still gets the right type
+AD_VALUES_TEMPLATE = "(%s, %s::int, %s::timestamptz, %s::timestamptz, %s::int, %s, %s::float, %s::float, %s)"
+REAL_ESTATE_VALUES_TEMPLATE = "(%s::int, %s::int, %s::int, %s::int, %s::int)"
+
+# the inserts take their ids from NEXT_IDS_QUERY, so the outcome of every row can be
+# matched to it by id like for the updates (RETURNING doesn't guarantee any row order)
+NEXT_IDS_QUERY = "SELECT nextval(pg_get_serial_sequence(%s, 'id')) AS id FROM generate_series(1, %s);"
+
+BATCH_INSERT_ADS_QUERY = "INSERT INTO ads (id, agreement, customer, publish_date, end_date, realtor, description, price, sold_price, status) VALUES %s RETURNING id;"
+BATCH_UPDATE_ADS_QUERY = """UPDATE ads SET agreement = v.agreement, customer = v.customer, publish_date = v.publish_date,
+                            end_date = v.end_date, realtor = v.realtor, description = v.description,
+                            price = v.price, sold_price = v.sold_price, status = v.status,
+                            version = ads.version + 1, updated_at = now()
+                            FROM (VALUES %s) AS v(id, agreement, customer, publish_date, end_date, realtor, description, price, sold_price, status)
+                            WHERE ads.id = v.id RETURNING ads.id;"""
+
+BATCH_INSERT_REAL_ESTATES_QUERY = "INSERT INTO real_estates (id, real_estate_type, municipal, adress, living_space, no_of_rooms) VALUES %s RETURNING id;"
+BATCH_UPDATE_REAL_ESTATES_QUERY = """UPDATE real_estates SET real_estate_type = v.real_estate_type, municipal = v.municipal,
+                            adress = v.adress, living_space = v.living_space, no_of_rooms = v.no_of_rooms,
+                            version = real_estates.version + 1, updated_at = now()
+                            FROM (VALUES %s) AS v(id, real_estate_type, municipal, adress, living_space, no_of_rooms)
+                            WHERE real_estates.id = v.id RETURNING real_estates.id;"""
+
+
+# --- Realtor ratings ---
+# realtor_stats (migrations/0004_realtor_stats.sql) holds the review count, score sum and
+# score histogram of every realtor, adjusted by the review functions of db_async.py in the
+# same transaction as the review itself, so reading a realtor's rating never scans realtor_reviews.
+
+APPLY_REVIEW_TO_STATS_QUERY = """
+    INSERT INTO realtor_stats AS s (realtor, review_count, score_sum, histogram)
+    VALUES (%(realtor)s, %(delta)s, %(delta)s * %(score)s, jsonb_build_object(%(score)s::text, %(delta)s))
+    ON CONFLICT (realtor) DO UPDATE SET
+        review_count = s.review_count + %(delta)s,
+        score_sum = s.score_sum + %(delta)s * %(score)s,
+        histogram = CASE
+            WHEN coalesce((s.histogram ->> %(score)s::text)::int, 0) + %(delta)s = 0
+            THEN s.histogram - %(score)s::text
+            ELSE s.histogram || jsonb_build_object(
+                %(score)s::text, coalesce((s.histogram ->> %(score)s::text)::int, 0) + %(delta)s)
+        END;
+"""
+
+REALTOR_STATS_QUERY = """select realtor_profiles.id as realtor, coalesce(review_count, 0) as review_count,
+                            coalesce(score_sum, 0) as score_sum, avg_score, coalesce(histogram, '{}') as histogram
+                            from realtor_profiles
+                            left join realtor_stats on realtor_stats.realtor = realtor_profiles.id
+                            where realtor_profiles.id = %s;"""
+
+TOP_REALTORS_QUERY = """select realtor_stats.realtor, users.name, review_count, score_sum, avg_score, histogram from realtor_stats
+                            join users on users.id = realtor_stats.realtor
+                            where review_count >= %s
+                            order by avg_score desc nulls last, review_count desc, realtor_stats.realtor
+                            limit %s;"""
+
+
+# filled by market_stats.refresh_market_stats(), newest month first
+MUNICIPAL_STATS_QUERY = """select month, listings, sold, median_price, median_sold_price, median_sold_to_asking, refreshed_at
+                            from municipal_month_stats
+                            where municipal = %s and month >= date_trunc('month', now()) - make_interval(months => %s)
+                            order by month desc;"""
 
-def get_user_type_id(con, type):
+
+NOTIFY_INVALIDATED_QUERY = "SELECT pg_notify(%s, entity) FROM unnest(%s) AS entity;"
+
+
+def invalidate_cached_db(con, *entities):
+    """
+    Drops changed entities ("ad:12", "ad:*" for all ads) from the entity cache of
+    this worker and notifies the other workers. Called once the change is committed
+    """
+    for entity in entities:
+        kind, _, key = entity.partition(":")
+        cache.invalidate(kind, key)
     with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM user_types WHERE type = %s;", (type,))
-            items = cursor.fetchone()
-            print(items)
-            user_type_id = items["id"]
-    return user_type_id
+        with con.cursor() as cursor:
+            cursor.execute(NOTIFY_INVALIDATED_QUERY, (cache.CHANNEL, list(entities)))
+
+
+# tables with a version/updated_at column (migrations/0003_row_versions.sql), every UPDATE bumps them
+VERSIONED_TABLES = ("users", "ads", "real_estates")
 
 
 def build_partial_update_query(update_data: dict, table: str, pk: str = "id"):
@@ -43,6 +364,9 @@ def build_partial_update_query(update_data: dict, table: str, pk: str = "id"):
     if not set_clauses:
         return None, None
 
+    if table in VERSIONED_TABLES:
+        set_clauses.append(sql.SQL("version = version + 1, updated_at = now()"))
+
     # Build UPDATE with RETURNING
     query = sql.SQL("""
         UPDATE {table}
@@ -59,479 +383,498 @@ def build_partial_update_query(update_data: dict, table: str, pk: str = "id"):
     return query, params
 
 
-def get_all_customers_db(con, limit):
-    type = get_user_type_id(con, "Kund")
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            # cursor.execute("SELECT user_name, user_psw, email FROM users WHERE type = %s LIMIT %s;", (type,limit))
-            cursor.execute(
-                """select user_name, user_psw, email,street, street_no from users
-                            join customer_profiles on users.id=customer_profiles.id
-                            join adresses on customer_profiles.adress=adresses.id
-                            where type=%s LIMIT %s;""",
-                (type, limit),
-            )
-            items = cursor.fetchall()
-    return items
+# --- Sparse fieldsets ---
+# The list endpoints take fields=id,price,... to select only those columns. Every field
+# maps to its expression and the joins it needs, and joins no requested field needs are
+# left out. A left out inner join is replaced by a NOT NULL check on its foreign key, so
+# a page has the same rows whatever the fields (the key is a foreign key, so a non-NULL
+# one always finds its row). user_psw is never selectable.
+
+AD_FIELDS = {
+    "id": ("ads.id", ()),
+    "agreement": ("ads.agreement", ()),
+    "customer": ("cust_users.name", ("cust_users",)),
+    "publish_date": ("ads.publish_date", ()),
+    "end_date": ("ads.end_date", ()),
+    "realtor": ("realt_users.name", ("realt_users",)),
+    "description": ("ads.description", ()),
+    "price": ("ads.price", ()),
+    "sold_price": ("ads.sold_price", ()),
+    "status": ("ads.status", ()),
+    "version": (
+        "concat_ws('.', ads.version, cust_users.version, realt_users.version)",
+        ("cust_users", "realt_users"),
+    ),
+    "updated_at": (
+        "greatest(ads.updated_at, cust_users.updated_at, realt_users.updated_at)",
+        ("cust_users", "realt_users"),
+    ),
+}
+
+AD_JOINS = {
+    "cust_users": (
+        "join users cust_users on ads.customer = cust_users.id",
+        "ads.customer is not null",
+    ),
+    "realt_users": (
+        "join users realt_users on ads.realtor = realt_users.id",
+        "ads.realtor is not null",
+    ),
+}
+
+CUSTOMER_FIELDS = {
+    "id": ("users.id", ()),
+    "user_name": ("users.user_name", ()),
+    "name": ("users.name", ()),
+    "email": ("users.email", ()),
+    "street": ("adresses.street", ("adresses",)),
+    "street_no": ("adresses.street_no", ("adresses",)),
+    "version": ("users.version", ()),
+    "updated_at": ("users.updated_at", ()),
+}
+
+CUSTOMER_JOINS = {
+    "adresses": (
+        "join adresses on customer_profiles.adress=adresses.id",
+        "customer_profiles.adress is not null",
+    ),
+}
+
+
+def build_projection(fields, columns, joins, base, always=("id",)):
+    """
+    The select of `fields` (plus the `always` ones, e.g. what a page cursor needs) from
+    `base` with only the joins they need, and the filters standing in for the other joins.
+    Returns (select, filters) for build_page_query
+    """
+    names = list(dict.fromkeys([*always, *fields]))
+    needed = {join for name in names for join in columns[name][1]}
+    select = sql.SQL("select {} {} {}").format(
+        sql.SQL(", ").join(
+            sql.SQL("{} as {}").format(sql.SQL(columns[name][0]), sql.Identifier(name))
+            for name in names
+        ),
+        sql.SQL(base),
+        sql.SQL(" ").join(
+            sql.SQL(join) for name, (join, _) in joins.items() if name in needed
+        ),
+    )
+    filters = [
+        (sql.SQL(not_null), ())
+        for name, (_, not_null) in joins.items()
+        if name not in needed
+    ]
+    return select, filters
+
+
+def ad_list_select(fields, sort="id"):
+    """(select, filters) of the ad list for a fields= value, the default columns without one"""
+    fields = parse_names(fields, AD_FIELDS, "field")
+    if not fields:
+        return ALL_ADS_SELECT, []
+    column, _ = parse_sort(sort, AD_SORT_COLUMNS)
+    return build_projection(fields, AD_FIELDS, AD_JOINS, "from ads", ("id", column))
+
+
+def customer_list_select(fields):
+    """(select, filters) of the customer list for a fields= value, the default columns without one"""
+    fields = parse_names(fields, CUSTOMER_FIELDS, "field")
+    if not fields:
+        return ALL_CUSTOMERS_SELECT, []
+    return build_projection(
+        fields,
+        CUSTOMER_FIELDS,
+        CUSTOMER_JOINS,
+        "from users join customer_profiles on users.id=customer_profiles.id",
+    )
 
 
-def get_customer_db(con, customer_id):
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    """select user_name, user_psw, email,street, street_no from users
-                            join customer_profiles on users.id=customer_profiles.id
-                            join adresses on customer_profiles.adress=adresses.id
-                            where users.id=%s;""",
-                    (customer_id),
-                )
-                items = cursor.fetchall()
-            except Exception:
-                raise ValueError("Customer ID not valid")
-    return items
+def project(row, fields):
+    """Only the `fields` of a row, e.g. of a cached ad. All of them without fields"""
+    if not fields:
+        return row
+    return {name: row[name] for name in fields if name in row}
 
 
-def get_all_ads_db(con, limit):
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            # cursor.execute("SELECT * FROM ads LIMIT %s;", (limit,))
-            cursor.execute(
-                """select agreement, cust_users.name as customer, publish_date, end_date, realt_users.name as realtor, description, price, sold_price, status from ads
-                            join users cust_users on ads.customer = cust_users.id
-                            join users realt_users on ads.realtor = realt_users.id LIMIT %s;""",
-                (limit,),
-            )
-            items = cursor.fetchall()
-    return items
+# --- Keyset pagination ---
+# Pages are fetched with WHERE (sort_key, id) > (last sort_key, last id) instead of OFFSET,
+# so with an index on (sort_key, id) every page costs the same no matter how deep it is.
+# The cursor handed to clients is an opaque token of [sort, last sort_key, last id].
 
+AD_SORT_COLUMNS = ("id", "publish_date", "price")
+# sort keys a cursor may carry NULL for (the others are NOT NULL or computed)
+NULLABLE_SORT_COLUMNS = ("publish_date", "price")
 
-def get_ad_db(con, ad_id):
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    """select agreement, cust_users.name as customer, publish_date, end_date, realt_users.name as realtor, description, price, sold_price, status from ads
-                            join users cust_users on ads.customer = cust_users.id
-                            join users realt_users on ads.realtor = realt_users.id where ads.id=%s;""",
-                    (ad_id,),
-                )
-                items = cursor.fetchall()
-            except Exception:
-                raise ValueError("Customer ID not valid")
-    return items
 
+def encode_cursor(sort, row):
+    """Build the cursor pointing after `row` for the given sort"""
+    column = sort.lstrip("-")
+    payload = json.dumps([sort, row[column], row["id"]], default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
 
-def get_all_realtor_reviews_db(con, limit):
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """select cust_users.name as customer, realt_users.name as realtor, score, comment from realtor_reviews
-                            join users cust_users on realtor_reviews.originator = cust_users.id
-                            join users realt_users on realtor_reviews.realtor = realt_users.id LIMIT %s;""",
-                (limit,),
-            )
-            items = cursor.fetchall()
-    return items
 
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
 
-def add_customer_db(con, user_input):
-    type = get_user_type_id(con, "Mäklare")
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "INSERT INTO users (type, user_name, user_psw, email) VALUES (%s,%s,%s,%s) RETURNING id;",
-                    (type, user_input.username, user_input.password, user_input.email),
-                )
-                inserted = cursor.fetchone()
-                id = inserted["id"]
-                cursor.execute(
-                    "INSERT INTO customer_profiles (id,adress) VALUES (%s,%s) RETURNING id;",
-                    (id, user_input.adress),
-                )
-            except psycopg2.errors.UniqueViolation:
-                raise psycopg2.errors.UniqueViolation("Unique error")
-            except psycopg2.errors.ForeignKeyViolation:
-                raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
-            except Exception:
-                raise ValueError("DB error")
-    return inserted
 
+def decode_sort_key(column, value):
+    """
+    The sort key of a cursor as the type of its column, raises ValueError if it can't be
+    one (a tampered cursor), so it never reaches the query as a 500
+    """
+    if value is None:
+        if column not in NULLABLE_SORT_COLUMNS:
+            raise ValueError("invalid cursor")
+        return None
+    if column == "id":
+        if not is_id(value):
+            raise ValueError("invalid cursor")
+        return value
+    if column == "publish_date":
+        try:
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError("invalid cursor")
+    # price and the search rank
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("invalid cursor")
+    return value
+
+
+def decode_cursor(cursor, sort):
+    """Returns (last sort_key, last id) of a cursor, raises ValueError if it is invalid"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("cursor does not belong to this sort order")
+    if not is_id(last_id):
+        raise ValueError("invalid cursor")
+    return decode_sort_key(sort.lstrip("-"), value), last_id
+
+
+def parse_sort(sort, allowed):
+    """'price' sorts ascending, '-price' descending. Returns (column, descending)"""
+    column = sort.lstrip("-")
+    if column not in allowed:
+        raise ValueError(f"can only sort by {', '.join(allowed)}")
+    return column, sort.startswith("-")
+
+
+def build_keyset_query(
+    select, table, column, descending, limit, after=None, filters=(), keys=None
+):
+    """
+    Builds the query for one page of `select` ordered by (column, id).
+    `after` is the (sort_key, id) of the last row of the previous page and
+    `filters` a list of (condition, params) that always apply.
+    `keys` maps sort columns that aren't columns of `table` to the expression they are
+    computed by (the select has to return them under the same name).
+    NULL sort keys come last in ascending and first in descending order, like
+    postgres (and the indexes) order them, so they are fetched by a separate
+    branch instead of an OR that would make the index unusable.
+    """
+    filters = list(filters)
+    key = (keys or {}).get(column) or sql.Identifier(table, column)
+    id_col = sql.Identifier(table, "id")
+    direction = sql.SQL("DESC" if descending else "ASC")
+    nulls = sql.SQL("NULLS FIRST" if descending else "NULLS LAST")
+    compare = sql.SQL("<" if descending else ">")
+
+    def part(conditions, order_by):
+        conditions = filters + conditions
+        query = select
+        if conditions:
+            query = sql.SQL("{} where {}").format(
+                query, sql.SQL(" and ").join(c for c, _ in conditions)
+            )
+        query = sql.SQL("{} order by {} limit %s").format(
+            query, sql.SQL(", ").join(order_by)
+        )
+        return query, [p for _, params in conditions for p in params] + [limit]
+
+    by_id = sql.SQL("{} {}").format(id_col, direction)
+    if column == "id":
+        conditions = []
+        if after is not None:
+            conditions.append(
+                (sql.SQL("{} {} %s").format(id_col, compare), (after[1],))
+            )
+        return part(conditions, [by_id])
 
-def add_realtor_db(con, user_input):
-    type = get_user_type_id(con, "Mäklare")
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "INSERT INTO users (type, user_name, user_psw, email) VALUES (%s,%s,%s,%s) RETURNING id;",
-                    (type, user_input.username, user_input.password, user_input.email),
-                )
-                inserted = cursor.fetchone()
-                id = inserted["id"]
-                cursor.execute(
-                    "INSERT INTO realtor_profiles (id,agency) VALUES (%s,%s) RETURNING id;",
-                    (id, user_input.agency),
-                )
-            except psycopg2.errors.UniqueViolation:
-                raise psycopg2.errors.UniqueViolation("Unique error")
-            except psycopg2.errors.ForeignKeyViolation:
-                raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
-            except Exception:
-                raise ValueError("DB error")
-    return inserted
+    by_key = sql.SQL("{} {} {}").format(key, direction, nulls)
+    if after is None:
+        return part([], [by_key, by_id])
 
+    value, last_id = after
+    after_key = (
+        sql.SQL("({}, {}) {} (%s, %s)").format(key, id_col, compare),
+        (value, last_id),
+    )
+    null_key = (sql.SQL("{} is null").format(key), ())
+    null_key_after_id = (
+        sql.SQL("{} is null and {} {} %s").format(key, id_col, compare),
+        (last_id,),
+    )
+    not_null_key = (sql.SQL("{} is not null").format(key), ())
+
+    if value is None and not descending:
+        # already among the trailing NULLs
+        return part([null_key_after_id], [by_id])
+    if value is not None and descending:
+        # the leading NULLs have all been returned
+        return part([after_key], [by_key, by_id])
+
+    if value is not None:
+        # rest of the non-NULL keys, then the NULLs
+        first = part([after_key], [by_key, by_id])
+        second = part([null_key], [by_id])
+    else:
+        # rest of the leading NULLs, then the non-NULL keys
+        first = part([null_key_after_id], [by_id])
+        second = part([not_null_key], [by_key, by_id])
+    query = sql.SQL(
+        "select * from (({}) union all ({})) page order by page.{} {} {}, page.id {} limit %s"
+    ).format(first[0], second[0], sql.Identifier(column), direction, nulls, direction)
+    return query, first[1] + second[1] + [limit]
+
+
+def build_page_query(
+    select,
+    table,
+    limit,
+    sort="id",
+    cursor=None,
+    allowed=("id",),
+    filters=(),
+    keys=None,
+):
+    """Query (and params) for a page of `limit` rows, one extra row is fetched to detect a next page"""
+    column, descending = parse_sort(sort, allowed)
+    after = decode_cursor(cursor, sort) if cursor else None
+    return build_keyset_query(
+        select, table, column, descending, limit + 1, after, filters, keys
+    )
 
-def add_real_estate_db(con, user_input):
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "INSERT INTO real_estates (real_estate_type, municipal, adress, living_space, no_of_rooms) VALUES (%s,%s,%s,%s,%s) RETURNING id;",
-                    (
-                        user_input.real_estate_type,
-                        user_input.municipal,
-                        user_input.adress,
-                        user_input.living_space,
-                        user_input.no_of_rooms,
-                    ),
-                )
-                inserted = cursor.fetchone()
-            except psycopg2.errors.UniqueViolation:
-                raise psycopg2.errors.UniqueViolation("Unique error")
-            except psycopg2.errors.ForeignKeyViolation:
-                raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
-            except Exception:
-                raise ValueError("DB error")
-    return inserted
 
+def split_page(rows, limit, sort="id"):
+    """Returns (rows of the page, cursor of the next page or None)"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(sort, rows[-1])
+
+
+# --- Ad search ---
+# Filters on ads are applied directly, filters on the real estate go into an EXISTS
+# subquery that is only added when one of them is used, so a search on price or status
+# never touches ads_real_estates/real_estates (and no ad is returned twice).
+
+AD_SEARCH_FILTERS = {
+    "q": "ads.description_tsv @@ websearch_to_tsquery('swedish', %s)",
+    "status": "ads.status = %s",
+    "min_price": "ads.price >= %s",
+    "max_price": "ads.price <= %s",
+}
+
+REAL_ESTATE_SEARCH_FILTERS = {
+    "municipal": "real_estates.municipal = %s",
+    "real_estate_type": "real_estates.real_estate_type = %s",
+    "min_rooms": "real_estates.no_of_rooms >= %s",
+    "max_rooms": "real_estates.no_of_rooms <= %s",
+    "min_living_space": "real_estates.living_space >= %s",
+    "max_living_space": "real_estates.living_space <= %s",
+}
+
+
+def build_ad_search_filters(search):
+    """Turns an AdSearch into a list of (condition, params) for build_page_query"""
+    criteria = search.model_dump(exclude_none=True)
+    filters = [
+        (sql.SQL(condition), (criteria[name],))
+        for name, condition in AD_SEARCH_FILTERS.items()
+        if name in criteria
+    ]
+    estate_filters = [
+        (sql.SQL(condition), criteria[name])
+        for name, condition in REAL_ESTATE_SEARCH_FILTERS.items()
+        if name in criteria
+    ]
+    if estate_filters:
+        filters.append(
+            (
+                sql.SQL("""exists (select 1 from ads_real_estates
+                            join real_estates on real_estates.id = ads_real_estates.real_estate
+                            where ads_real_estates.ad = ads.id and {})""").format(
+                    sql.SQL(" and ").join(c for c, _ in estate_filters)
+                ),
+                tuple(value for _, value in estate_filters),
+            )
+        )
+    return filters
 
-def add_realtor_review_db(con, user_input):
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "INSERT INTO realtor_reviews (originator, realtor, score, comment) VALUES (%s,%s,%s,%s) RETURNING id;",
-                    (
-                        user_input.originator,
-                        user_input.realtor,
-                        user_input.score,
-                        user_input.comment,
-                    ),
-                )
-                inserted = cursor.fetchone()
-            except psycopg2.errors.UniqueViolation:
-                raise psycopg2.errors.UniqueViolation("Unique error")
-            except psycopg2.errors.ForeignKeyViolation:
-                raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
-            except Exception:
-                raise ValueError("DB error")
-    return inserted
 
+# --- Full-text search ---
+# ads.description_tsv is the description as a swedish tsvector with a GIN index
+# (migrations/0005_ad_fulltext_search.sql). q is parsed by websearch_to_tsquery, so it
+# takes search engine syntax: balkong sjöutsikt, "öppen spis", balkong -garage, balkong or altan
 
-def add_ad_db(con, ad_input):
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "INSERT INTO ads (agreement, customer, publish_date, end_date, realtor, description, price, sold_price, status) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s) RETURNING id;",
-                    (
-                        ad_input.agreement,
-                        ad_input.customer,
-                        ad_input.publish_date,
-                        ad_input.end_date,
-                        ad_input.realtor,
-                        ad_input.description,
-                        ad_input.price,
-                        ad_input.sold_price,
-                        ad_input.status,
-                    ),
-                )
-                inserted = cursor.fetchone()
-            except psycopg2.errors.UniqueViolation:
-                raise psycopg2.errors.UniqueViolation("Unique error")
-            except psycopg2.errors.ForeignKeyViolation:
-                raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
-            except Exception:
-                raise ValueError("DB error")
-    return inserted
+TEXT_SEARCH_CONFIG = "swedish"
+HEADLINE_OPTIONS = "MaxFragments=2, MaxWords=20, MinWords=5, StartSel=<b>, StopSel=</b>"
 
 
-def delete_customer_db(con, customer_id: int):
-    """Delete a user by ID."""
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "DELETE FROM customer_favorites WHERE customer = %s RETURNING customer;",
-                    (customer_id,),
-                )
-                cursor.execute(
-                    "DELETE FROM customer_profiles WHERE id = %s RETURNING id;",
-                    (customer_id,),
-                )
-                cursor.execute(
-                    "DELETE FROM users WHERE id = %s RETURNING id;", (customer_id,)
-                )
-                result = cursor.fetchone()
-                if not result:
-                    raise ValueError("User not found")
-            except ValueError:
-                raise ValueError("User not found")
-    return
+def ad_search_sort(search):
+    """The sort of an AdSearch, searches on q are sorted by relevance unless told otherwise"""
+    return search.sort or ("-rank" if search.q else "id")
 
 
-def delete_realtor_db(con, realtor_id: int):
-    """Delete a realtor by ID."""
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "DELETE FROM realtor_profiles WHERE id = %s RETURNING id;",
-                    (realtor_id,),
-                )
-                cursor.execute(
-                    "DELETE FROM users WHERE id = %s RETURNING id;", (realtor_id,)
-                )
-                result = cursor.fetchone()
-                if not result:
-                    raise ValueError("User not found")
-            except ValueError:
-                raise ValueError("User not found")
-    return
+def build_ad_search_query(search, sort):
+    """
+    Query (and params) for a page of an AdSearch. With a q every ad gets a rank and a
+    headline (the matching parts of its description, matches wrapped in <b></b>)
+    and the ads can be sorted by rank
+    """
+    filters = build_ad_search_filters(search)
+    if not search.q:
+        return build_page_query(
+            ALL_ADS_SELECT,
+            "ads",
+            search.limit,
+            sort,
+            search.cursor,
+            allowed=AD_SORT_COLUMNS,
+            filters=filters,
+        )
+    # inlined, since the rank is also used in the keyset conditions which take no params.
+    # % would be taken for a placeholder, it isn't part of any word so it's dropped
+    tsquery = sql.SQL("websearch_to_tsquery({}, {})").format(
+        sql.Literal(TEXT_SEARCH_CONFIG), sql.Literal(search.q.replace("%", " "))
+    )
+    # float8, as a real wouldn't compare equal to itself once it went through a cursor
+    rank = sql.SQL("ts_rank(ads.description_tsv, {})::float8").format(tsquery)
+    select = sql.SQL(
+        "select {}, {} as rank, ts_headline({}, coalesce(description, ''), {}, {}) as headline {}"
+    ).format(
+        sql.SQL(AD_COLUMNS),
+        rank,
+        sql.Literal(TEXT_SEARCH_CONFIG),
+        tsquery,
+        sql.Literal(HEADLINE_OPTIONS),
+        sql.SQL(ADS_FROM),
+    )
+    return build_page_query(
+        select,
+        "ads",
+        search.limit,
+        sort,
+        search.cursor,
+        allowed=AD_SORT_COLUMNS + ("rank",),
+        filters=filters,
+        keys={"rank": rank},
+    )
 
 
-def delete_realtor_review_db(con, realtor_review_id: int):
-    """Delete a realtor by ID."""
+# the sync path of benchmarks/bench_async.py, the endpoints use db_async.get_ad_db()
+def get_ad_db(con, ad_id):
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
             try:
-                cursor.execute(
-                    "DELETE FROM realtor_reviews WHERE id = %s RETURNING id;",
-                    (realtor_review_id,),
-                )
-                result = cursor.fetchone()
-                if not result:
-                    raise ValueError("realtor review not found")
-            except ValueError:
-                raise ValueError("realtor review not found")
-    return
+                prepared.execute(cursor, AD_QUERY, (ad_id,))
+                items = cursor.fetchall()
+            except Exception:
+                raise ValueError("Ad ID not valid")
+    return items
 
 
-def delete_real_estate_db(con, real_estate_id: int):
-    """Delete a real estate by ID."""
+def write_batch_db(con, query, rows, template, new_ids_of=None):
+    """
+    Writes all rows with one multi-row statement in a single transaction.
+    Returns the outcome of every row, in order: {"id": ...} if it was written,
+    otherwise {"error": ...} (e.g. when an UPDATE matched no row).
+    If the statement fails on a constraint the rows are retried one by one, each
+    in a savepoint, so the valid rows are still written and the bad ones reported.
+    The first value of every row is its id, which the outcomes are matched by. For
+    inserts (new_ids_of, the table) the ids are taken from the table's sequence first.
+    """
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            if new_ids_of:
+                cursor.execute(NEXT_IDS_QUERY, (new_ids_of, len(rows)))
+                ids = [r["id"] for r in cursor.fetchall()]
+                rows = [(id, *row) for id, row in zip(ids, rows)]
+            cursor.execute("SAVEPOINT batch;")
             try:
-                cursor.execute(
-                    "DELETE FROM real_estates WHERE id = %s RETURNING id;",
-                    (real_estate_id,),
+                returned = execute_values(
+                    cursor, query, rows, template, page_size=len(rows), fetch=True
                 )
-                result = cursor.fetchone()
-                if not result:
-                    raise ValueError("Real estate not found")
-            except ValueError:
-                raise ValueError("Real estate not found")
-    return
+            except (psycopg2.IntegrityError, psycopg2.DataError):
+                cursor.execute("ROLLBACK TO SAVEPOINT batch;")
+            else:
+                written = {r["id"] for r in returned}
+                return [
+                    {"id": row[0]} if row[0] in written else {"error": "not found"}
+                    for row in rows
+                ]
+
+            outcomes = []
+            for row in rows:
+                cursor.execute("SAVEPOINT batch_row;")
+                try:
+                    returned = execute_values(
+                        cursor, query, [row], template, fetch=True
+                    )
+                    cursor.execute("RELEASE SAVEPOINT batch_row;")
+                    outcomes.append(
+                        {"id": returned[0]["id"]}
+                        if returned
+                        else {"error": "not found"}
+                    )
+                except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT batch_row;")
+                    outcomes.append({"error": e.diag.message_primary or str(e)})
+    return outcomes
+
+
+def add_ads_batch_db(con, ads):
+    return write_batch_db(
+        con,
+        BATCH_INSERT_ADS_QUERY,
+        [ad_params(ad) for ad in ads],
+        "(%s::int, " + AD_VALUES_TEMPLATE[1:],
+        new_ids_of="ads",
+    )
 
 
-def delete_ad_db(con, ad_id: int):
-    """Delete a user by ID."""
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute("DELETE FROM ads WHERE id = %s RETURNING id;", (ad_id,))
-                result = cursor.fetchone()
-                if not result:
-                    raise ValueError("Ad not found")
-            except ValueError:
-                raise ValueError("Ad not found")
-    return
+def update_ads_batch_db(con, ads):
+    outcomes = write_batch_db(
+        con,
+        BATCH_UPDATE_ADS_QUERY,
+        [(ad.id, *ad_params(ad)) for ad in ads],
+        "(%s::int, " + AD_VALUES_TEMPLATE[1:],
+    )
+    invalidate_cached_db(con, "ad:*")
+    return outcomes
 
 
-def update_customer_db(con, customer_id: int, customer_update):
-    """
-    updates a customer's data.
-    Returns the updated customer object.
-    """
-    type = get_user_type_id(con, "Kund")
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "UPDATE users SET type=%s, user_name=%s, user_psw=%s, email=%s, name=%s WHERE id=%s RETURNING *;",
-                    (
-                        type,
-                        customer_update.username,
-                        customer_update.password,
-                        customer_update.email,
-                        customer_update.name,
-                        customer_id,
-                    ),
-                )
-                row = cursor.fetchone()
-                if not row:
-                    raise ValueError("Customer not found")
-            except psycopg2.errors.ForeignKeyViolation:
-                raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
-            except psycopg2.errors.UniqueViolation:
-                raise psycopg2.errors.UniqueViolation("Unique error")
-            except ValueError:
-                raise ValueError("customer does not exist")
-    return row
-
-
-def update_realtor_db(con, realtor_id: int, realtor_update):
-    """
-    updates a realtor's data.
-    Returns the updated realtor object.
-    """
-    type = get_user_type_id(con, "Mäklare")
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "UPDATE users SET type=%s, user_name=%s, user_psw=%s, email=%s, name=%s WHERE id=%s RETURNING *;",
-                    (
-                        type,
-                        realtor_update.username,
-                        realtor_update.password,
-                        realtor_update.email,
-                        realtor_update.name,
-                        realtor_id,
-                    ),
-                )
-                row = cursor.fetchone()
-                if not row:
-                    raise ValueError("Customer not found")
-            except psycopg2.errors.ForeignKeyViolation:
-                raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
-            except psycopg2.errors.UniqueViolation:
-                raise psycopg2.errors.UniqueViolation("Unique error")
-            except ValueError:
-                raise ValueError("customer does not exist")
-    return row
-
-
-def update_realtor_review_db(con, realtor_review_id: int, realtor_review_update):
-    """
-    updates a realtor's data.
-    Returns the updated realtor object.
-    """
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "UPDATE realtor_reviews SET originator=%s, realtor=%s, score=%s, comment=%s WHERE id=%s RETURNING *;",
-                    (
-                        realtor_review_update.originator,
-                        realtor_review_update.realtor,
-                        realtor_review_update.score,
-                        realtor_review_update.comment,
-                        realtor_review_id,
-                    ),
-                )
-                row = cursor.fetchone()
-                if not row:
-                    raise ValueError("Customer not found")
-            except psycopg2.errors.ForeignKeyViolation:
-                raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
-            except psycopg2.errors.UniqueViolation:
-                raise psycopg2.errors.UniqueViolation("Unique error")
-            except ValueError:
-                raise ValueError("customer does not exist")
-    return row
-
-
-def update_real_estate_db(con, real_estate_id: int, real_estate_update):
-    """
-    updates a real estate's data.
-    Returns the updated real estate object.
-    """
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "UPDATE real_estates SET real_estate_type=%s, municipal=%s, adress=%s, living_space=%s, no_of_rooms=%s WHERE id=%s RETURNING *;",
-                    (
-                        real_estate_update.real_estate_type,
-                        real_estate_update.municipal,
-                        real_estate_update.adress,
-                        real_estate_update.living_space,
-                        real_estate_update.no_of_rooms,
-                        real_estate_id,
-                    ),
-                )
-                row = cursor.fetchone()
-                if not row:
-                    raise ValueError("Real estate not found")
-            except psycopg2.errors.ForeignKeyViolation:
-                raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
-            except psycopg2.errors.UniqueViolation:
-                raise psycopg2.errors.UniqueViolation("Unique error")
-            except ValueError:
-                raise ValueError("real estate does not exist")
-    return row
-
-
-def update_ad_db(con, ad_id: int, ad_update):
-    """
-     updates an ad's data.
-    Returns the updated ad object.
-    """
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cursor:
-            try:
-                cursor.execute(
-                    "UPDATE ads SET agreement=%s, customer=%s, publish_date=%s, end_date=%s, realtor=%s, description=%s, price=%s, sold_price=%s, status=%s WHERE id=%s RETURNING *;",
-                    (
-                        ad_update.agreement,
-                        ad_update.customer,
-                        ad_update.publish_date,
-                        ad_update.end_date,
-                        ad_update.realtor,
-                        ad_update.description,
-                        ad_update.price,
-                        ad_update.sold_price,
-                        ad_update.status,
-                        ad_id,
-                    ),
-                )
-                row = cursor.fetchone()
-                if not row:
-                    raise ValueError("ad not found")
-            except psycopg2.errors.ForeignKeyViolation:
-                raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
-            except psycopg2.errors.UniqueViolation:
-                raise psycopg2.errors.UniqueViolation("Unique error")
-            except ValueError:
-                raise ValueError("ad does not exist")
-    return row
-
-
-def patch_customer_db(con, customer_id, update_data):
-    query, params = build_partial_update_query(update_data, table="users", pk="id")
-    params[-1] = customer_id  # set PK
+def add_real_estates_batch_db(con, real_estates):
+    return write_batch_db(
+        con,
+        BATCH_INSERT_REAL_ESTATES_QUERY,
+        [real_estate_params(real_estate) for real_estate in real_estates],
+        "(%s::int, " + REAL_ESTATE_VALUES_TEMPLATE[1:],
+        new_ids_of="real_estates",
+    )
 
-    try:
-        with con:
-            with con.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(query, tuple(params))
-                row = cur.fetchone()
-
-                if not row:
-                    raise HTTPException(status_code=404, detail="User not found")
-
-                # return safe fields only
-                return {
-                    "id": row["id"],
-                    "username": row.get("username"),
-                    "email": row.get("email"),
-                    "created_at": row.get("created_at"),
-                }
-
-    except errors.UniqueViolation:
-        raise errors.UniqueViolation("Unique constraint violated")
-    except Exception as e:
-        raise Exception(e)
+
+def update_real_estates_batch_db(con, real_estates):
+    return write_batch_db(
+        con,
+        BATCH_UPDATE_REAL_ESTATES_QUERY,
+        [
+            (real_estate.id, *real_estate_params(real_estate))
+            for real_estate in real_estates
+        ],
+        "(%s::int, " + REAL_ESTATE_VALUES_TEMPLATE[1:],
+    )
@@ -0,0 +1,685 @@
+import asyncio
+import time
+
+import aiopg
+import cache
+import lookups
+import prepared
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from db import (
+    USER_TYPE_QUERY,
+    CUSTOMER_QUERY,
+    AD_QUERY,
+    AD_FULL_QUERY,
+    AD_RELATED_QUERIES,
+    FAVORITE_ADS_SELECT,
+    TRENDING_ADS_QUERY,
+    ALL_REALTOR_REVIEWS_SELECT,
+    INSERT_AD_QUERY,
+    INSERT_USER_QUERY,
+    INSERT_CUSTOMER_PROFILE_QUERY,
+    INSERT_REALTOR_PROFILE_QUERY,
+    INSERT_REAL_ESTATE_QUERY,
+    INSERT_REALTOR_REVIEW_QUERY,
+    DELETE_USER_QUERY,
+    DELETE_CUSTOMER_PROFILE_QUERY,
+    DELETE_REALTOR_PROFILE_QUERY,
+    DELETE_REALTOR_REVIEW_QUERY,
+    DELETE_REAL_ESTATE_QUERY,
+    DELETE_AD_QUERY,
+    UPDATE_USER_QUERY,
+    REALTOR_REVIEW_FOR_UPDATE_QUERY,
+    UPDATE_REALTOR_REVIEW_QUERY,
+    UPDATE_REAL_ESTATE_QUERY,
+    UPDATE_AD_QUERY,
+    ADD_FAVORITE_QUERY,
+    REMOVE_FAVORITES_QUERY,
+    AD_FAVORITE_COUNT_QUERY,
+    APPLY_REVIEW_TO_STATS_QUERY,
+    NOTIFY_INVALIDATED_QUERY,
+    ALL_CUSTOMERS_VERSIONS_SELECT,
+    CUSTOMER_VERSION_QUERY,
+    ALL_ADS_VERSIONS_SELECT,
+    AD_VERSION_QUERY,
+    REALTOR_STATS_QUERY,
+    TOP_REALTORS_QUERY,
+    MUNICIPAL_STATS_QUERY,
+    AD_SORT_COLUMNS,
+    ad_params,
+    real_estate_params,
+    build_partial_update_query,
+    ad_list_select,
+    ad_search_sort,
+    customer_list_select,
+    build_ad_search_query,
+    build_page_query,
+    include_related,
+    split_page,
+)
+from db_setup import (
+    POOL_MIN_SIZE,
+    POOL_MAX_SIZE,
+    POOL_TIMEOUT,
+    POOL_MAX_LIFETIME,
+    PoolTimeout,
+    connection_kwargs,
+)
+
+"""
+Async query functions used by the async endpoints in app.py, variants of the query
+functions in db.py. They build their SQL with the same queries and helpers as db.py, but through aiopg (asyncio on top of psycopg2), so an endpoint
+waiting on the database doesn't block a thread and one worker can serve many requests at once.
+
+- Same conventions as db.py: every function starts with a connection parameter,
+rows are returned as RealDictRows and the same exceptions are raised
+- aiopg connections are always in autocommit mode, use `async with cursor.begin()`
+when several statements have to run in one transaction
+"""
+
+_pool = None
+_wait_total = 0.0
+_acquired = 0
+
+
+async def init_async_pool(**kwargs):
+    """Create the async connection pool of this worker, called on application startup"""
+    global _pool
+    if _pool is None:
+        _pool = await aiopg.create_pool(
+            minsize=POOL_MIN_SIZE,
+            maxsize=POOL_MAX_SIZE,
+            pool_recycle=POOL_MAX_LIFETIME,
+            **(kwargs or connection_kwargs()),
+        )
+    return _pool
+
+
+async def close_async_pool():
+    """Close every pooled connection, called on application shutdown"""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        await _pool.wait_closed()
+        _pool = None
+
+
+def get_async_pool():
+    if _pool is None:
+        raise RuntimeError(
+            "Async connection pool is not initialized, call init_async_pool() first"
+        )
+    return _pool
+
+
+async def acquire():
+    """Borrow a connection, waiting at most POOL_TIMEOUT seconds for one to be free"""
+    global _wait_total, _acquired
+    start = time.perf_counter()
+    try:
+        con = await asyncio.wait_for(get_async_pool().acquire(), POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PoolTimeout(f"no database connection available after {POOL_TIMEOUT}s")
+    _wait_total += time.perf_counter() - start
+    _acquired += 1
+    return con
+
+
+async def release(con):
+    await get_async_pool().release(con)
+
+
+def async_pool_stats():
+    """Current usage of the async pool, reported next to the sync pool in /pool/stats"""
+    pool = get_async_pool()
+    return {
+        "min_size": pool.minsize,
+        "max_size": pool.maxsize,
+        "in_use": pool.size - pool.freesize,
+        "idle": pool.freesize,
+        "acquired_total": _acquired,
+        "wait_time_total_ms": round(_wait_total * 1000, 3),
+        "wait_time_avg_ms": (
+            round(_wait_total * 1000 / _acquired, 3) if _acquired else 0.0
+        ),
+    }
+
+
+async def get_user_type_id(con, type):
+    user_type_id = lookups.get_id("user_types", type)
+    if user_type_id is not None:
+        return user_type_id
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(USER_TYPE_QUERY, (type,))
+        items = await cursor.fetchone()
+    return items["id"]
+
+
+async def get_all_customers_db(con, limit, page_cursor=None, fields=None):
+    """A page of customers, with only the columns (and joins) of `fields` if given"""
+    select, filters = customer_list_select(fields)
+    type = await get_user_type_id(con, "Kund")
+    query, params = build_page_query(
+        select,
+        "users",
+        limit,
+        cursor=page_cursor,
+        filters=[(sql.SQL("users.type = %s"), (type,)), *filters],
+    )
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(query, params)
+        items = await cursor.fetchall()
+    return split_page(items, limit)
+
+
+async def get_customer_db(con, customer_id):
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            await prepared.execute_async(cursor, CUSTOMER_QUERY, (customer_id,))
+            items = await cursor.fetchall()
+        except Exception:
+            raise ValueError("Customer ID not valid")
+    return items
+
+
+async def get_all_ads_db(con, limit, sort="id", page_cursor=None, fields=None):
+    """A page of ads, with only the columns (and joins) of `fields` if given"""
+    select, filters = ad_list_select(fields, sort)
+    query, params = build_page_query(
+        select,
+        "ads",
+        limit,
+        sort,
+        page_cursor,
+        allowed=AD_SORT_COLUMNS,
+        filters=filters,
+    )
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(query, params)
+        items = await cursor.fetchall()
+    return split_page(items, limit, sort)
+
+
+async def search_ads_db(con, search):
+    sort = ad_search_sort(search)
+    query, params = build_ad_search_query(search, sort)
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(query, params)
+        items = await cursor.fetchall()
+    return split_page(items, search.limit, sort)
+
+
+async def get_ad_db(con, ad_id):
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            await prepared.execute_async(cursor, AD_QUERY, (ad_id,))
+            items = await cursor.fetchall()
+        except Exception:
+            raise ValueError("Ad ID not valid")
+    return items
+
+
+async def get_customers_versions_db(con, limit, page_cursor=None):
+    """(id, version, updated_at) of the rows get_all_customers_db() would return, and the next cursor"""
+    type = await get_user_type_id(con, "Kund")
+    query, params = build_page_query(
+        ALL_CUSTOMERS_VERSIONS_SELECT,
+        "users",
+        limit,
+        cursor=page_cursor,
+        filters=[(sql.SQL("users.type = %s"), (type,))],
+    )
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(query, params)
+        items = await cursor.fetchall()
+    return split_page(items, limit)
+
+
+async def get_customer_version_db(con, customer_id):
+    """(version, updated_at) of a customer, None if it doesn't exist"""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await prepared.execute_async(cursor, CUSTOMER_VERSION_QUERY, (customer_id,))
+        return await cursor.fetchone()
+
+
+async def get_ads_versions_db(con, limit, sort="id", page_cursor=None):
+    """(id, version, updated_at) of the rows get_all_ads_db() would return, and the next cursor"""
+    query, params = build_page_query(
+        ALL_ADS_VERSIONS_SELECT,
+        "ads",
+        limit,
+        sort,
+        page_cursor,
+        allowed=AD_SORT_COLUMNS,
+    )
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(query, params)
+        items = await cursor.fetchall()
+    return split_page(items, limit, sort)
+
+
+async def get_ad_version_db(con, ad_id):
+    """(version, updated_at) of an ad, None if it doesn't exist"""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await prepared.execute_async(cursor, AD_VERSION_QUERY, (ad_id,))
+        return await cursor.fetchone()
+
+
+async def get_ads_related_db(con, ads, include):
+    """Adds the `include` relations (see AD_RELATED_QUERIES) to a page of ads, one query per relation"""
+    if not ads:
+        return ads
+    ids = [ad["id"] for ad in ads]
+    for name in include:
+        async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+            await cursor.execute(AD_RELATED_QUERIES[name], (ids,))
+            include_related(ads, name, await cursor.fetchall())
+    return ads
+
+
+async def get_favorite_ads_db(con, customer_id, limit, page_cursor=None):
+    query, params = build_page_query(
+        FAVORITE_ADS_SELECT,
+        "ads",
+        limit,
+        cursor=page_cursor,
+        filters=[(sql.SQL("customer_favorites.customer = %s"), (customer_id,))],
+    )
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(query, params)
+        items = await cursor.fetchall()
+    return split_page(items, limit)
+
+
+async def get_trending_ads_db(con, limit):
+    """The most favorited ads, read from the top of the favorite_count index"""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(TRENDING_ADS_QUERY, (limit,))
+        return await cursor.fetchall()
+
+
+async def get_ad_full_db(con, ad_id):
+    """An ad with its users, real estates (adress, profile, images) and images, None if it doesn't exist"""
+    async with con.cursor() as cursor:
+        await cursor.execute(AD_FULL_QUERY, (ad_id,))
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def get_all_realtor_reviews_db(con, limit, page_cursor=None):
+    query, params = build_page_query(
+        ALL_REALTOR_REVIEWS_SELECT, "realtor_reviews", limit, cursor=page_cursor
+    )
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(query, params)
+        items = await cursor.fetchall()
+    return split_page(items, limit)
+
+
+async def get_realtor_stats_db(con, realtor_id):
+    """Review count, score sum, average and histogram of a realtor, None if it doesn't exist"""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(REALTOR_STATS_QUERY, (realtor_id,))
+        return await cursor.fetchone()
+
+
+async def get_top_realtors_db(con, limit, min_reviews=1):
+    """The realtors with the best average score among those with at least min_reviews reviews"""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(TOP_REALTORS_QUERY, (min_reviews, limit))
+        return await cursor.fetchall()
+
+
+async def get_municipal_stats_db(con, municipal_id, months=12):
+    """Market statistics of a municipal for each of the last `months` months that had ads"""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(MUNICIPAL_STATS_QUERY, (municipal_id, months - 1))
+        return await cursor.fetchall()
+
+
+async def add_ad_db(con, ad_input):
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            await prepared.execute_async(cursor, INSERT_AD_QUERY, ad_params(ad_input))
+            inserted = await cursor.fetchone()
+        except psycopg2.errors.UniqueViolation:
+            raise psycopg2.errors.UniqueViolation("Unique error")
+        except psycopg2.errors.ForeignKeyViolation:
+            raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
+        except Exception:
+            raise ValueError("DB error")
+    return inserted
+
+
+async def apply_review_to_stats(cursor, realtor, score, delta):
+    """Adds (delta 1) or removes (delta -1) a review's score to the stats of its realtor"""
+    if realtor is None or score is None:
+        return
+    await cursor.execute(
+        APPLY_REVIEW_TO_STATS_QUERY,
+        {"realtor": realtor, "score": score, "delta": delta},
+    )
+
+
+async def invalidate_cached_db(con, *entities):
+    """
+    Drops changed entities ("ad:12", "ad:*" for all ads) from the entity cache of
+    this worker and notifies the other workers. Called once the change is committed
+    """
+    for entity in entities:
+        kind, _, key = entity.partition(":")
+        cache.invalidate(kind, key)
+    async with con.cursor() as cursor:
+        await cursor.execute(NOTIFY_INVALIDATED_QUERY, (cache.CHANNEL, list(entities)))
+
+
+async def add_user_db(con, user_input, profile_query, profile_value):
+    """Inserts a user and its customer/realtor profile in one transaction"""
+    type = await get_user_type_id(con, "Mäklare")
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            async with cursor.begin():
+                await cursor.execute(
+                    INSERT_USER_QUERY,
+                    (type, user_input.username, user_input.password, user_input.email),
+                )
+                inserted = await cursor.fetchone()
+                await cursor.execute(profile_query, (inserted["id"], profile_value))
+        except psycopg2.errors.UniqueViolation:
+            raise psycopg2.errors.UniqueViolation("Unique error")
+        except psycopg2.errors.ForeignKeyViolation:
+            raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
+        except Exception:
+            raise ValueError("DB error")
+    return inserted
+
+
+async def add_customer_db(con, user_input):
+    return await add_user_db(
+        con, user_input, INSERT_CUSTOMER_PROFILE_QUERY, user_input.adress
+    )
+
+
+async def add_realtor_db(con, user_input):
+    return await add_user_db(
+        con, user_input, INSERT_REALTOR_PROFILE_QUERY, user_input.agency
+    )
+
+
+async def add_real_estate_db(con, user_input):
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            await cursor.execute(
+                INSERT_REAL_ESTATE_QUERY, real_estate_params(user_input)
+            )
+            inserted = await cursor.fetchone()
+        except psycopg2.errors.UniqueViolation:
+            raise psycopg2.errors.UniqueViolation("Unique error")
+        except psycopg2.errors.ForeignKeyViolation:
+            raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
+        except Exception:
+            raise ValueError("DB error")
+    return inserted
+
+
+async def add_realtor_review_db(con, user_input):
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            async with cursor.begin():
+                await cursor.execute(
+                    INSERT_REALTOR_REVIEW_QUERY,
+                    (
+                        user_input.originator,
+                        user_input.realtor,
+                        user_input.score,
+                        user_input.comment,
+                    ),
+                )
+                inserted = await cursor.fetchone()
+                await apply_review_to_stats(
+                    cursor, user_input.realtor, user_input.score, 1
+                )
+        except psycopg2.errors.UniqueViolation:
+            raise psycopg2.errors.UniqueViolation("Unique error")
+        except psycopg2.errors.ForeignKeyViolation:
+            raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
+        except Exception:
+            raise ValueError("DB error")
+    return inserted
+
+
+async def add_favorite_db(con, customer_id: int, ad_id: int):
+    """
+    Favorites an ad for a customer, a no-op if it already is.
+    Returns the ad's favorite count and whether the favorite was added
+    """
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            await cursor.execute(ADD_FAVORITE_QUERY, (customer_id, ad_id))
+            row = await cursor.fetchone()
+        except psycopg2.errors.ForeignKeyViolation:
+            raise ValueError("customer or ad not found")
+        # the CTE only returns a row when its INSERT added the favorite
+        added = row is not None
+        if not added:
+            await cursor.execute(AD_FAVORITE_COUNT_QUERY, (ad_id,))
+            row = await cursor.fetchone()
+    return row["favorite_count"], added
+
+
+async def remove_favorite_db(con, customer_id: int, ad_id: int):
+    """Removes an ad from a customer's favorites. Returns the ad's favorite count"""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(REMOVE_FAVORITES_QUERY, (customer_id, ad_id, ad_id))
+        row = await cursor.fetchone()
+        if not row:
+            raise ValueError("favorite not found")
+    return row["favorite_count"]
+
+
+async def delete_user_db(con, user_id: int, profile_query, *before):
+    """Deletes a user with its profile (and `before` statements) in one transaction"""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        async with cursor.begin():
+            for query, params in before:
+                await cursor.execute(query, params)
+            await cursor.execute(profile_query, (user_id,))
+            await cursor.execute(DELETE_USER_QUERY, (user_id,))
+            if not await cursor.fetchone():
+                raise ValueError("User not found")
+
+
+async def delete_customer_db(con, customer_id: int):
+    """Delete a customer by ID."""
+    await delete_user_db(
+        con,
+        customer_id,
+        DELETE_CUSTOMER_PROFILE_QUERY,
+        (REMOVE_FAVORITES_QUERY, (customer_id, None, None)),
+    )
+    # ads show the customer's name
+    await invalidate_cached_db(con, f"customer:{customer_id}", "ad:*")
+
+
+async def delete_realtor_db(con, realtor_id: int):
+    """Delete a realtor by ID."""
+    await delete_user_db(con, realtor_id, DELETE_REALTOR_PROFILE_QUERY)
+    await invalidate_cached_db(con, "ad:*")  # ads show the realtor's name
+
+
+async def delete_realtor_review_db(con, realtor_review_id: int):
+    """Delete a realtor review by ID."""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        async with cursor.begin():
+            await cursor.execute(DELETE_REALTOR_REVIEW_QUERY, (realtor_review_id,))
+            result = await cursor.fetchone()
+            if not result:
+                raise ValueError("realtor review not found")
+            await apply_review_to_stats(cursor, result["realtor"], result["score"], -1)
+
+
+async def delete_real_estate_db(con, real_estate_id: int):
+    """Delete a real estate by ID."""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(DELETE_REAL_ESTATE_QUERY, (real_estate_id,))
+        if not await cursor.fetchone():
+            raise ValueError("Real estate not found")
+
+
+async def delete_ad_db(con, ad_id: int):
+    """Delete an ad by ID."""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        await cursor.execute(DELETE_AD_QUERY, (ad_id,))
+        if not await cursor.fetchone():
+            raise ValueError("Ad not found")
+    await invalidate_cached_db(con, f"ad:{ad_id}")
+
+
+async def update_user_db(con, user_id: int, user_update, type):
+    """Replaces the data of a customer or realtor, returns the updated row"""
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            await cursor.execute(
+                UPDATE_USER_QUERY,
+                (
+                    type,
+                    user_update.username,
+                    user_update.password,
+                    user_update.email,
+                    user_update.name,
+                    user_id,
+                ),
+            )
+            row = await cursor.fetchone()
+        except psycopg2.errors.ForeignKeyViolation:
+            raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
+        except psycopg2.errors.UniqueViolation:
+            raise psycopg2.errors.UniqueViolation("Unique error")
+    if not row:
+        raise ValueError("customer does not exist")
+    return row
+
+
+async def update_customer_db(con, customer_id: int, customer_update):
+    """
+    updates a customer's data.
+    Returns the updated customer object.
+    """
+    type = await get_user_type_id(con, "Kund")
+    row = await update_user_db(con, customer_id, customer_update, type)
+    # ads show the customer's name
+    await invalidate_cached_db(con, f"customer:{customer_id}", "ad:*")
+    return row
+
+
+async def update_realtor_db(con, realtor_id: int, realtor_update):
+    """
+    updates a realtor's data.
+    Returns the updated realtor object.
+    """
+    type = await get_user_type_id(con, "Mäklare")
+    row = await update_user_db(con, realtor_id, realtor_update, type)
+    await invalidate_cached_db(con, "ad:*")  # ads show the realtor's name
+    return row
+
+
+async def update_realtor_review_db(con, realtor_review_id: int, realtor_review_update):
+    """
+    updates a realtor review's data, and the stats of the realtors it moved between.
+    Returns the updated realtor review object.
+    """
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            async with cursor.begin():
+                await cursor.execute(
+                    REALTOR_REVIEW_FOR_UPDATE_QUERY, (realtor_review_id,)
+                )
+                old = await cursor.fetchone()
+                await cursor.execute(
+                    UPDATE_REALTOR_REVIEW_QUERY,
+                    (
+                        realtor_review_update.originator,
+                        realtor_review_update.realtor,
+                        realtor_review_update.score,
+                        realtor_review_update.comment,
+                        realtor_review_id,
+                    ),
+                )
+                row = await cursor.fetchone()
+                if not row:
+                    raise ValueError("realtor review does not exist")
+                if (old["realtor"], old["score"]) != (row["realtor"], row["score"]):
+                    await apply_review_to_stats(
+                        cursor, old["realtor"], old["score"], -1
+                    )
+                    await apply_review_to_stats(cursor, row["realtor"], row["score"], 1)
+        except psycopg2.errors.ForeignKeyViolation:
+            raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
+        except psycopg2.errors.UniqueViolation:
+            raise psycopg2.errors.UniqueViolation("Unique error")
+    return row
+
+
+async def update_real_estate_db(con, real_estate_id: int, real_estate_update):
+    """
+    updates a real estate's data.
+    Returns the updated real estate object.
+    """
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            await cursor.execute(
+                UPDATE_REAL_ESTATE_QUERY,
+                (*real_estate_params(real_estate_update), real_estate_id),
+            )
+            row = await cursor.fetchone()
+        except psycopg2.errors.ForeignKeyViolation:
+            raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
+        except psycopg2.errors.UniqueViolation:
+            raise psycopg2.errors.UniqueViolation("Unique error")
+    if not row:
+        raise ValueError("real estate does not exist")
+    return row
+
+
+async def update_ad_db(con, ad_id: int, ad_update):
+    """
+    updates an ad's data.
+    Returns the updated ad object.
+    """
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            await cursor.execute(UPDATE_AD_QUERY, (*ad_params(ad_update), ad_id))
+            row = await cursor.fetchone()
+        except psycopg2.errors.ForeignKeyViolation:
+            raise psycopg2.errors.ForeignKeyViolation("Foreign Key error")
+        except psycopg2.errors.UniqueViolation:
+            raise psycopg2.errors.UniqueViolation("Unique error")
+    if not row:
+        raise ValueError("ad does not exist")
+    await invalidate_cached_db(con, f"ad:{ad_id}")
+    return row
+
+
+async def patch_customer_db(con, customer_id, update_data):
+    """Updates the given columns of a customer, returns its safe fields"""
+    query, params = build_partial_update_query(update_data, table="users", pk="id")
+    params[-1] = customer_id  # set PK
+    async with con.cursor(cursor_factory=RealDictCursor) as cursor:
+        try:
+            await cursor.execute(query, tuple(params))
+            row = await cursor.fetchone()
+        except psycopg2.errors.UniqueViolation:
+            raise psycopg2.errors.UniqueViolation("Unique constraint violated")
+    if not row:
+        raise ValueError("User not found")
+    # ads show the customer's name
+    await invalidate_cached_db(con, f"customer:{customer_id}", "ad:*")
+    # return safe fields only
+    return {
+        "id": row["id"],
+        "username": row.get("username"),
+        "email": row.get("email"),
+        "created_at": row.get("created_at"),
+    }
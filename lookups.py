@@ -0,0 +1,69 @@
+import threading
+
+from psycopg2 import sql
+
+"""
+In-process cache of the small lookup tables (user_types, municipals, real_estate_types).
+It is loaded on startup and reloaded whenever a trigger on one of the tables sends a
+NOTIFY on the lookup_changed channel (see notifications.py), so db.py and the
+validation in schemas.py can resolve and check their ids without a query.
+
+Until the cache is loaded (e.g. in scripts) lookups return None and ids are not checked.
+"""
+
+CHANNEL = "lookup_changed"
+
+# table -> column holding the name
+LOOKUP_TABLES = {
+    "user_types": "type",
+    "municipals": "municipal",
+    "real_estate_types": "type",
+}
+
+_lock = threading.Lock()
+_ids = {}  # table -> {name: id}, only contains the tables that are loaded
+_known_ids = {}  # table -> set of ids
+
+
+def load_table(con, table):
+    """(Re)loads one lookup table"""
+    query = sql.SQL("SELECT id, {} FROM {};").format(
+        sql.Identifier(LOOKUP_TABLES[table]), sql.Identifier(table)
+    )
+    with con.cursor() as cursor:
+        cursor.execute(query)
+        ids = {name: id for id, name in cursor.fetchall()}
+    if not con.autocommit:
+        con.rollback()
+    with _lock:
+        _ids[table] = ids
+        _known_ids[table] = set(ids.values())
+
+
+def load_lookups(con):
+    """Loads every lookup table, called on startup"""
+    for table in LOOKUP_TABLES:
+        load_table(con, table)
+
+
+def on_lookup_changed(con, table):
+    """Listener callback: the payload is the changed table, None means reload everything"""
+    if table is None:
+        load_lookups(con)
+    elif table in LOOKUP_TABLES:
+        load_table(con, table)
+
+
+def is_loaded(table):
+    return table in _ids
+
+
+def get_id(table, name):
+    """The id of a name in a lookup table, None if unknown or not loaded"""
+    return _ids.get(table, {}).get(name)
+
+
+def id_exists(table, id):
+    """Whether an id exists in a lookup table. True when the table isn't loaded"""
+    ids = _known_ids.get(table)
+    return ids is None or id in ids
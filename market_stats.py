@@ -0,0 +1,112 @@
+import os
+import threading
+
+"""
+Incremental refresh of the per municipal and month market statistics in
+municipal_month_stats (migrations/0006_municipal_market_stats.sql).
+
+Triggers record which (municipal, month) pairs a change touched in municipal_stats_dirty,
+a refresh takes those pairs and recomputes just them, so its cost depends on what changed
+since the last run and not on the size of the history.
+Run it from a scheduler with `python db_setup.py refresh-stats`, or let every api worker
+run it in the background every MARKET_STATS_REFRESH_INTERVAL seconds (0, the default,
+turns that off). An advisory lock makes concurrent refreshes skip instead of wait.
+"""
+
+REFRESH_INTERVAL = float(os.getenv("MARKET_STATS_REFRESH_INTERVAL", "0"))  # seconds
+# arbitrary key of the advisory lock held while refreshing
+REFRESH_LOCK_KEY = 727301
+
+# Taken in its own statement, which waits for transactions still marking one of the pairs,
+# so the statement recomputing them (with a newer snapshot) sees their changes
+TAKE_DIRTY_MONTHS = """
+    DELETE FROM municipal_stats_dirty RETURNING municipal, month;
+"""
+
+DELETE_MONTH_STATS = """
+    DELETE FROM municipal_month_stats s
+    USING unnest(%s::int[], %s::date[]) AS d(municipal, month)
+    WHERE s.municipal = d.municipal AND s.month = d.month;
+"""
+
+# months without any ads anymore get no row
+COMPUTE_MONTH_STATS = """
+    INSERT INTO municipal_month_stats
+        (municipal, month, listings, sold, median_price, median_sold_price, median_sold_to_asking)
+    SELECT municipal, month, count(*), count(sold_price),
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY price),
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY sold_price),
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY sold_price / nullif(price, 0))
+    FROM (
+        SELECT DISTINCT d.municipal, d.month, a.id, a.price, a.sold_price
+        FROM unnest(%s::int[], %s::date[]) AS d(municipal, month)
+        JOIN real_estates re ON re.municipal = d.municipal
+        JOIN ads_real_estates ar ON ar.real_estate = re.id
+        JOIN ads a ON a.id = ar.ad
+        WHERE a.publish_date >= d.month AND a.publish_date < d.month + interval '1 month'
+    ) month_ads
+    GROUP BY municipal, month;
+"""
+
+
+def refresh_market_stats(con):
+    """
+    Recomputes the statistics of the months marked dirty since the last refresh.
+    Returns the number of (municipal, month) pairs refreshed, or None if another
+    refresh was running
+    """
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s);", (REFRESH_LOCK_KEY,))
+            if not cursor.fetchone()[0]:
+                return None
+            cursor.execute(TAKE_DIRTY_MONTHS)
+            dirty = cursor.fetchall()
+            if not dirty:
+                return 0
+            municipals = [municipal for municipal, _ in dirty]
+            months = [month for _, month in dirty]
+            cursor.execute(DELETE_MONTH_STATS, (municipals, months))
+            cursor.execute(COMPUTE_MONTH_STATS, (municipals, months))
+    return len(dirty)
+
+
+class Refresher(threading.Thread):
+    """Runs refresh_market_stats() every `interval` seconds with a pooled connection"""
+
+    def __init__(self, pool, interval=REFRESH_INTERVAL):
+        super().__init__(name="market-stats-refresher", daemon=True)
+        self._pool = pool
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+        self.join(timeout=5)
+
+    def run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                with self._pool.connection() as con:
+                    refresh_market_stats(con)
+            except Exception as e:
+                print(f"market-stats-refresher: refresh failed ({e})")
+
+
+_refresher = None
+
+
+def start_refresher(pool, interval=REFRESH_INTERVAL):
+    """Starts the background refresh of this worker, unless the interval is 0"""
+    global _refresher
+    if _refresher is None and interval > 0:
+        _refresher = Refresher(pool, interval)
+        _refresher.start()
+    return _refresher
+
+
+def stop_refresher():
+    global _refresher
+    if _refresher is not None:
+        _refresher.stop()
+        _refresher = None
@@ -0,0 +1,298 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+
+from psycopg2 import extensions
+
+import slow_queries
+
+"""
+Request and database timing of the api, exported on GET /metrics (Prometheus text format)
+and as a Server-Timing header on every response.
+
+MetricsMiddleware times every request and keeps a RequestStats in a context variable for
+its duration; the database layer adds to it: the time waiting for a pooled connection
+(get_db/get_async_db), and the time in SQL, the number of queries and rows of every
+execute, through TimedConnection (the connection class of the sync pool, its cursors
+time their statements) and TimedAsyncConnection (wraps a connection of the aiopg pool).
+Sync endpoints run in a copy of the request's context, which shares the RequestStats.
+
+Statements are also handed to slow_queries.check(), which logs the slow ones.
+Recording a query is a few additions on the request's RequestStats, the histograms are
+updated once per request under a lock, so the hot path stays cheap. Histograms are per
+method and route template (/ads/{ad_id}, not /ads/12), so there is one series per endpoint.
+"""
+
+# upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    """What one request spent on the database, added to while it runs"""
+
+    __slots__ = ("db_time", "db_wait", "queries", "rows")
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.db_wait = 0.0
+        self.queries = 0
+        self.rows = 0
+
+    def server_timing(self, total):
+        return (
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries, {self.rows} rows", '
+            f"db-wait;dur={self.db_wait * 1000:.2f}, "
+            f"app;dur={total * 1000:.2f}"
+        )
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.duration = Histogram()
+        self.db_time = Histogram()
+        self.db_wait = Histogram()
+        self.statuses = {}  # status code -> requests
+        self.queries = 0
+        self.rows = 0
+
+
+_current = ContextVar("request_stats", default=None)
+_lock = threading.Lock()
+_routes = {}  # (method, route) -> RouteMetrics
+
+
+def record_query(seconds, rows):
+    """Adds a statement to the current request, if there is one (not e.g. the refresher)"""
+    stats = _current.get()
+    if stats is not None:
+        stats.db_time += seconds
+        stats.queries += 1
+        if rows > 0:
+            stats.rows += rows
+
+
+def record_wait(seconds):
+    """Adds time spent waiting for a pooled connection to the current request"""
+    stats = _current.get()
+    if stats is not None:
+        stats.db_wait += seconds
+
+
+def record_request(method, route, status, seconds, stats):
+    with _lock:
+        metrics = _routes.get((method, route))
+        if metrics is None:
+            metrics = _routes[(method, route)] = RouteMetrics()
+        metrics.duration.observe(seconds)
+        metrics.db_time.observe(stats.db_time)
+        metrics.db_wait.observe(stats.db_wait)
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+        metrics.queries += stats.queries
+        metrics.rows += stats.rows
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every http request, see the module docstring"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = stats.server_timing(time.perf_counter() - start)
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"server-timing", timing.encode()),
+                    ],
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            # set by the router once it matched, the template keeps the number of series small
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            record_request(
+                scope["method"], route, status, time.perf_counter() - start, stats
+            )
+
+
+class TimedCursor:
+    """Mixin timing the statements of a psycopg2 cursor class, see timed_cursor_class()"""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            seconds = time.perf_counter() - start
+            record_query(seconds, self.rowcount)
+            slow_queries.check(self, query, vars, seconds)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            seconds = time.perf_counter() - start
+            record_query(seconds, self.rowcount)
+            slow_queries.check(self, query, None, seconds)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            seconds = time.perf_counter() - start
+            record_query(seconds, self.rowcount)
+            slow_queries.check(self, sql, None, seconds)
+
+
+@lru_cache(maxsize=None)
+def timed_cursor_class(base):
+    return type(f"Timed{base.__name__}", (TimedCursor, base), {})
+
+
+class TimedConnection(extensions.connection):
+    """psycopg2 connection whose cursors (whatever their cursor_factory) time their statements"""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+        kwargs["cursor_factory"] = timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+class TimedAsyncCursor:
+    """Wraps an aiopg cursor, timing execute() and passing everything else through"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def execute(self, operation, parameters=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.execute(operation, parameters, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            record_query(seconds, self._cursor.rowcount)
+            slow_queries.check(self._cursor.raw, operation, parameters, seconds)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _TimedAsyncCursorContext:
+    def __init__(self, context):
+        self._context = context
+
+    async def __aenter__(self):
+        return TimedAsyncCursor(await self._context.__aenter__())
+
+    async def __aexit__(self, *exc_info):
+        return await self._context.__aexit__(*exc_info)
+
+    def __await__(self):
+        return self._wrap().__await__()
+
+    async def _wrap(self):
+        return TimedAsyncCursor(await self._context)
+
+
+class TimedAsyncConnection:
+    """Wraps an aiopg connection so the cursors it opens time their statements"""
+
+    def __init__(self, con):
+        self._con = con
+
+    def cursor(self, *args, **kwargs):
+        return _TimedAsyncCursorContext(self._con.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _histogram_lines(name, histogram, labels):
+    cumulative = 0
+    for bound, count in zip((*BUCKETS, "+Inf"), histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+    yield f"{name}_sum{{{labels}}} {histogram.sum:.6f}"
+    yield f"{name}_count{{{labels}}} {histogram.count}"
+
+
+HISTOGRAMS = {
+    "http_request_duration_seconds": ("duration", "Request latency"),
+    "db_query_duration_seconds": ("db_time", "Time in SQL per request"),
+    "db_pool_wait_seconds": (
+        "db_wait",
+        "Time waiting for a pooled connection per request",
+    ),
+}
+COUNTERS = {
+    "db_queries_total": ("queries", "Statements executed"),
+    "db_rows_total": ("rows", "Rows returned or changed by the statements"),
+}
+
+
+def render():
+    """The metrics in Prometheus text format"""
+    with _lock:
+        routes = sorted(_routes.items())
+        lines = []
+        for name, (attribute, help) in HISTOGRAMS.items():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+            for (method, route), metrics in routes:
+                lines += _histogram_lines(
+                    name,
+                    getattr(metrics, attribute),
+                    _labels(method=method, route=route),
+                )
+        lines += [
+            "# HELP http_requests_total Requests",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route), metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                labels = _labels(method=method, route=route, status=status)
+                lines.append(f"http_requests_total{{{labels}}} {count}")
+        for name, (attribute, help) in COUNTERS.items():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+            for (method, route), metrics in routes:
+                labels = _labels(method=method, route=route)
+                lines.append(f"{name}{{{labels}}} {getattr(metrics, attribute)}")
+    return "\n".join(lines) + "\n"
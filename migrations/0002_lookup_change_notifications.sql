@@ -0,0 +1,21 @@
+-- Lets the api workers know when a lookup table changes, so they can reload their cached copy (see lookups.py).
+-- NOTIFY is only delivered when the transaction commits
+
+CREATE OR REPLACE FUNCTION notify_lookup_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('lookup_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER user_types_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON user_types
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_lookup_changed();
+
+CREATE TRIGGER municipals_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON municipals
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_lookup_changed();
+
+CREATE TRIGGER real_estate_types_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON real_estate_types
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_lookup_changed();
@@ -0,0 +1,15 @@
+-- Row versions for conditional GETs (ETag / Last-Modified, see app.py).
+-- version is bumped and updated_at set by every UPDATE in db.py, inserts start at version 1.
+-- Constant/stable defaults don't rewrite the tables on postgres 11+
+
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+ALTER TABLE ads
+    ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+ALTER TABLE real_estates
+    ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
@@ -0,0 +1,26 @@
+-- Rating aggregates per realtor, kept up to date by the realtor review functions in db.py
+-- in the same transaction as the review change. Reviews without a score don't count.
+-- histogram maps a score to its number of reviews, e.g. {"4": 2, "5": 7}
+
+CREATE TABLE IF NOT EXISTS realtor_stats (
+    realtor INT PRIMARY KEY REFERENCES realtor_profiles(id) ON DELETE CASCADE,
+    review_count INT NOT NULL DEFAULT 0,
+    score_sum BIGINT NOT NULL DEFAULT 0,
+    avg_score DOUBLE PRECISION GENERATED ALWAYS AS (
+        CASE WHEN review_count > 0 THEN score_sum::double precision / review_count END
+    ) STORED,
+    histogram JSONB NOT NULL DEFAULT '{}'
+);
+
+-- top rated realtors
+CREATE INDEX IF NOT EXISTS realtor_stats_avg_score_idx ON realtor_stats (avg_score DESC NULLS LAST, review_count DESC, realtor);
+
+INSERT INTO realtor_stats (realtor, review_count, score_sum, histogram)
+SELECT realtor, sum(n), sum(score * n), jsonb_object_agg(score::text, n)
+FROM (
+    SELECT realtor, score, count(*) AS n FROM realtor_reviews
+    WHERE realtor IS NOT NULL AND score IS NOT NULL
+    GROUP BY realtor, score
+) per_score
+GROUP BY realtor
+ON CONFLICT (realtor) DO NOTHING;
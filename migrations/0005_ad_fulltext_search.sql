@@ -0,0 +1,10 @@
+-- migrate: no-transaction
+-- Full-text search over ad descriptions (GET /ads/search?q=), with swedish stemming so
+-- "balkong" also finds "balkongen" and "balkonger".
+-- Adding a stored generated column rewrites ads once, the GIN index is then built
+-- without blocking writes
+
+ALTER TABLE ads ADD COLUMN IF NOT EXISTS description_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('swedish', coalesce(description, ''))) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_description_tsv_idx ON ads USING GIN (description_tsv);
@@ -0,0 +1,131 @@
+-- Market statistics per municipal and month (of the ads' publish_date), read by
+-- GET /stats/municipals/{id}. Triggers mark the (municipal, month) pairs a change
+-- touches in municipal_stats_dirty, and market_stats.refresh_market_stats() (run by
+-- `python db_setup.py refresh-stats` or the api's background refresher) recomputes
+-- only those. An ad in several real estates counts once in each of their municipals.
+
+CREATE TABLE IF NOT EXISTS municipal_month_stats (
+    municipal INT REFERENCES municipals(id) ON DELETE CASCADE,
+    month DATE,
+    listings INT NOT NULL,
+    sold INT NOT NULL,
+    median_price DOUBLE PRECISION,
+    median_sold_price DOUBLE PRECISION,
+    -- median of sold_price / price over the sold ads
+    median_sold_to_asking DOUBLE PRECISION,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (municipal, month)
+);
+
+CREATE TABLE IF NOT EXISTS municipal_stats_dirty (
+    municipal INT,
+    month DATE,
+    -- updated on every mark, so the refresh waits for (and sees) a transaction that marks a pair it is taking
+    marked_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (municipal, month)
+);
+
+-- ads: a changed ad dirties its old and new month, a deleted one is marked before
+-- the delete cascades to ads_real_estates (which is needed to find its municipals)
+CREATE OR REPLACE FUNCTION mark_ads_stats_dirty() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO municipal_stats_dirty (municipal, month)
+        SELECT DISTINCT re.municipal, date_trunc('month', OLD.publish_date)::date
+        FROM ads_real_estates ar JOIN real_estates re ON re.id = ar.real_estate
+        WHERE ar.ad = OLD.id AND re.municipal IS NOT NULL AND OLD.publish_date IS NOT NULL
+        ON CONFLICT (municipal, month) DO UPDATE SET marked_at = now();
+        RETURN OLD;
+    END IF;
+    -- only ads whose statistics changed, not e.g. a new description
+    INSERT INTO municipal_stats_dirty (municipal, month)
+    SELECT DISTINCT re.municipal, date_trunc('month', changed.publish_date)::date
+    FROM old_ads o
+    JOIN new_ads n ON n.id = o.id
+    CROSS JOIN LATERAL (VALUES (o.publish_date), (n.publish_date)) changed(publish_date)
+    JOIN ads_real_estates ar ON ar.ad = o.id
+    JOIN real_estates re ON re.id = ar.real_estate
+    WHERE (o.publish_date, o.price, o.sold_price) IS DISTINCT FROM (n.publish_date, n.price, n.sold_price)
+      AND re.municipal IS NOT NULL AND changed.publish_date IS NOT NULL
+    ON CONFLICT (municipal, month) DO UPDATE SET marked_at = now();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER ads_market_stats_update
+    AFTER UPDATE ON ads REFERENCING OLD TABLE AS old_ads NEW TABLE AS new_ads
+    FOR EACH STATEMENT EXECUTE FUNCTION mark_ads_stats_dirty();
+
+CREATE TRIGGER ads_market_stats_delete
+    BEFORE DELETE ON ads
+    FOR EACH ROW EXECUTE FUNCTION mark_ads_stats_dirty();
+
+-- ads_real_estates: linking or unlinking an ad dirties the ad's month in the real estate's municipal
+-- (a new ad only counts once it is linked, rows removed by a cascade were marked by the other triggers)
+CREATE OR REPLACE FUNCTION mark_ads_real_estates_stats_dirty() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO municipal_stats_dirty (municipal, month)
+        SELECT DISTINCT re.municipal, date_trunc('month', a.publish_date)::date
+        FROM new_links l JOIN ads a ON a.id = l.ad JOIN real_estates re ON re.id = l.real_estate
+        WHERE re.municipal IS NOT NULL AND a.publish_date IS NOT NULL
+        ON CONFLICT (municipal, month) DO UPDATE SET marked_at = now();
+    ELSE
+        INSERT INTO municipal_stats_dirty (municipal, month)
+        SELECT DISTINCT re.municipal, date_trunc('month', a.publish_date)::date
+        FROM old_links l JOIN ads a ON a.id = l.ad JOIN real_estates re ON re.id = l.real_estate
+        WHERE re.municipal IS NOT NULL AND a.publish_date IS NOT NULL
+        ON CONFLICT (municipal, month) DO UPDATE SET marked_at = now();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER ads_real_estates_market_stats_insert
+    AFTER INSERT ON ads_real_estates REFERENCING NEW TABLE AS new_links
+    FOR EACH STATEMENT EXECUTE FUNCTION mark_ads_real_estates_stats_dirty();
+
+CREATE TRIGGER ads_real_estates_market_stats_delete
+    AFTER DELETE ON ads_real_estates REFERENCING OLD TABLE AS old_links
+    FOR EACH STATEMENT EXECUTE FUNCTION mark_ads_real_estates_stats_dirty();
+
+-- real_estates: moving a real estate to another municipal dirties the months of its ads
+-- in both, deleting it those in its municipal (before the delete cascades to ads_real_estates)
+CREATE OR REPLACE FUNCTION mark_real_estates_stats_dirty() RETURNS trigger AS $$
+DECLARE
+    municipals INT[] := ARRAY[OLD.municipal];
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        municipals := municipals || NEW.municipal;
+    END IF;
+    INSERT INTO municipal_stats_dirty (municipal, month)
+    SELECT DISTINCT m.municipal, date_trunc('month', a.publish_date)::date
+    FROM ads_real_estates ar
+    JOIN ads a ON a.id = ar.ad
+    CROSS JOIN unnest(municipals) AS m(municipal)
+    WHERE ar.real_estate = OLD.id AND m.municipal IS NOT NULL AND a.publish_date IS NOT NULL
+    ON CONFLICT (municipal, month) DO UPDATE SET marked_at = now();
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER real_estates_market_stats_update
+    AFTER UPDATE OF municipal ON real_estates
+    FOR EACH ROW WHEN (OLD.municipal IS DISTINCT FROM NEW.municipal)
+    EXECUTE FUNCTION mark_real_estates_stats_dirty();
+
+CREATE TRIGGER real_estates_market_stats_delete
+    BEFORE DELETE ON real_estates
+    FOR EACH ROW EXECUTE FUNCTION mark_real_estates_stats_dirty();
+
+-- the first refresh computes the whole history
+INSERT INTO municipal_stats_dirty (municipal, month)
+SELECT DISTINCT re.municipal, date_trunc('month', a.publish_date)::date
+FROM ads a
+JOIN ads_real_estates ar ON ar.ad = a.id
+JOIN real_estates re ON re.id = ar.real_estate
+WHERE re.municipal IS NOT NULL AND a.publish_date IS NOT NULL
+ON CONFLICT (municipal, month) DO NOTHING;
@@ -0,0 +1,17 @@
+-- Plans of sampled slow queries, captured by slow_queries.py with EXPLAIN (ANALYZE, BUFFERS)
+-- for later review. query is the normalized SQL (parameters replaced by ?), fingerprint
+-- is the same for every execution of it.
+
+CREATE TABLE IF NOT EXISTS slow_query_log (
+    id BIGSERIAL PRIMARY KEY,
+    captured_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    fingerprint TEXT NOT NULL,
+    query TEXT NOT NULL,
+    -- file:line and function of db.py / db_async.py that ran the query
+    call_site TEXT,
+    duration_ms DOUBLE PRECISION NOT NULL,
+    plan JSONB NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS slow_query_log_fingerprint_idx ON slow_query_log (fingerprint, captured_at DESC);
+CREATE INDEX IF NOT EXISTS slow_query_log_captured_at_idx ON slow_query_log (captured_at);
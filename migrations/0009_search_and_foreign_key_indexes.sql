@@ -0,0 +1,32 @@
+-- migrate: no-transaction
+-- The indexes of keyset pagination, ad search and foreign keys. On a database that
+-- predates the migration runner the tables are already large, so they are built without
+-- blocking writes. A build that failed leaves an INVALID index, drop it and migrate again
+
+-- keyset pagination: every sort order of the list endpoints is served by an index on (sort key, id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_publish_date_id_idx ON ads (publish_date, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_price_id_idx ON ads (price, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_type_id_idx ON users (type, id);
+
+-- ad search: the common filter combinations are answered by index scans
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_status_price_id_idx ON ads (status, price, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_for_sale_publish_date_id_idx ON ads (publish_date, id) WHERE status = 'for sale';
+CREATE INDEX CONCURRENTLY IF NOT EXISTS real_estates_municipal_type_rooms_idx ON real_estates (municipal, real_estate_type, no_of_rooms);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS real_estates_municipal_living_space_idx ON real_estates (municipal, living_space);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_real_estates_real_estate_ad_idx ON ads_real_estates (real_estate, ad);
+
+-- foreign keys: joins and ON DELETE CASCADE/SET NULL look rows up by the referencing column
+-- (ads_real_estates.real_estate and real_estates.municipal are covered by the search indexes above,
+-- realtor_reviews.originator by its UNIQUE constraint and the remaining ones by primary keys)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS adresses_municipal_idx ON adresses (municipal);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS broker_agencies_adress_idx ON broker_agencies (adress);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS realtor_profiles_agency_idx ON realtor_profiles (agency);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS customer_profiles_adress_idx ON customer_profiles (adress);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS real_estates_real_estate_type_idx ON real_estates (real_estate_type);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS real_estates_adress_idx ON real_estates (adress);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS real_estate_images_real_estate_idx ON real_estate_images (real_estate);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_customer_idx ON ads (customer);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_realtor_idx ON ads (realtor);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ad_images_picture_idx ON ad_images (picture);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS customer_favorites_ad_idx ON customer_favorites (ad);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS realtor_reviews_realtor_idx ON realtor_reviews (realtor);
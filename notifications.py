@@ -0,0 +1,101 @@
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import sql
+
+from db_setup import get_connection
+
+"""
+Listens for postgres NOTIFY messages in a background thread, so in-process caches of
+every worker can react when the data they hold changes (the notifications are sent by
+triggers or by db.py when it commits a change).
+
+Callbacks are called as callback(con, payload) from the listener thread, with its own
+autocommit connection they may use to reload data. After every (re)connect they are
+called with payload None: notifications sent while the connection was down are lost,
+so the callback should treat everything it caches as possibly stale.
+"""
+
+RECONNECT_DELAY = 1.0  # seconds between attempts to reconnect after an error
+POLL_TIMEOUT = 1.0  # seconds between checks whether the listener should stop
+
+
+class Listener(threading.Thread):
+    def __init__(self, connect=get_connection):
+        super().__init__(name="pg-listener", daemon=True)
+        self._connect = connect
+        self._callbacks = {}  # channel -> [callback]
+        self._stopping = threading.Event()
+        self.connected = threading.Event()
+
+    def subscribe(self, channel, callback):
+        """Registers a callback for a channel, must be called before start()"""
+        self._callbacks.setdefault(channel, []).append(callback)
+
+    def stop(self):
+        self._stopping.set()
+        self.join(timeout=POLL_TIMEOUT * 2)
+
+    def run(self):
+        while not self._stopping.is_set():
+            con = None
+            try:
+                con = self._connect()
+                con.autocommit = True
+                with con.cursor() as cursor:
+                    for channel in self._callbacks:
+                        cursor.execute(
+                            sql.SQL("LISTEN {};").format(sql.Identifier(channel))
+                        )
+                self.connected.set()
+                for channel in self._callbacks:
+                    self._dispatch(con, channel, None)
+                self._listen(con)
+            except Exception as e:
+                print(f"pg-listener: connection lost ({e}), reconnecting")
+                self.connected.clear()
+                self._stopping.wait(RECONNECT_DELAY)
+            finally:
+                if con is not None and not con.closed:
+                    con.close()
+
+    def _listen(self, con):
+        while not self._stopping.is_set():
+            if select.select([con], [], [], POLL_TIMEOUT) == ([], [], []):
+                continue
+            con.poll()
+            while con.notifies:
+                notify = con.notifies.pop(0)
+                self._dispatch(con, notify.channel, notify.payload)
+
+    def _dispatch(self, con, channel, payload):
+        for callback in self._callbacks.get(channel, []):
+            try:
+                callback(con, payload)
+            except psycopg2.Error:
+                raise  # the connection is broken, reconnect
+            except Exception as e:
+                print(f"pg-listener: callback for {channel} failed: {e}")
+
+
+_listener = None
+
+
+def start_listener(subscriptions):
+    """Starts the listener of this worker with a {channel: callback} mapping"""
+    global _listener
+    if _listener is None:
+        _listener = Listener()
+        for channel, callback in subscriptions.items():
+            _listener.subscribe(channel, callback)
+        _listener.start()
+    return _listener
+
+
+def stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,199 @@
+import hashlib
+import os
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+
+import psycopg2
+from psycopg2 import extensions
+
+"""
+Server side prepared statements for the hottest queries of db.py and db_async.py.
+
+execute() runs a query through PREPARE/EXECUTE instead of sending its text: the first
+time a connection sees a query it is prepared under a name derived from its text, after
+that only `EXECUTE name(params)` is sent, so postgres skips parsing and analysis and,
+after a few executions, can reuse a generic plan. Only fixed query strings (the query
+constants of db.py) are prepared. Queries built with psycopg2.sql (the keyset pages, whose
+text depends on the sort, cursor and fields of the request) run unprepared, so clients
+can't fill the statement cache and the sessions with one-off statements.
+
+Prepared statements live as long as the session, so which ones a connection has is
+tracked per connection (connections the pool closes drop out on their own). When a
+statement is gone (DISCARD ALL, a server restart behind the pool) or postgres refuses to
+reuse it because a migration changed the columns it returns, it is prepared again and
+the query retried, as long as it was the first statement of its transaction and nothing
+is lost by rolling back. Later in a transaction the error is raised once and the next call
+prepares the statement again. Set DB_PREPARE_STATEMENTS=0 to send plain queries (needed
+behind a pooler in transaction mode, such as pgbouncer).
+"""
+
+PREPARE_STATEMENTS = os.getenv("DB_PREPARE_STATEMENTS", "1") == "1"
+# statements prepared per connection at most, the others run unprepared
+MAX_PREPARED = int(os.getenv("DB_MAX_PREPARED", "200"))
+# distinct queries whose statement (and query_of() entry) is kept
+STATEMENT_CACHE_SIZE = 1024
+
+_PLACEHOLDER = re.compile(r"%%|%s")
+# errors after which the statement has to be prepared again
+_STALE = (
+    psycopg2.errors.InvalidSqlStatementName,
+    psycopg2.errors.FeatureNotSupported,
+    psycopg2.errors.DuplicatePreparedStatement,
+)
+# ... and those after which it still exists
+_EXISTS = (
+    psycopg2.errors.FeatureNotSupported,
+    psycopg2.errors.DuplicatePreparedStatement,
+)
+
+_prepared = weakref.WeakKeyDictionary()  # psycopg2 connection -> prepared names
+_lock = threading.Lock()
+_counts = {"prepared": 0, "executed": 0, "reprepared": 0, "unprepared": 0}
+_queries = OrderedDict()  # statement name -> the query it was prepared from
+
+
+def statement(query):
+    """
+    (name, PREPARE sql, EXECUTE sql) of a query with %s placeholders,
+    None for queries that can't be prepared (named %(x)s placeholders)
+    """
+    found = _statement(query)
+    if found is not None:
+        with _lock:
+            # least recently used first, bounded like the lru_cache of _statement()
+            _queries[found[0]] = query
+            _queries.move_to_end(found[0])
+            while len(_queries) > STATEMENT_CACHE_SIZE:
+                _queries.popitem(last=False)
+    return found
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _statement(query):
+    if "%(" in query:
+        return None
+    count = 0
+
+    def placeholder(match):
+        nonlocal count
+        if match.group() == "%%":
+            return "%"
+        count += 1
+        return f"${count}"
+
+    body = _PLACEHOLDER.sub(placeholder, query.strip().rstrip(";"))
+    name = "stmt_" + hashlib.sha1(body.encode()).hexdigest()[:16]
+    args = f"({', '.join(['%s'] * count)})" if count else ""
+    return name, f"PREPARE {name} AS {body}", f"EXECUTE {name}{args}"
+
+
+def query_of(run):
+    """The query behind an `EXECUTE name(...)` sent by execute(), None for other statements"""
+    if not run.startswith("EXECUTE stmt_"):
+        return None
+    return _queries.get(run[len("EXECUTE ") :].split("(", 1)[0])
+
+
+def _count(key):
+    with _lock:
+        _counts[key] += 1
+
+
+def _plan(con, query):
+    """
+    What to run for a query on a connection: its statement and the set of names
+    prepared on the connection, or None to run it unprepared
+    """
+    if not PREPARE_STATEMENTS or not isinstance(query, str):
+        # a psycopg2.sql query is built per request, see the module docstring
+        return None
+    found = statement(query)
+    if found is None:
+        return None
+    with _lock:
+        prepared = _prepared.setdefault(con, set())
+    if found[0] not in prepared and (
+        len(prepared) >= MAX_PREPARED
+        # a failing PREPARE would abort the transaction around it, so prepare only
+        # as the first statement of a transaction (always the case on aiopg)
+        or con.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+    ):
+        return None
+    return found, prepared
+
+
+def _forget(prepared, name, error):
+    """Drops a stale statement, True if it still exists and has to be deallocated"""
+    prepared.discard(name)
+    _count("reprepared")
+    # still there if a migration changed its result (or a failed retry left it behind),
+    # it is prepared again under the same name
+    return isinstance(error, _EXISTS)
+
+
+def execute(cursor, query, params=None):
+    """cursor.execute(query, params), through a prepared statement when possible"""
+    con = cursor.connection
+    first = con.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+    plan = _plan(con, query)
+    if plan is None:
+        _count("unprepared")
+        return cursor.execute(query, params)
+    (name, prepare, run), prepared = plan
+    try:
+        if name not in prepared:
+            cursor.execute(prepare)
+            prepared.add(name)
+            _count("prepared")
+        cursor.execute(run, params)
+    except _STALE as e:
+        deallocate = _forget(prepared, name, e)
+        if not first:
+            raise
+        con.rollback()
+        if deallocate:
+            cursor.execute(f"DEALLOCATE {name}")
+        cursor.execute(prepare)
+        prepared.add(name)
+        cursor.execute(run, params)
+    _count("executed")
+
+
+async def execute_async(cursor, query, params=None):
+    """execute() for an aiopg cursor"""
+    con = cursor.raw.connection
+    first = con.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+    plan = _plan(con, query)
+    if plan is None:
+        _count("unprepared")
+        return await cursor.execute(query, params)
+    (name, prepare, run), prepared = plan
+    try:
+        if name not in prepared:
+            await cursor.execute(prepare)
+            prepared.add(name)
+            _count("prepared")
+        await cursor.execute(run, params)
+    except _STALE as e:
+        deallocate = _forget(prepared, name, e)
+        if not first:
+            raise
+        # autocommit, the failed statement left no transaction behind
+        if deallocate:
+            await cursor.execute(f"DEALLOCATE {name}")
+        await cursor.execute(prepare)
+        prepared.add(name)
+        await cursor.execute(run, params)
+    _count("executed")
+
+
+def stats():
+    with _lock:
+        return {
+            **_counts,
+            "connections": len(_prepared),
+            "statements": sum(len(names) for names in _prepared.values()),
+        }
@@ -0,0 +1,256 @@
+import asyncio
+import math
+import os
+import random
+import time
+
+import aiopg
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+from db_setup import POOL_MAX_LIFETIME, POOL_MAX_SIZE, POOL_TIMEOUT, connection_kwargs
+
+"""
+Read/write splitting: the GET endpoints using the async pool (get_async_db in app.py) read
+from a streaming replica when DATABASE_REPLICA_URLS lists any, everything else uses the
+primary (DATABASE_URL): writes, the sync endpoints and requests that must see a write.
+
+- Read your writes: every POST/PUT/PATCH/DELETE response sets a db_primary_until cookie,
+and the GETs of a client that has one which hasn't expired yet (DB_READ_YOUR_WRITES_SECONDS)
+go to the primary, so a client reloading what it just changed doesn't get the old version
+from a replica that hasn't replayed the change yet
+- Lag: a background task asks every replica how far behind it is each
+DB_REPLICA_CHECK_INTERVAL seconds. Replicas more than DB_REPLICA_MAX_LAG seconds behind,
+that didn't answer, or whose WAL receiver isn't streaming from the primary (or hasn't
+heard from it for DB_REPLICA_RECEIVER_TIMEOUT seconds) get no reads until that changes.
+Reading pg_stat_wal_receiver takes superuser or pg_read_all_stats for the user of the
+replica DSNs, without it no replica looks connected and every read goes to the primary
+- Fallback: when no replica is eligible, or the chosen one fails to hand out a connection,
+the read goes to the primary instead of failing
+"""
+
+MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))  # seconds
+CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "1"))  # seconds
+# a pin shorter than the lag a replica may have wouldn't hide it
+PIN_SECONDS = max(
+    float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "10")), MAX_LAG + CHECK_INTERVAL
+)
+# an idle primary sends nothing until the receiver pings it after wal_receiver_timeout / 2
+# (30s by default), so a quiet receiver isn't a disconnected one before that
+RECEIVER_TIMEOUT = float(os.getenv("DB_REPLICA_RECEIVER_TIMEOUT", "45"))  # seconds
+PIN_COOKIE = "db_primary_until"
+READ_METHODS = ("GET", "HEAD")
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# lag: 0 on the primary, and on a replica that replayed everything it received however
+# long ago the last transaction was, otherwise the age of the last replayed transaction.
+# A replica whose receiver stopped has replayed everything it received too, so receiving
+# tells whether it still streams from the primary and heard from it recently
+LAG_QUERY = """
+    SELECT
+        CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+        END AS lag,
+        NOT pg_is_in_recovery() OR coalesce(
+            receiver.status = 'streaming'
+            AND receiver.last_msg_receipt_time > now() - make_interval(secs => %s),
+            false
+        ) AS receiving
+    FROM (SELECT 1) AS one LEFT JOIN pg_stat_wal_receiver AS receiver ON true;
+"""
+
+
+class Replica:
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.pool = None
+        self.lag = None  # seconds, None until known
+        self.healthy = False
+        self.receiving = False  # streaming WAL from the primary
+        self.reads = 0
+        self.errors = 0
+
+    @property
+    def name(self):
+        """host:port/dbname of the replica, without the credentials of its DSN"""
+        params = parse_dsn(self.dsn)
+        return (
+            f"{params.get('host', 'localhost')}:{params.get('port', 5432)}"
+            f"/{params.get('dbname', '')}"
+        )
+
+    def eligible(self):
+        return (
+            self.healthy
+            and self.receiving
+            and self.lag is not None
+            and self.lag <= MAX_LAG
+        )
+
+    async def check(self):
+        """Updates the lag of the replica, opening its pool on the first success"""
+        try:
+            await asyncio.wait_for(self._check(), POOL_TIMEOUT)
+        except (asyncio.TimeoutError, psycopg2.Error, OSError) as e:
+            if self.healthy:
+                print(f"replicas: {self.name} unavailable ({e})")
+            self.healthy = False
+            self.errors += 1
+
+    async def _check(self):
+        if self.pool is None:
+            self.pool = await aiopg.create_pool(
+                minsize=1,
+                maxsize=POOL_MAX_SIZE,
+                pool_recycle=POOL_MAX_LIFETIME,
+                **connection_kwargs(self.dsn),
+            )
+        async with self.pool.acquire() as con:
+            async with con.cursor() as cursor:
+                await cursor.execute(LAG_QUERY, (RECEIVER_TIMEOUT,))
+                lag, receiving = await cursor.fetchone()
+        self.lag = float(lag) if lag is not None else None
+        if receiving != self.receiving and self.healthy:
+            state = "receiving" if receiving else "not receiving"
+            print(f"replicas: {self.name} {state} WAL from the primary")
+        self.receiving = receiving
+        if not self.healthy:
+            print(f"replicas: {self.name} available, {self.lag}s behind")
+        self.healthy = True
+
+    async def acquire(self):
+        return await asyncio.wait_for(self.pool.acquire(), POOL_TIMEOUT)
+
+    async def release(self, con):
+        await self.pool.release(con)
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "receiving": self.receiving,
+            "lag_seconds": None if self.lag is None else round(self.lag, 3),
+            "eligible": self.eligible(),
+            "reads": self.reads,
+            "errors": self.errors,
+            "in_use": self.pool.size - self.pool.freesize if self.pool else 0,
+        }
+
+
+_replicas = []
+_monitor = None
+_fallbacks = 0  # reads that went to the primary for want of an eligible replica
+
+
+async def _monitor_lag():
+    while True:
+        await asyncio.sleep(CHECK_INTERVAL)
+        await asyncio.gather(*(replica.check() for replica in _replicas))
+
+
+async def init_replicas(dsns):
+    """Connects to the replicas and starts watching their lag, called on application startup"""
+    global _monitor
+    if _replicas or not dsns:
+        return
+    _replicas.extend(Replica(dsn) for dsn in dsns)
+    await asyncio.gather(*(replica.check() for replica in _replicas))
+    _monitor = asyncio.create_task(_monitor_lag())
+
+
+async def close_replicas():
+    global _monitor
+    if _monitor is not None:
+        _monitor.cancel()
+        try:
+            await _monitor
+        except asyncio.CancelledError:
+            pass
+        _monitor = None
+    for replica in _replicas:
+        await replica.close()
+    _replicas.clear()
+
+
+def pinned(request):
+    """Whether the client wrote recently enough that it must read from the primary"""
+    try:
+        return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def routable(request):
+    """Whether the request may read from a replica"""
+    return bool(_replicas) and request.method in READ_METHODS and not pinned(request)
+
+
+async def acquire_read():
+    """
+    A connection of an eligible replica and the replica, picked at random to spread the
+    reads, or (None, None) when the read has to go to the primary
+    """
+    global _fallbacks
+    candidates = [replica for replica in _replicas if replica.eligible()]
+    random.shuffle(candidates)
+    for replica in candidates:
+        try:
+            con = await replica.acquire()
+        except asyncio.TimeoutError:
+            # busy, not broken: the primary takes this read
+            continue
+        except (psycopg2.Error, OSError) as e:
+            print(f"replicas: {replica.name} failed to connect ({e})")
+            replica.healthy = False
+            replica.errors += 1
+            continue
+        replica.reads += 1
+        return con, replica
+    _fallbacks += 1
+    return None, None
+
+
+class ReadYourWritesMiddleware:
+    """ASGI middleware pinning a client that wrote to the primary, see the module docstring"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS or not _replicas:
+            return await self.app(scope, receive, send)
+
+        async def send_with_pin(message):
+            if message["type"] == "http.response.start":
+                cookie = (
+                    f"{PIN_COOKIE}={time.time() + PIN_SECONDS:.3f}; "
+                    f"Max-Age={math.ceil(PIN_SECONDS)}; Path=/; HttpOnly; SameSite=Lax"
+                )
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"set-cookie", cookie.encode()),
+                    ],
+                }
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
+
+
+def stats():
+    """Lag and reads of every replica, reported in /pool/stats"""
+    return {
+        "max_lag_seconds": MAX_LAG,
+        "read_your_writes_seconds": PIN_SECONDS,
+        "replicas": [replica.stats() for replica in _replicas],
+        "fallbacks": _fallbacks,
+    }
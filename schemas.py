@@ -1,9 +1,29 @@
 # Add Pydantic schemas here that you'll use in your routes / endpoints
 # Pydantic schemas are used to validate data that you receive, or to make sure that whatever data
 # you send back to the client follows a certain structure
-from datetime import date
+from datetime import date, datetime
 from typing import Optional
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, ConfigDict, Field, EmailStr, field_validator
+
+import lookups
+
+# --- LOOKUPS ---
+
+class RealestateLookups(BaseModel):
+    # checked against the cached lookup tables, without a query
+    @field_validator("real_estate_type", check_fields=False)
+    @classmethod
+    def real_estate_type_exists(cls, value):
+        if value is not None and not lookups.id_exists("real_estate_types", value):
+            raise ValueError("unknown real estate type")
+        return value
+
+    @field_validator("municipal", check_fields=False)
+    @classmethod
+    def municipal_exists(cls, value):
+        if value is not None and not lookups.id_exists("municipals", value):
+            raise ValueError("unknown municipal")
+        return value
 
 # --- USER ---
 
@@ -62,20 +82,101 @@ class AdUpdate(BaseModel):
     price: float
     sold_price:float
     status: str = Field(..., max_length=255)
+
+class AdBatchUpdate(AdUpdate):
+    id: int
+
+# favorites
+class FavoriteCreate(BaseModel):
+    ad: int
+
+# the listing as returned by GET /ads/{ad_id}/full
+class UserSummary(BaseModel):
+    id: int
+    name: Optional[str] = None
+    email: Optional[str] = None
+
+class RealtorSummary(UserSummary):
+    agency: Optional[str] = None
+
+class Image(BaseModel):
+    id: int
+    picture_link: str
+
+class AdressFull(BaseModel):
+    street: Optional[str] = None
+    street_no: Optional[str] = None
+    postal_code: Optional[str] = None
+    postal_area: Optional[str] = None
+
+class HouseProfile(BaseModel):
+    building_plot: Optional[float] = None
+
+class ApartmentProfile(BaseModel):
+    apartment_id: Optional[str] = None
+    floor: Optional[int] = None
+
+class RealestateFull(BaseModel):
+    id: int
+    real_estate_type: Optional[str] = None
+    municipal: Optional[str] = None
+    living_space: Optional[int] = None
+    no_of_rooms: Optional[int] = None
+    adress: Optional[AdressFull] = None
+    house: Optional[HouseProfile] = None
+    apartment: Optional[ApartmentProfile] = None
+    images: list[Image] = []
+
+class AdFull(BaseModel):
+    id: int
+    agreement: Optional[str] = None
+    publish_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    sold_price: Optional[float] = None
+    status: Optional[str] = None
+    customer: Optional[UserSummary] = None
+    realtor: Optional[RealtorSummary] = None
+    real_estates: list[RealestateFull] = []
+    images: list[Image] = []
+
+class AdFullResponse(BaseModel):
+    ad: AdFull
+
+class AdSearch(RealestateLookups):
+    q: Optional[str] = Field(None, min_length=1, max_length=200)
+    municipal: Optional[int] = None
+    real_estate_type: Optional[int] = None
+    status: Optional[str] = Field(None, max_length=50)
+    min_price: Optional[float] = Field(None, ge=0)
+    max_price: Optional[float] = Field(None, ge=0)
+    min_rooms: Optional[int] = Field(None, ge=0)
+    max_rooms: Optional[int] = Field(None, ge=0)
+    min_living_space: Optional[int] = Field(None, ge=0)
+    max_living_space: Optional[int] = Field(None, ge=0)
+    limit: int = Field(20, ge=1, le=100)
+    sort: Optional[str] = None  # id, or -rank when searching on q
+    cursor: Optional[str] = None
+    include: Optional[str] = None  # images,real_estates
+
 # real estate
-class RealestateCreate(BaseModel):
+class RealestateCreate(RealestateLookups):
     real_estate_type: int
     municipal: int
     adress: int
     living_space: int
     no_of_rooms: int
 
-class RealestateUpdate(BaseModel):
+class RealestateUpdate(RealestateLookups):
     real_estate_type: int
     municipal: int
     adress: int
     living_space: int
     no_of_rooms: int
+
+class RealestateBatchUpdate(RealestateUpdate):
+    id: int
     
 # review
 class RealtorReviewCreate(BaseModel):
@@ -91,3 +192,26 @@ class RealtorReviewUpdate(BaseModel):
     comment: str = Field(..., max_length=255)
 
     
+
+# bulk import
+class ListingImport(BaseModel):
+    # one row of a listings import: a real estate and its ad, lookups given by name
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    municipal: str = Field(..., max_length=100)
+    street: str = Field(..., max_length=100)
+    street_no: str = Field(..., max_length=20)
+    postal_code: Optional[str] = Field(None, max_length=20)
+    postal_area: Optional[str] = Field(None, max_length=100)
+    real_estate_type: str = Field(..., max_length=50)
+    living_space: int
+    no_of_rooms: int
+    agreement: str = Field(..., max_length=255)
+    customer: int
+    realtor: int
+    publish_date: date
+    end_date: date
+    description: str = Field(..., max_length=255)
+    price: float
+    sold_price: Optional[float] = None
+    status: str = Field(..., max_length=50)
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+import prepared
+
+"""
+Slow query log: statements slower than SLOW_QUERY_MS are printed with their normalized SQL
+(literals and parameters replaced by ?, so no customer data ends up in the log), a
+fingerprint of it that is the same for every execution of the query, and the db.py or
+db_async.py function that ran it, e.g.
+
+    slow-query: 812.4 ms [3f9c0e1a7b2d4c55] db_async.py:286 get_all_realtor_reviews_db: select ... limit ?
+
+Every statement of the api's connections passes through check() (called by the timed
+cursors of metrics.py), which costs one comparison unless the statement is slow.
+
+A sample (SLOW_QUERY_EXPLAIN_SAMPLE, 0 to 1) of the slow SELECTs is run again by a background
+thread under EXPLAIN (ANALYZE, BUFFERS) in a read only transaction, and the plan is stored
+in the slow_query_log table (migrations/0008_slow_query_log.sql) for later review, at most
+once per fingerprint every SLOW_QUERY_EXPLAIN_INTERVAL seconds. Writes are never explained,
+EXPLAIN ANALYZE would run them again. The plans can contain the values the query filtered on.
+"""
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))  # 0 turns the log off
+EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0"))
+EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "60"))  # seconds
+# an explain runs the query again, this bounds what it can cost
+EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "10000"))
+# captures waiting for the background thread at most, the others are dropped
+EXPLAIN_QUEUE_SIZE = 100
+
+INSERT_SLOW_QUERY = """
+    INSERT INTO slow_query_log (fingerprint, query, call_site, duration_ms, plan)
+    VALUES (%s, %s, %s, %s, %s);
+"""
+
+_SPACE = re.compile(r"\s+")
+# string and number literals, psycopg2 and postgres placeholders (numbers inside names stay)
+_LITERAL = re.compile(r"'(?:[^']|'')*'|(?<![\w.$])\d+(?:\.\d+)?(?![\w.])|%s|\$\d+")
+_LIST = re.compile(r"\(\?(?:, \?)+\)")
+_READ_ONLY = re.compile(
+    r"^(select|with)\b(?!.*\b(insert|update|delete)\b)", re.I | re.S
+)
+# frames of these files are the instrumentation, not the caller
+_SKIP_FILES = ("slow_queries.py", "metrics.py", "prepared.py")
+
+_local = threading.local()
+_lock = threading.Lock()
+_last_explained = {}  # fingerprint -> time of the last capture
+
+
+def normalize(query):
+    """The query with whitespace collapsed and every literal or parameter replaced by ?"""
+    query = _SPACE.sub(" ", query).strip().rstrip(";")
+    return _LIST.sub("(?, ...)", _LITERAL.sub("?", query))
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def call_site():
+    """file:line function of the innermost caller outside the instrumentation and libraries"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        name = os.path.basename(filename)
+        if name not in _SKIP_FILES and "site-packages" not in filename:
+            return f"{name}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def check(cursor, query, vars, seconds):
+    """
+    Logs the statement if it was slow, and queues it for an explain if sampled.
+    `cursor` is the psycopg2 cursor that ran it (for an aiopg cursor, its .raw)
+    """
+    if SLOW_QUERY_MS <= 0 or seconds * 1000 < SLOW_QUERY_MS:
+        return
+    if getattr(_local, "explaining", False):
+        return
+    try:
+        if not isinstance(query, str):
+            query = query.as_string(cursor)
+        # a prepared statement is logged (and explained) as the query it was prepared from
+        query = prepared.query_of(query) or query
+        normalized = normalize(query)
+        site = call_site()
+        print(
+            f"slow-query: {seconds * 1000:.1f} ms [{fingerprint(normalized)}] "
+            f"{site}: {normalized}"
+        )
+        if _explainer is not None and _sampled(normalized):
+            _explainer.submit(
+                normalized, site, seconds * 1000, cursor.mogrify(query, vars).decode()
+            )
+    except Exception as e:
+        # the log must never fail the query it reports on
+        print(f"slow-query: could not log a slow statement ({e})")
+
+
+def _sampled(normalized):
+    if EXPLAIN_SAMPLE <= 0 or not _READ_ONLY.match(normalized):
+        return False
+    if random.random() >= EXPLAIN_SAMPLE:
+        return False
+    key = fingerprint(normalized)
+    now = time.monotonic()
+    with _lock:
+        if now - _last_explained.get(key, -EXPLAIN_INTERVAL) < EXPLAIN_INTERVAL:
+            return False
+        _last_explained[key] = now
+    return True
+
+
+class Explainer(threading.Thread):
+    """Runs the queued slow queries under EXPLAIN ANALYZE with a pooled connection"""
+
+    def __init__(self, pool):
+        super().__init__(name="slow-query-explainer", daemon=True)
+        self._pool = pool
+        self._queue = queue.Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+        self._stopping = threading.Event()
+
+    def submit(self, normalized, site, duration_ms, query):
+        try:
+            self._queue.put_nowait((normalized, site, duration_ms, query))
+        except queue.Full:
+            pass
+
+    def stop(self):
+        self._stopping.set()
+        self.join(timeout=5)
+
+    def run(self):
+        # the explains are slow too, they must not be logged and explained again
+        _local.explaining = True
+        while not self._stopping.is_set():
+            try:
+                capture = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                with self._pool.connection() as con:
+                    explain(con, *capture)
+            except Exception as e:
+                print(f"slow-query-explainer: explain failed ({e})")
+
+
+def explain(con, normalized, site, duration_ms, query):
+    """Stores the EXPLAIN (ANALYZE, BUFFERS) plan of a read only query in slow_query_log"""
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute("SET TRANSACTION READ ONLY;")
+            cursor.execute("SET LOCAL statement_timeout = %s;", (EXPLAIN_TIMEOUT_MS,))
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}")
+            plan = cursor.fetchone()[0]
+    with con:
+        with con.cursor() as cursor:
+            cursor.execute(
+                INSERT_SLOW_QUERY,
+                (
+                    fingerprint(normalized),
+                    normalized,
+                    site,
+                    duration_ms,
+                    json.dumps(plan),
+                ),
+            )
+
+
+_explainer = None
+
+
+def start_explainer(pool):
+    """Starts capturing plans of slow queries in this worker, unless the sample rate is 0"""
+    global _explainer
+    if _explainer is None and EXPLAIN_SAMPLE > 0 and SLOW_QUERY_MS > 0:
+        _explainer = Explainer(pool)
+        _explainer.start()
+    return _explainer
+
+
+def stop_explainer():
+    global _explainer
+    if _explainer is not None:
+        _explainer.stop()
+        _explainer = None
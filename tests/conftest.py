@@ -0,0 +1,65 @@
+import os
+import sys
+
+import psycopg2
+import pytest
+from psycopg2 import sql
+from psycopg2.extensions import make_dsn, parse_dsn
+
+# the modules under test are flat files in the repository root
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+import db_setup  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """A test client of the app, whose connection a test sets with stubs.serve()"""
+    from fastapi.testclient import TestClient
+
+    import prepared
+    from app import app
+
+    # plain statements, a PREPARE would be one more execute
+    monkeypatch.setattr(prepared, "PREPARE_STATEMENTS", False)
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture(scope="module")
+def scratch_dsn():
+    """
+    DSN of a migrated and seeded scratch database created next to the one in DATABASE_URL
+    and dropped afterwards. Skips the tests using it when DATABASE_URL is not set, the
+    server can't be reached or its user may not create databases
+    """
+    if not db_setup.DATABASE_URL:
+        pytest.skip("DATABASE_URL is not set")
+    try:
+        admin = psycopg2.connect(db_setup.DATABASE_URL, connect_timeout=3)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"DATABASE_URL is unreachable ({e})")
+    admin.autocommit = True  # CREATE/DROP DATABASE can't run in a transaction
+    name = f"{parse_dsn(db_setup.DATABASE_URL).get('dbname', 'hemnet')}_test"
+    drop = sql.SQL("DROP DATABASE IF EXISTS {};").format(sql.Identifier(name))
+    with admin.cursor() as cursor:
+        cursor.execute(drop)
+        try:
+            cursor.execute(sql.SQL("CREATE DATABASE {};").format(sql.Identifier(name)))
+        except psycopg2.errors.InsufficientPrivilege:
+            admin.close()
+            pytest.skip("the user of DATABASE_URL may not create databases")
+    dsn = make_dsn(db_setup.DATABASE_URL, dbname=name)
+    try:
+        with pytest.MonkeyPatch.context() as patch:
+            # migrate() and seed() use the scratch database
+            patch.setattr(db_setup, "DATABASE_URL", dsn)
+            patch.chdir(REPOSITORY)
+            db_setup.migrate()
+            db_setup.seed()
+        yield dsn
+    finally:
+        with admin.cursor() as cursor:
+            cursor.execute(drop)
+        admin.close()
@@ -0,0 +1,122 @@
+"""
+Stand-ins for an aiopg connection, so the async endpoints and db_async.py can be tested
+without a database: every statement is recorded and answered with the rows the test's
+StubConnection.rows() gives for it.
+"""
+
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+from psycopg2 import extensions
+
+import metrics
+from app import app, get_async_db
+from db import AD_QUERY, AD_VERSION_QUERY, UPDATE_AD_QUERY
+
+
+class StubCursor:
+    """An aiopg cursor that records its statements and answers from StubConnection.rows()"""
+
+    def __init__(self, con):
+        self.con = con
+        self.raw = self  # prepared.py reads cursor.raw.connection
+        self.connection = con
+        self._rows = []
+
+    async def execute(self, query, params=None):
+        self.con.executed.append(query)
+        self.con.params.append(params)
+        self._rows = self.con.rows(query, params)
+
+    @property
+    def rowcount(self):
+        return len(self._rows)
+
+    async def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    async def fetchall(self):
+        return self._rows
+
+    @asynccontextmanager
+    async def begin(self):
+        self.con.transactions.append("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.con.transactions.append("ROLLBACK")
+            raise
+        self.con.transactions.append("COMMIT")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class StubConnection:
+    """A connection answering every statement with no rows, tests override rows()"""
+
+    def __init__(self):
+        self.executed = []
+        self.params = []
+        self.transactions = []
+
+    def cursor(self, *args, **kwargs):
+        return StubCursor(self)
+
+    def get_transaction_status(self):
+        return extensions.TRANSACTION_STATUS_IDLE
+
+    def rows(self, query, params):
+        return []
+
+    def ran(self, query):
+        """How many times the query was executed"""
+        return self.executed.count(query)
+
+
+def serve(con):
+    """Makes the endpoints use `con`, wrapped like get_async_db wraps its connections"""
+
+    async def stub_db():
+        return metrics.TimedAsyncConnection(con)
+
+    app.dependency_overrides[get_async_db] = stub_db
+
+
+class AdConnection(StubConnection):
+    """
+    A connection holding ads (id -> version number) for the ad detail queries: GET
+    /ads/{ad_id} and its version probe, and PUT /ads/{ad_id} which bumps the version
+    """
+
+    def __init__(self, *ad_ids):
+        super().__init__()
+        self.versions = {ad_id: 1 for ad_id in ad_ids}
+        self.updated_at = datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+
+    def ad(self, ad_id):
+        return {
+            "id": ad_id,
+            "price": 1000000.0,
+            "status": "for sale",
+            "version": f"{self.versions[ad_id]}.1.1",
+            "updated_at": self.updated_at,
+        }
+
+    def rows(self, query, params):
+        ad_id = params[-1] if params else None
+        if not isinstance(ad_id, int) or ad_id not in self.versions:
+            return []
+        if query == AD_QUERY:
+            return [self.ad(ad_id)]
+        if query == AD_VERSION_QUERY:
+            ad = self.ad(ad_id)
+            return [{"version": ad["version"], "updated_at": ad["updated_at"]}]
+        if query == UPDATE_AD_QUERY:
+            self.versions[ad_id] += 1
+            self.updated_at += timedelta(minutes=1)
+            return [self.ad(ad_id)]
+        return []
@@ -0,0 +1,93 @@
+"""
+GET /ads/{ad_id}/full: the ad, its customer and realtor, its real estates (adress,
+house/apartment profile, images) and its images come back from one statement, nested
+as AdFullResponse, and an unknown ad is a 404.
+
+Against a scratch database (skipped without DATABASE_URL, see conftest.py) the json of
+AD_FULL_QUERY is checked to validate as AdFull and to hold every linked real estate.
+"""
+
+import psycopg2
+
+from db import AD_FULL_QUERY
+from schemas import AdFull
+from stubs import StubConnection, serve
+
+AD = {
+    "id": 5,
+    "agreement": "exclusive",
+    "publish_date": "2024-05-01T00:00:00",
+    "end_date": None,
+    "description": "Uppsala, villa",
+    "price": 4500000,
+    "sold_price": None,
+    "status": "for sale",
+    "customer": {"id": 1, "name": "Anna", "email": "anna@example.com"},
+    "realtor": None,
+    "real_estates": [
+        {
+            "id": 7,
+            "real_estate_type": "Villa",
+            "municipal": "Uppsala",
+            "living_space": 120,
+            "no_of_rooms": 5,
+            "adress": {
+                "street": "Storgatan",
+                "street_no": "1",
+                "postal_code": "75320",
+                "postal_area": "Uppsala",
+            },
+            "house": {"building_plot": 800.0},
+            "apartment": None,
+            "images": [{"id": 3, "picture_link": "https://example.com/3.jpg"}],
+        }
+    ],
+    "images": [{"id": 3, "picture_link": "https://example.com/3.jpg"}],
+}
+
+
+class FullAdConnection(StubConnection):
+    """A connection answering AD_FULL_QUERY with the json of ad 5"""
+
+    def rows(self, query, params):
+        if query == AD_FULL_QUERY and params == (5,):
+            return [(AD,)]
+        return []
+
+
+def test_listing_page_comes_from_one_statement(client):
+    con = FullAdConnection()
+    serve(con)
+    response = client.get("/ads/5/full")
+    assert response.status_code == 200
+    ad = response.json()["ad"]
+    assert ad["customer"]["name"] == "Anna"
+    assert ad["realtor"] is None
+    (real_estate,) = ad["real_estates"]
+    assert real_estate["adress"]["street"] == "Storgatan"
+    assert real_estate["house"] == {"building_plot": 800.0}
+    assert real_estate["images"] == AD["images"]
+    assert con.executed == [AD_FULL_QUERY]
+
+
+def test_unknown_ad_is_not_found(client):
+    serve(FullAdConnection())
+    assert client.get("/ads/6/full").status_code == 404
+
+
+def test_full_ad_json_matches_the_schema(scratch_dsn):
+    con = psycopg2.connect(scratch_dsn)
+    try:
+        with con.cursor() as cursor:
+            cursor.execute(
+                "SELECT ad, array_agg(real_estate ORDER BY real_estate) FROM ads_real_estates GROUP BY ad ORDER BY ad LIMIT 1;"
+            )
+            ad_id, real_estates = cursor.fetchone()
+            cursor.execute(AD_FULL_QUERY, (ad_id,))
+            ad = AdFull(**cursor.fetchone()[0])
+            cursor.execute(AD_FULL_QUERY, (-1,))
+            assert cursor.fetchone() is None
+    finally:
+        con.close()
+    assert ad.id == ad_id
+    assert [real_estate.id for real_estate in ad.real_estates] == real_estates
@@ -0,0 +1,102 @@
+"""
+Batch writes: the outcome of every item is matched to it by id, not by the order of the
+rows RETURNING gives back (which postgres doesn't guarantee), for inserts as well as
+updates. The stub connection answers RETURNING in reverse order.
+"""
+
+from types import SimpleNamespace
+
+from db import (
+    NEXT_IDS_QUERY,
+    add_real_estates_batch_db,
+    update_real_estates_batch_db,
+)
+
+FIRST_ID = 100
+
+
+class StubCursor:
+    def __init__(self, con):
+        self.con = con
+        self.connection = con
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self._rows = []
+        if query == NEXT_IDS_QUERY:
+            table, count = params
+            self.con.sequences.append(table)
+            self._rows = [{"id": FIRST_ID + i} for i in range(count)]
+        elif isinstance(query, bytes):
+            # one execute_values() page, of the rows mogrify() was given
+            values, self.con.mogrified = self.con.mogrified, []
+            self.con.written.append(values)
+            ids = [row[0] for row in values if row[0] in self.con.existing]
+            self._rows = [{"id": id} for id in reversed(ids)]
+
+    def mogrify(self, template, args):
+        self.con.mogrified.append(tuple(args))
+        return b"(...)"
+
+    def fetchall(self):
+        return self._rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class StubConnection:
+    encoding = "UTF8"
+
+    def __init__(self, existing=()):
+        self.existing = set(existing)
+        self.sequences = []
+        self.written = []
+        self.mogrified = []
+
+    def cursor(self, *args, **kwargs):
+        return StubCursor(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def real_estate(rooms, id=None):
+    return SimpleNamespace(
+        id=id,
+        real_estate_type=1,
+        municipal=1,
+        adress=1,
+        living_space=80,
+        no_of_rooms=rooms,
+    )
+
+
+def test_inserted_rows_get_the_ids_taken_for_them():
+    con = StubConnection(existing=range(FIRST_ID, FIRST_ID + 3))
+    outcomes = add_real_estates_batch_db(
+        con, [real_estate(rooms) for rooms in (1, 2, 3)]
+    )
+    assert con.sequences == ["real_estates"]
+    # every row is inserted with its id, the outcomes follow the items
+    assert [(row[0], row[-1]) for row in con.written[0]] == [
+        (100, 1),
+        (101, 2),
+        (102, 3),
+    ]
+    assert outcomes == [{"id": 100}, {"id": 101}, {"id": 102}]
+
+
+def test_updated_rows_are_matched_by_id():
+    con = StubConnection(existing={7, 9})
+    outcomes = update_real_estates_batch_db(
+        con, [real_estate(1, id=7), real_estate(2, id=8), real_estate(3, id=9)]
+    )
+    assert con.sequences == []
+    assert outcomes == [{"id": 7}, {"error": "not found"}, {"id": 9}]
@@ -0,0 +1,133 @@
+"""
+Bulk import: a value that passes the checks of ListingImport but that postgres refuses
+(here an integer out of range, raised by the COPY like postgres does) rejects only its
+own row, with the error, and the other rows of the chunk are still imported.
+
+The import runs against a stub connection that keeps the row numbers loaded by committed
+transactions and savepoints, and against lookups that are never looked up.
+"""
+
+import csv
+import io
+import json
+
+import psycopg2
+import pytest
+
+from bulk_import import LOAD_STAGED_LISTINGS, LookupCache, import_listings
+
+INT_MAX = 2**31 - 1
+
+
+class StubCursor:
+    def __init__(self, con):
+        self.con = con
+        self.staged = []
+
+    def execute(self, query, params=None):
+        self.con.executed.append(query)
+        if query == LOAD_STAGED_LISTINGS:
+            self.con.pending += self.staged
+        elif query.startswith("SAVEPOINT"):
+            self.con.savepoint = len(self.con.pending)
+        elif query.startswith("ROLLBACK TO SAVEPOINT"):
+            del self.con.pending[self.con.savepoint :]
+
+    def copy_expert(self, query, buffer):
+        rows = list(csv.reader(buffer))
+        # living_space is the 5th staging column
+        if any(int(row[4]) > INT_MAX for row in rows):
+            raise psycopg2.errors.NumericValueOutOfRange("integer out of range")
+        self.staged = [int(row[0]) for row in rows]
+
+    def fetchall(self):
+        return []  # no unknown customers or realtors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class StubConnection:
+    def __init__(self):
+        self.executed = []
+        self.pending = []
+        self.savepoint = 0
+        self.committed = []
+        self.transactions = 0
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def __enter__(self):
+        self.transactions += 1
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.committed += self.pending
+        self.pending = []
+        return False
+
+
+class StubLookups(LookupCache):
+    """Every municipal, real estate type and adress already exists, with id 1"""
+
+    def resolve(self, cursor, listings):
+        for listing in listings:
+            self.municipals.setdefault(listing.municipal, 1)
+            self.real_estate_types.setdefault(listing.real_estate_type, 1)
+        return {self.adress_key(listing): 1 for listing in listings}
+
+
+def listing(living_space=80):
+    return {
+        "municipal": "Uppsala",
+        "street": "Storgatan",
+        "street_no": "1",
+        "real_estate_type": "Villa",
+        "living_space": living_space,
+        "no_of_rooms": 4,
+        "agreement": "exclusive",
+        "customer": 1,
+        "realtor": 2,
+        "publish_date": "2024-05-01",
+        "end_date": "2024-06-01",
+        "description": "Uppsala, villa",
+        "price": 4500000,
+        "status": "for sale",
+    }
+
+
+def run_import(listings, chunk_size):
+    con = StubConnection()
+    rejections = []
+    stream = io.StringIO("".join(json.dumps(row) + "\n" for row in listings))
+    report = import_listings(
+        con,
+        stream,
+        "ndjson",
+        chunk_size=chunk_size,
+        on_reject=lambda row_no, error: rejections.append((row_no, error)),
+        cache=StubLookups(),
+    )
+    return con, report, rejections
+
+
+def test_valid_chunk_is_loaded_in_one_transaction():
+    con, report, rejections = run_import([listing() for _ in range(3)], chunk_size=3)
+    assert report == {"rows": 3, "imported": 3, "rejected": 0}
+    assert con.committed == [1, 2, 3]
+    assert con.transactions == 1
+    assert not any(query.startswith("SAVEPOINT") for query in con.executed)
+
+
+@pytest.mark.parametrize("chunk_size", [2, 5])
+def test_value_postgres_refuses_rejects_only_its_row(chunk_size):
+    listings = [listing(), listing(INT_MAX + 1), listing(), listing()]
+    con, report, rejections = run_import(listings, chunk_size)
+    assert report == {"rows": 4, "imported": 3, "rejected": 1}
+    assert rejections == [(2, "integer out of range")]
+    assert sorted(con.committed) == [1, 3, 4]
@@ -0,0 +1,101 @@
+"""
+Entity cache: LRU eviction, TTL expiry and the hit/miss/eviction counters of LRUCache,
+values loaded across an invalidation aren't cached, the entity_invalidated payloads drop
+what they name, and GET /ads/{ad_id} is served from the cache until PUT /ads/{ad_id}
+invalidates it (and notifies the other workers).
+"""
+
+import time
+
+import pytest
+
+import cache
+from db import AD_QUERY, NOTIFY_INVALIDATED_QUERY
+from stubs import AdConnection, serve
+
+AD_UPDATE = {
+    "agreement": "exclusive",
+    "customer": 1,
+    "publish_date": "2024-05-01",
+    "end_date": "2024-06-01",
+    "realtor": 2,
+    "description": "Uppsala, villa",
+    "price": 4500000,
+    "sold_price": 0,
+    "status": "for sale",
+}
+
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch):
+    caches = {"ad": cache.LRUCache(), "customer": cache.LRUCache()}
+    monkeypatch.setattr(cache, "caches", caches)
+    return caches
+
+
+def test_least_recently_used_entry_is_evicted():
+    entries = cache.LRUCache(max_size=2)
+    entries.put(1, "one", entries.token())
+    entries.put(2, "two", entries.token())
+    assert entries.get(1) == "one"  # 2 is now the least recently used
+    entries.put(3, "three", entries.token())
+    assert entries.get(2) is None
+    assert entries.get(1) == "one"
+    assert entries.get(3) == "three"
+    stats = entries.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (3, 1, 1)
+
+
+def test_expired_entry_is_a_miss(monkeypatch):
+    entries = cache.LRUCache(ttl=60)
+    entries.put(1, "one", entries.token())
+    now = time.monotonic()
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now + 61)
+    assert entries.get(1) is None
+    assert entries.stats()["evictions"] == 1
+
+
+def test_value_loaded_across_an_invalidation_is_not_cached():
+    entries = cache.LRUCache()
+    token = entries.token()
+    entries.invalidate(1)  # a write committed while the value was being loaded
+    entries.put(1, "old", token)
+    assert entries.get(1) is None
+
+
+def test_value_from_a_lagging_replica_is_not_cached_after_an_invalidation():
+    entries = cache.LRUCache()
+    entries.invalidate(1)
+    entries.put(1, "maybe old", entries.token(), stale_for=5)
+    assert entries.get(1) is None
+    entries.put(2, "current", entries.token(), stale_for=5)
+    assert entries.get(2) == "current"
+
+
+def test_notifications_drop_what_they_name(caches):
+    for kind in ("ad", "customer"):
+        for key in (1, 2):
+            caches[kind].put(key, f"{kind} {key}", caches[kind].token())
+    cache.on_entity_invalidated(None, "ad:1")
+    assert caches["ad"].get(1) is None
+    assert caches["ad"].get(2) == "ad 2"
+    cache.on_entity_invalidated(None, "ad:*")
+    assert caches["ad"].get(2) is None
+    assert caches["customer"].get(1) == "customer 1"
+    cache.on_entity_invalidated(None, None)  # after a reconnect
+    assert caches["customer"].get(1) is None
+
+
+def test_ad_is_served_from_the_cache_until_it_changes(client):
+    con = AdConnection(5)
+    serve(con)
+    first = client.get("/ads/5").json()
+    assert client.get("/ads/5").json() == first
+    assert con.ran(AD_QUERY) == 1
+
+    assert client.put("/ads/5", json=AD_UPDATE).status_code == 200
+    notified = con.params[con.executed.index(NOTIFY_INVALIDATED_QUERY)]
+    assert notified == (cache.CHANNEL, ["ad:5"])
+
+    assert client.get("/ads/5").json()["ad"][0]["version"] == "2.1.1"
+    assert con.ran(AD_QUERY) == 2
@@ -0,0 +1,67 @@
+"""
+Keyset cursors: what encode_cursor() hands out decodes to the sort key and id it was made
+from, and a tampered cursor raises ValueError (a 400) instead of reaching the query with a
+sort key of the wrong type.
+"""
+
+import base64
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from db import decode_cursor, encode_cursor
+
+
+def tampered(sort, value, last_id=7):
+    payload = json.dumps([sort, value, last_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+@pytest.mark.parametrize(
+    "sort, row, expected",
+    [
+        ("id", {"id": 7}, 7),
+        ("price", {"id": 7, "price": 1500000.0}, 1500000.0),
+        ("-price", {"id": 7, "price": None}, None),
+        (
+            "-publish_date",
+            {"id": 7, "publish_date": datetime(2024, 5, 1, 12, tzinfo=timezone.utc)},
+            datetime(2024, 5, 1, 12, tzinfo=timezone.utc),
+        ),
+        ("publish_date", {"id": 7, "publish_date": None}, None),
+        ("-rank", {"id": 7, "rank": 0.25}, 0.25),
+    ],
+)
+def test_cursor_round_trip(sort, row, expected):
+    assert decode_cursor(encode_cursor(sort, row), sort) == (expected, 7)
+
+
+@pytest.mark.parametrize(
+    "sort, value",
+    [
+        ("price", "1500000"),
+        ("price", [1, 2]),
+        ("price", {"price": 1}),
+        ("price", True),
+        ("publish_date", "yesterday"),
+        ("publish_date", 1714564800),
+        ("id", 7.5),
+        ("id", None),
+        ("-rank", None),
+    ],
+)
+def test_tampered_sort_key_is_rejected(sort, value):
+    with pytest.raises(ValueError):
+        decode_cursor(tampered(sort, value), sort)
+
+
+@pytest.mark.parametrize("last_id", ["7", 7.0, None, True])
+def test_tampered_id_is_rejected(last_id):
+    with pytest.raises(ValueError):
+        decode_cursor(tampered("price", 100.0, last_id), "price")
+
+
+def test_cursor_of_another_sort_is_rejected():
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor("price", {"id": 7, "price": 1.0}), "-price")
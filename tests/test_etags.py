@@ -0,0 +1,102 @@
+"""
+Conditional GET: GET /ads/{ad_id} and GET /ads/ send an ETag built from the row versions,
+and answer a request whose If-None-Match (or If-Modified-Since) is still current with a
+304 after the version probe alone, without the full query or a body. A changed version
+gives a new ETag and a 200.
+"""
+
+import pytest
+
+import cache
+from db import AD_QUERY, AD_VERSION_QUERY
+from stubs import AdConnection, StubConnection, serve
+
+
+@pytest.fixture(autouse=True)
+def empty_caches(monkeypatch):
+    # with a cached copy there would be no probe at all
+    monkeypatch.setattr(
+        cache,
+        "caches",
+        {"ad": cache.LRUCache(max_size=0), "customer": cache.LRUCache()},
+    )
+
+
+@pytest.fixture
+def con(client):
+    con = AdConnection(5)
+    serve(con)
+    return con
+
+
+def test_current_etag_gets_a_304_after_the_version_probe(client, con):
+    response = client.get("/ads/5")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag == '"ad-5-1.1.1"'
+    con.executed.clear()
+
+    response = client.get("/ads/5", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert con.executed == [AD_VERSION_QUERY]
+
+
+def test_changed_version_gets_the_new_ad(client, con):
+    etag = client.get("/ads/5").headers["etag"]
+    con.versions[5] += 1
+    response = client.get("/ads/5", headers={"If-None-Match": f'"other", {etag}'})
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"ad-5-2.1.1"'
+    assert con.ran(AD_QUERY) == 2
+
+
+def test_if_modified_since(client, con):
+    last_modified = client.get("/ads/5").headers["last-modified"]
+    con.executed.clear()
+    response = client.get("/ads/5", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    assert con.executed == [AD_VERSION_QUERY]
+
+    response = client.get(
+        "/ads/5", headers={"If-Modified-Since": "Wed, 01 May 2024 11:59:59 GMT"}
+    )
+    assert response.status_code == 200
+
+
+class PageConnection(StubConnection):
+    """A page of ads (and their versions), the same for every page query"""
+
+    def __init__(self):
+        super().__init__()
+        self.versions = {1: "1.1.1", 2: "1.1.1"}
+
+    def rows(self, query, params):
+        return [
+            {"id": id, "price": 1000000.0, "version": version}
+            for id, version in self.versions.items()
+        ]
+
+
+def test_unchanged_page_gets_a_304_after_the_versions_query(client):
+    con = PageConnection()
+    serve(con)
+    etag = client.get("/ads/").headers["etag"]
+    con.executed.clear()
+
+    response = client.get("/ads/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert len(con.executed) == 1  # the versions, not the page
+
+    con.versions[2] = "2.1.1"
+    response = client.get("/ads/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_page_with_included_relations_has_no_etag(client):
+    serve(PageConnection())
+    response = client.get("/ads/", params={"fields": "price"})
+    assert response.status_code == 200
+    assert "etag" not in response.headers
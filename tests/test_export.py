@@ -0,0 +1,51 @@
+"""
+GET /ads/export borrows its connection when the body starts streaming and gives it back
+when the stream ends, so a response that is never sent doesn't keep a pooled connection.
+The pool is a stub counting what is borrowed, bulk_export.export_ads() yields two chunks.
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+import bulk_export
+from app import app
+
+
+class StubPool:
+    def __init__(self):
+        self.borrowed = 0
+        self.returned = []
+
+    def getconn(self):
+        self.borrowed += 1
+        return object()
+
+    def putconn(self, con, broken=False):
+        self.returned.append(broken)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = StubPool()
+    monkeypatch.setattr(app_module, "get_pool", lambda: pool)
+    monkeypatch.setattr(
+        bulk_export,
+        "export_ads",
+        lambda con, format, itersize: iter(['{"id": 1}\n', '{"id": 2}\n']),
+    )
+    return pool
+
+
+def test_unsent_response_borrows_no_connection(pool):
+    response = app_module.export_ads(format="ndjson", itersize=2000)
+    assert response.status_code == 200
+    assert pool.borrowed == 0
+
+
+def test_streamed_export_gives_its_connection_back(pool):
+    response = TestClient(app).get("/ads/export")
+    assert response.status_code == 200
+    assert response.text == '{"id": 1}\n{"id": 2}\n'
+    assert pool.borrowed == 1
+    assert pool.returned == [False]
@@ -0,0 +1,112 @@
+"""
+Favorites: POST /customers/{customer_id}/favorites answers 201 with the ad's new
+favorite_count when it adds the favorite and 200 with the unchanged count when the ad
+already was a favorite, DELETE decrements the count, and unknown ads or favorites are
+404s. Against a scratch database (skipped without DATABASE_URL, see conftest.py)
+ads.favorite_count is checked to follow customer_favorites.
+"""
+
+import psycopg2
+import pytest
+from psycopg2.extras import RealDictCursor
+
+from db import ADD_FAVORITE_QUERY, AD_FAVORITE_COUNT_QUERY, REMOVE_FAVORITES_QUERY
+from stubs import StubConnection, serve
+
+
+class FavoriteConnection(StubConnection):
+    """A connection holding customer_favorites and the favorite_count of ads"""
+
+    def __init__(self, *ad_ids):
+        super().__init__()
+        self.favorites = set()
+        self.counts = {ad_id: 0 for ad_id in ad_ids}
+
+    def rows(self, query, params):
+        if query == ADD_FAVORITE_QUERY:
+            if params[1] not in self.counts:
+                raise psycopg2.errors.ForeignKeyViolation("customer_favorites_ad_fkey")
+            if params in self.favorites:
+                return []  # ON CONFLICT DO NOTHING
+            self.favorites.add(params)
+            self.counts[params[1]] += 1
+            return [{"favorite_count": self.counts[params[1]]}]
+        if query == AD_FAVORITE_COUNT_QUERY:
+            return [{"favorite_count": self.counts[params[0]]}]
+        if query == REMOVE_FAVORITES_QUERY:
+            customer, ad_id, _ = params
+            if (customer, ad_id) not in self.favorites:
+                return []
+            self.favorites.remove((customer, ad_id))
+            self.counts[ad_id] -= 1
+            return [{"id": ad_id, "favorite_count": self.counts[ad_id]}]
+        return []
+
+
+@pytest.fixture
+def con(client):
+    con = FavoriteConnection(5)
+    serve(con)
+    return con
+
+
+def favorite(client, customer, ad_id=5):
+    return client.post(f"/customers/{customer}/favorites", json={"ad": ad_id})
+
+
+def test_new_favorite_is_created(client, con):
+    response = favorite(client, 1)
+    assert response.status_code == 201
+    assert response.json() == {"ad": 5, "favorite_count": 1}
+    assert favorite(client, 2).json()["favorite_count"] == 2
+
+
+def test_repeated_favorite_changes_nothing(client, con):
+    favorite(client, 1)
+    response = favorite(client, 1)
+    assert response.status_code == 200
+    assert response.json() == {"ad": 5, "favorite_count": 1}
+    assert con.ran(AD_FAVORITE_COUNT_QUERY) == 1
+
+
+def test_removed_favorite_is_no_longer_counted(client, con):
+    favorite(client, 1)
+    favorite(client, 2)
+    response = client.delete("/customers/1/favorites/5")
+    assert response.status_code == 200
+    assert response.json() == {"ad": 5, "favorite_count": 1}
+    assert client.delete("/customers/1/favorites/5").status_code == 404
+    assert con.counts[5] == 1
+
+
+def test_favorite_of_an_unknown_ad_is_not_found(client, con):
+    assert favorite(client, 1, ad_id=6).status_code == 404
+
+
+def test_favorite_count_follows_the_favorites(scratch_dsn):
+    con = psycopg2.connect(scratch_dsn, cursor_factory=RealDictCursor)
+    try:
+        with con.cursor() as cursor:
+            cursor.execute("""SELECT customer_profiles.id AS customer, ads.id AS ad
+                   FROM customer_profiles CROSS JOIN ads
+                   WHERE NOT EXISTS (SELECT 1 FROM customer_favorites f
+                                     WHERE f.customer = customer_profiles.id AND f.ad = ads.id)
+                   LIMIT 1;""")
+            customer, ad_id = cursor.fetchone().values()
+            cursor.execute(AD_FAVORITE_COUNT_QUERY, (ad_id,))
+            before = cursor.fetchone()["favorite_count"]
+
+            cursor.execute(ADD_FAVORITE_QUERY, (customer, ad_id))
+            assert cursor.fetchone()["favorite_count"] == before + 1
+            cursor.execute(ADD_FAVORITE_QUERY, (customer, ad_id))
+            assert cursor.fetchone() is None
+            cursor.execute(
+                "SELECT count(*) AS n FROM customer_favorites WHERE ad = %s;", (ad_id,)
+            )
+            assert cursor.fetchone()["n"] == before + 1
+
+            cursor.execute(REMOVE_FAVORITES_QUERY, (customer, ad_id, ad_id))
+            assert cursor.fetchone()["favorite_count"] == before
+    finally:
+        con.rollback()
+        con.close()
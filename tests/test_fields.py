@@ -0,0 +1,75 @@
+"""
+Sparse fieldsets: fields=a,b on GET /ads/, /ads/{ad_id}, /customers/ and
+/customers/{customer_id} returns only those fields, rejects unknown ones with a 400 naming
+the allowed fields, and the list queries select only the requested columns (plus id and
+the sort key) with only the joins those need.
+"""
+
+import pytest
+
+import cache
+from db import AD_FIELDS, ad_list_select, parse_names
+from stubs import AdConnection, StubConnection, serve
+
+
+@pytest.fixture(autouse=True)
+def empty_caches(monkeypatch):
+    monkeypatch.setattr(
+        cache,
+        "caches",
+        {"ad": cache.LRUCache(), "customer": cache.LRUCache()},
+    )
+
+
+def test_field_names_are_checked():
+    assert parse_names(" price, status,price ", AD_FIELDS, "field") == [
+        "price",
+        "status",
+    ]
+    assert parse_names("", AD_FIELDS, "field") == []
+    with pytest.raises(ValueError, match="unknown field color, allowed are id, "):
+        parse_names("price,color", AD_FIELDS, "field")
+
+
+@pytest.mark.parametrize("path", ["/ads/", "/ads/5", "/customers/", "/customers/1"])
+def test_unknown_field_is_a_bad_request(client, path):
+    con = StubConnection()
+    serve(con)
+    response = client.get(path, params={"fields": "id,color"})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("unknown field color, allowed are")
+    assert con.executed == []
+
+
+def test_ad_has_only_the_requested_fields(client):
+    serve(AdConnection(5))
+    response = client.get("/ads/5", params={"fields": "status,price"})
+    assert response.json() == {"ad": [{"status": "for sale", "price": 1000000.0}]}
+    assert "etag" in response.headers  # the cached ad still has its version
+
+
+def test_list_query_selects_only_what_is_needed():
+    select, filters = ad_list_select("price", "-publish_date")
+    query = repr(select)
+    assert "ads.price" in query and "ads.publish_date" in query and "ads.id" in query
+    assert "ads.description" not in query
+    assert "join users" not in query
+    # the inner joins it skipped still leave out the ads they would have dropped
+    assert [repr(filter) for filter, _ in filters] == [
+        "SQL('ads.customer is not null')",
+        "SQL('ads.realtor is not null')",
+    ]
+
+    select, filters = ad_list_select("customer")
+    assert "join users cust_users" in repr(select)
+    assert "join users realt_users" not in repr(select)
+    assert len(filters) == 1
+
+
+def test_page_has_only_the_requested_fields(client):
+    con = StubConnection()
+    serve(con)
+    response = client.get("/ads/", params={"fields": "price"})
+    assert response.status_code == 200
+    (query,) = con.executed
+    assert "ads.description" not in repr(query)
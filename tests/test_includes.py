@@ -0,0 +1,51 @@
+"""
+GET /ads/?include=... must cost 1 + (number of included relations) queries whatever the
+page size: the relations of a whole page are fetched with one query each (no N+1).
+
+The route runs against a stub connection that records every execute and answers with
+canned rows, so no database is needed. It is wrapped in metrics.TimedAsyncConnection like
+get_async_db does, so the query count of the Server-Timing header is checked as well.
+"""
+
+import pytest
+
+from stubs import StubConnection, serve
+
+INCLUDE = ("images", "real_estates")
+
+
+class PageConnection(StubConnection):
+    """A connection whose ads page holds `ads` ads, each with one image and real estate"""
+
+    def __init__(self, ads):
+        super().__init__()
+        self.ads = ads
+
+    def rows(self, query, params):
+        if isinstance(query, str) and "ad_images" in query:
+            return [
+                {"ad": ad, "id": ad, "picture_link": f"{ad}.jpg"} for ad in params[0]
+            ]
+        if isinstance(query, str) and "ads_real_estates" in query:
+            return [{"ad": ad, "id": ad, "living_space": 80} for ad in params[0]]
+        return [{"id": ad, "price": 1000000.0} for ad in range(1, self.ads + 1)]
+
+
+@pytest.mark.parametrize("limit", [1, 20, 100])
+def test_included_relations_cost_one_query_each(client, limit):
+    # one more ad than fits the page, so there is a next page
+    con = PageConnection(ads=limit + 1)
+    serve(con)
+    response = client.get(
+        "/ads/", params={"limit": limit, "include": ",".join(INCLUDE)}
+    )
+
+    assert response.status_code == 200
+    ads = response.json()["ads"]
+    assert len(ads) == limit
+    for ad in ads:
+        assert [image["id"] for image in ad["images"]] == [ad["id"]]
+        assert [estate["id"] for estate in ad["real_estates"]] == [ad["id"]]
+    queries = 1 + len(INCLUDE)
+    assert len(con.executed) == queries
+    assert f'desc="{queries} queries' in response.headers["server-timing"]
@@ -0,0 +1,91 @@
+"""
+`python db_setup.py check-indexes`: it fails (returns False) and lists the foreign keys
+without a supporting index, and lists the tables mostly read by sequential scans.
+The report is checked against a stub connection answering the two catalog queries, and
+the migrations are checked to leave no foreign key unindexed on a scratch database
+(skipped without DATABASE_URL, see conftest.py).
+"""
+
+import db_setup
+
+
+class StubCursor:
+    def __init__(self, con):
+        self.con = con
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self._rows = self.con.answers[query]
+
+    def fetchall(self):
+        return self._rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class StubConnection:
+    def __init__(self, unindexed=(), seq_scanned=()):
+        self.answers = {
+            db_setup.UNINDEXED_FOREIGN_KEYS_QUERY: list(unindexed),
+            db_setup.SEQ_SCAN_HEAVY_TABLES_QUERY: list(seq_scanned),
+        }
+
+    def cursor(self, *args, **kwargs):
+        return StubCursor(self)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def use(monkeypatch, con):
+    monkeypatch.setattr(db_setup, "get_connection", lambda: con)
+
+
+def test_unindexed_foreign_key_fails_the_check(monkeypatch, capsys):
+    use(
+        monkeypatch,
+        StubConnection(
+            unindexed=[
+                {
+                    "table_name": "ads",
+                    "constraint_name": "ads_customer_fkey",
+                    "columns": "customer",
+                }
+            ],
+            seq_scanned=[
+                {
+                    "table_name": "ads",
+                    "live_rows": 50000,
+                    "seq_scan": 120,
+                    "seq_tup_read": 6000000,
+                    "idx_scan": 3,
+                }
+            ],
+        ),
+    )
+    assert db_setup.check_indexes() is False
+    report = capsys.readouterr().out
+    assert "ads(customer)  [ads_customer_fkey]" in report
+    assert "ads: 120 seq scans reading 6000000 rows, 3 index scans" in report
+
+
+def test_indexed_foreign_keys_pass_the_check(monkeypatch, capsys):
+    use(monkeypatch, StubConnection())
+    assert db_setup.check_indexes() is True
+    assert "All foreign keys are indexed" in capsys.readouterr().out
+
+
+def test_migrations_index_every_foreign_key(scratch_dsn, monkeypatch, capsys):
+    monkeypatch.setattr(db_setup, "DATABASE_URL", scratch_dsn)
+    passed = db_setup.check_indexes()
+    assert passed, capsys.readouterr().out
@@ -0,0 +1,147 @@
+"""
+Lookup cache: names and ids of user_types, municipals and real_estate_types are served
+from memory, a NOTIFY on lookup_changed reloads the table it names (all of them for
+None, after a reconnect), the schemas reject ids that aren't in a loaded table, and
+db_async resolves user types without a query.
+
+Against a scratch database (skipped without DATABASE_URL, see conftest.py) the trigger of
+migrations/0002 is checked to reach a running listener.
+"""
+
+import asyncio
+import time
+
+import psycopg2
+import pytest
+from pydantic import ValidationError
+
+import db_async
+import lookups
+from notifications import Listener
+from schemas import RealestateCreate
+from stubs import StubConnection
+
+TABLES = {
+    "user_types": [(1, "Kund"), (2, "Mäklare")],
+    "municipals": [(1, "Uppsala"), (2, "Lund")],
+    "real_estate_types": [(1, "Villa")],
+}
+
+
+class StubCursor:
+    def __init__(self, con):
+        self.con = con
+        self._rows = []
+
+    def execute(self, query, params=None):
+        # the table is an sql.Identifier of the composed query
+        (table,) = [t for t in self.con.tables if f"Identifier('{t}')" in repr(query)]
+        self.con.loaded.append(table)
+        self._rows = self.con.tables[table]
+
+    def fetchall(self):
+        return self._rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class LookupConnection:
+    """A sync autocommit connection holding the lookup tables"""
+
+    autocommit = True
+
+    def __init__(self):
+        self.tables = {table: list(rows) for table, rows in TABLES.items()}
+        self.loaded = []
+
+    def cursor(self):
+        return StubCursor(self)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(lookups, "_ids", {})
+    monkeypatch.setattr(lookups, "_known_ids", {})
+
+
+@pytest.fixture
+def con():
+    con = LookupConnection()
+    lookups.load_lookups(con)
+    return con
+
+
+def real_estate(**values):
+    return {
+        "real_estate_type": 1,
+        "municipal": 1,
+        "adress": 1,
+        "living_space": 80,
+        "no_of_rooms": 4,
+        **values,
+    }
+
+
+def test_lookups_are_served_from_memory(con):
+    assert lookups.get_id("municipals", "Lund") == 2
+    assert lookups.get_id("municipals", "Malmö") is None
+    assert lookups.id_exists("real_estate_types", 1)
+    assert not lookups.id_exists("real_estate_types", 2)
+
+
+def test_notification_reloads_the_changed_table(con):
+    con.tables["municipals"].append((3, "Malmö"))
+    con.loaded.clear()
+    listener = Listener(connect=None)
+    listener.subscribe(lookups.CHANNEL, lookups.on_lookup_changed)
+    listener._dispatch(con, lookups.CHANNEL, "municipals")
+    assert con.loaded == ["municipals"]
+    assert lookups.get_id("municipals", "Malmö") == 3
+
+    listener._dispatch(con, lookups.CHANNEL, "ads")  # not a lookup table
+    assert con.loaded == ["municipals"]
+    listener._dispatch(con, lookups.CHANNEL, None)  # after a reconnect
+    assert sorted(con.loaded[1:]) == sorted(TABLES)
+
+
+def test_schemas_check_ids_against_the_loaded_tables(con):
+    assert RealestateCreate(**real_estate()).municipal == 1
+    with pytest.raises(ValidationError, match="unknown municipal"):
+        RealestateCreate(**real_estate(municipal=9))
+    with pytest.raises(ValidationError, match="unknown real estate type"):
+        RealestateCreate(**real_estate(real_estate_type=9))
+
+
+def test_ids_are_not_checked_before_the_tables_are_loaded():
+    assert RealestateCreate(**real_estate(municipal=9)).municipal == 9
+
+
+def test_user_type_is_resolved_without_a_query(con):
+    db = StubConnection()
+    assert asyncio.run(db_async.get_user_type_id(db, "Mäklare")) == 2
+    assert db.executed == []
+
+
+def test_lookup_trigger_reaches_the_listener(scratch_dsn):
+    listener = Listener(connect=lambda: psycopg2.connect(scratch_dsn))
+    listener.subscribe(lookups.CHANNEL, lookups.on_lookup_changed)
+    listener.start()
+    try:
+        assert listener.connected.wait(5)
+        deadline = time.monotonic() + 5
+        while not lookups.is_loaded("municipals") and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert lookups.get_id("municipals", "Testkommun") is None
+        con = psycopg2.connect(scratch_dsn)
+        with con, con.cursor() as cursor:
+            cursor.execute("INSERT INTO municipals (municipal) VALUES ('Testkommun');")
+        con.close()
+        while lookups.get_id("municipals", "Testkommun") is None:
+            assert time.monotonic() < deadline + 5, "the listener didn't reload"
+            time.sleep(0.05)
+    finally:
+        listener.stop()
@@ -0,0 +1,156 @@
+"""
+Market statistics: a refresh takes the (municipal, month) pairs marked in
+municipal_stats_dirty and recomputes only those, does nothing when none are marked,
+and skips when another refresh holds the advisory lock. The background refresher keeps
+running after a failed refresh.
+
+Against a scratch database (skipped without DATABASE_URL, see conftest.py) the triggers
+of migrations/0006 are checked to mark only the month of an ad whose statistics changed.
+"""
+
+import datetime
+import threading
+
+import psycopg2
+
+import market_stats
+
+JANUARY = datetime.date(2024, 1, 1)
+FEBRUARY = datetime.date(2024, 2, 1)
+
+
+class StubCursor:
+    def __init__(self, con):
+        self.con = con
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.con.executed.append((query, params))
+        if query.startswith("SELECT pg_try_advisory_xact_lock"):
+            self._rows = [(self.con.locked,)]
+        elif query == market_stats.TAKE_DIRTY_MONTHS:
+            self._rows, self.con.dirty = self.con.dirty, []
+        else:
+            self._rows = []
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def fetchall(self):
+        return self._rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class StubConnection:
+    """A sync connection holding municipal_stats_dirty and the advisory lock"""
+
+    def __init__(self, dirty=(), locked=True):
+        self.dirty = list(dirty)
+        self.locked = locked  # whether pg_try_advisory_xact_lock gets the lock
+        self.executed = []
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def queries(self):
+        return [query for query, _ in self.executed]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def test_refresh_recomputes_the_dirty_months():
+    con = StubConnection(dirty=[(1, JANUARY), (2, FEBRUARY)])
+    assert market_stats.refresh_market_stats(con) == 2
+    recomputed = ([1, 2], [JANUARY, FEBRUARY])
+    assert (market_stats.DELETE_MONTH_STATS, recomputed) in con.executed
+    assert (market_stats.COMPUTE_MONTH_STATS, recomputed) in con.executed
+    assert con.dirty == []
+
+
+def test_refresh_without_dirty_months_computes_nothing():
+    con = StubConnection()
+    assert market_stats.refresh_market_stats(con) == 0
+    assert market_stats.COMPUTE_MONTH_STATS not in con.queries()
+
+
+def test_refresh_skips_while_another_refresh_runs():
+    con = StubConnection(dirty=[(1, JANUARY)], locked=False)
+    assert market_stats.refresh_market_stats(con) is None
+    assert market_stats.TAKE_DIRTY_MONTHS not in con.queries()
+    assert con.dirty == [(1, JANUARY)]  # left for the running refresh
+
+
+class StubPool:
+    def __init__(self, refreshed):
+        self.refreshed = refreshed
+        self.borrowed = 0
+
+    def connection(self):
+        self.borrowed += 1
+        if self.borrowed == 1:
+            raise psycopg2.OperationalError("server closed the connection")
+        if self.borrowed == 2:
+            self.refreshed.set()
+        return StubConnection()
+
+
+def test_refresher_keeps_running_after_a_failed_refresh(capsys):
+    refreshed = threading.Event()
+    pool = StubPool(refreshed)
+    refresher = market_stats.Refresher(pool, interval=0.01)
+    refresher.start()
+    try:
+        assert refreshed.wait(5)
+    finally:
+        refresher.stop()
+    assert "market-stats-refresher: refresh failed" in capsys.readouterr().out
+
+
+def test_refresher_is_off_by_default():
+    assert market_stats.start_refresher(StubPool(None), interval=0) is None
+
+
+def count_dirty(cursor):
+    cursor.execute("SELECT count(*) FROM municipal_stats_dirty;")
+    return cursor.fetchone()[0]
+
+
+def test_only_changed_statistics_mark_their_month(scratch_dsn):
+    con = psycopg2.connect(scratch_dsn)
+    try:
+        market_stats.refresh_market_stats(con)  # the whole history
+        with con, con.cursor() as cursor:
+            cursor.execute(
+                """SELECT a.id, re.municipal, date_trunc('month', a.publish_date)::date
+                   FROM ads a
+                   JOIN ads_real_estates ar ON ar.ad = a.id
+                   JOIN real_estates re ON re.id = ar.real_estate
+                   WHERE re.municipal IS NOT NULL AND a.publish_date IS NOT NULL
+                   ORDER BY a.id LIMIT 1;"""
+            )
+            ad, municipal, month = cursor.fetchone()
+            cursor.execute("UPDATE ads SET description = 'Ny' WHERE id = %s;", (ad,))
+            assert count_dirty(cursor) == 0
+            cursor.execute("UPDATE ads SET price = price + 1 WHERE id = %s;", (ad,))
+            cursor.execute("SELECT municipal, month FROM municipal_stats_dirty;")
+            assert (municipal, month) in cursor.fetchall()
+
+        assert market_stats.refresh_market_stats(con) >= 1
+        with con, con.cursor() as cursor:
+            assert count_dirty(cursor) == 0
+            cursor.execute(
+                "SELECT listings FROM municipal_month_stats WHERE municipal = %s AND month = %s;",
+                (municipal, month),
+            )
+            assert cursor.fetchone()[0] >= 1
+    finally:
+        con.close()
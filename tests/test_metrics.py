@@ -0,0 +1,75 @@
+"""
+Request metrics: every response carries a Server-Timing header with the request's time
+in SQL, its queries and rows, and GET /metrics exports per method and route template
+histograms and counters in Prometheus text format.
+"""
+
+import pytest
+
+import cache
+import metrics
+from stubs import AdConnection, serve
+
+
+@pytest.fixture(autouse=True)
+def empty_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, "_routes", {})
+    monkeypatch.setattr(
+        cache,
+        "caches",
+        {"ad": cache.LRUCache(), "customer": cache.LRUCache()},
+    )
+
+
+def exported(client):
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    return response.text.splitlines()
+
+
+def test_response_has_server_timing(client):
+    serve(AdConnection(5))
+    timing = client.get("/ads/5").headers["server-timing"]
+    assert 'desc="1 queries, 1 rows"' in timing
+    assert timing.startswith("db;dur=")
+    assert "db-wait;dur=" in timing and "app;dur=" in timing
+
+    timing = client.get("/ads/5").headers["server-timing"]  # from the cache
+    assert 'desc="0 queries, 0 rows"' in timing
+
+
+def test_requests_are_counted_per_route_template(client):
+    serve(AdConnection(5))
+    client.get("/ads/5")
+    client.get("/ads/5")
+    client.get("/ads/5", headers={"If-None-Match": '"ad-5-1.1.1"'})
+    client.get("/no/such/route")
+    lines = exported(client)
+    assert (
+        'http_requests_total{method="GET",route="/ads/{ad_id}",status="200"} 2' in lines
+    )
+    assert (
+        'http_requests_total{method="GET",route="/ads/{ad_id}",status="304"} 1' in lines
+    )
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"} 1' in lines
+    assert 'db_queries_total{method="GET",route="/ads/{ad_id}"} 1' in lines
+    assert 'db_rows_total{method="GET",route="/ads/{ad_id}"} 1' in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram()
+    for seconds in (0.0005, 0.003, 0.003, 20):
+        histogram.observe(seconds)
+    lines = list(metrics._histogram_lines("h", histogram, 'route="/"'))
+    assert 'h_bucket{route="/",le="0.001"} 1' in lines
+    assert 'h_bucket{route="/",le="0.0025"} 1' in lines
+    assert 'h_bucket{route="/",le="0.005"} 3' in lines
+    assert 'h_bucket{route="/",le="10.0"} 3' in lines
+    assert 'h_bucket{route="/",le="+Inf"} 4' in lines
+    assert 'h_count{route="/"} 4' in lines
+
+
+def test_queries_outside_a_request_are_not_recorded():
+    metrics.record_query(1.0, 10)  # e.g. the market stats refresher
+    metrics.record_wait(1.0)
+    assert metrics._routes == {}
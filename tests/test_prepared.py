@@ -0,0 +1,69 @@
+"""
+Prepared statements: the query constants are prepared once per connection and executed
+by name after that, queries built with psycopg2.sql (the pages, whose text depends on the
+request) are sent as they are, and the statement names remembered for query_of() stay
+bounded however many distinct queries are seen.
+"""
+
+import asyncio
+
+import pytest
+from psycopg2 import extensions, sql
+
+import prepared
+from db import ALL_ADS_SELECT, AD_QUERY, AD_SORT_COLUMNS, build_page_query
+
+
+class StubConnection:
+    def get_transaction_status(self):
+        return extensions.TRANSACTION_STATUS_IDLE
+
+
+class StubCursor:
+    """An aiopg cursor recording its statements"""
+
+    def __init__(self, con):
+        self.raw = self  # prepared.py reads cursor.raw.connection
+        self.connection = con
+        self.executed = []
+
+    async def execute(self, query, params=None):
+        self.executed.append(query)
+
+
+@pytest.fixture(autouse=True)
+def prepare(monkeypatch):
+    monkeypatch.setattr(prepared, "PREPARE_STATEMENTS", True)
+
+
+def run(cursor, query, params):
+    asyncio.run(prepared.execute_async(cursor, query, params))
+
+
+def test_query_constant_is_prepared_once_per_connection():
+    cursor = StubCursor(StubConnection())
+    run(cursor, AD_QUERY, (1,))
+    run(cursor, AD_QUERY, (2,))
+    name, prepare, execute = prepared.statement(AD_QUERY)
+    assert cursor.executed == [prepare, execute, execute]
+    assert prepared.query_of(execute) == AD_QUERY
+
+
+@pytest.mark.parametrize("fields", [None, "price,id", "id,price", "description"])
+def test_built_page_query_is_not_prepared(fields):
+    cursor = StubCursor(StubConnection())
+    select = ALL_ADS_SELECT if fields is None else sql.SQL(f"select {fields} from ads")
+    query, params = build_page_query(
+        select, "ads", 20, "-price", None, allowed=AD_SORT_COLUMNS
+    )
+    run(cursor, query, params)
+    assert cursor.executed == [query]
+
+
+def test_remembered_statements_are_bounded(monkeypatch):
+    monkeypatch.setattr(prepared, "STATEMENT_CACHE_SIZE", 10)
+    for number in range(50):
+        prepared.statement(f"SELECT {number}, %s;")
+    assert len(prepared._queries) <= 10
+    _, _, execute = prepared.statement("SELECT 49, %s;")
+    assert prepared.query_of(execute) == "SELECT 49, %s;"
@@ -0,0 +1,158 @@
+"""
+Realtor ratings: creating, moving and deleting a review adjusts realtor_stats in the same
+transaction as the review, which GET /realtors/{realtor_id}/stats then reads. The stub
+connection applies APPLY_REVIEW_TO_STATS_QUERY the way the upsert does, and the upsert
+itself is checked on a scratch database (skipped without DATABASE_URL, see conftest.py).
+"""
+
+import psycopg2
+import pytest
+from psycopg2.extras import RealDictCursor
+
+from db import (
+    APPLY_REVIEW_TO_STATS_QUERY,
+    DELETE_REALTOR_REVIEW_QUERY,
+    INSERT_REALTOR_REVIEW_QUERY,
+    REALTOR_REVIEW_FOR_UPDATE_QUERY,
+    REALTOR_STATS_QUERY,
+    UPDATE_REALTOR_REVIEW_QUERY,
+)
+from stubs import StubConnection, serve
+
+REALTORS = (2, 3)
+
+
+class ReviewConnection(StubConnection):
+    """A connection holding realtor_reviews and realtor_stats"""
+
+    def __init__(self):
+        super().__init__()
+        self.reviews = {}
+        self.stats = {}
+
+    def review(self, id, originator, realtor, score, comment):
+        if realtor not in REALTORS:
+            raise psycopg2.errors.ForeignKeyViolation("realtor_reviews_realtor_fkey")
+        self.reviews[id] = {"id": id, "realtor": realtor, "score": score}
+        return [{**self.reviews[id], "originator": originator, "comment": comment}]
+
+    def apply(self, realtor, score, delta):
+        stats = self.stats.setdefault(
+            realtor, {"review_count": 0, "score_sum": 0, "histogram": {}}
+        )
+        stats["review_count"] += delta
+        stats["score_sum"] += delta * score
+        count = stats["histogram"].get(str(score), 0) + delta
+        if count:
+            stats["histogram"][str(score)] = count
+        else:
+            del stats["histogram"][str(score)]
+
+    def rows(self, query, params):
+        if query == INSERT_REALTOR_REVIEW_QUERY:
+            return self.review(len(self.reviews) + 1, *params)
+        if query == REALTOR_REVIEW_FOR_UPDATE_QUERY:
+            review = self.reviews.get(params[0])
+            return [dict(review)] if review else []
+        if query == UPDATE_REALTOR_REVIEW_QUERY:
+            *values, id = params
+            return self.review(id, *values) if id in self.reviews else []
+        if query == DELETE_REALTOR_REVIEW_QUERY:
+            review = self.reviews.pop(params[0], None)
+            return [review] if review else []
+        if query == APPLY_REVIEW_TO_STATS_QUERY:
+            self.apply(params["realtor"], params["score"], params["delta"])
+            return []
+        if query == REALTOR_STATS_QUERY:
+            stats = self.stats.get(params[0], {"review_count": 0, "score_sum": 0})
+            count = stats["review_count"]
+            return [
+                {
+                    "realtor": params[0],
+                    "histogram": {},
+                    **stats,
+                    "avg_score": stats["score_sum"] / count if count else None,
+                }
+            ]
+        return []
+
+
+@pytest.fixture
+def con(client):
+    con = ReviewConnection()
+    serve(con)
+    return con
+
+
+def review(realtor=2, score=4):
+    return {"originator": 1, "realtor": realtor, "score": score, "comment": "Bra"}
+
+
+def stats(client, realtor):
+    return client.get(f"/realtors/{realtor}/stats").json()["stats"]
+
+
+def test_new_reviews_are_counted(client, con):
+    assert client.post("/realtor_reviews", json=review(score=4)).status_code == 200
+    assert client.post("/realtor_reviews", json=review(score=5)).status_code == 200
+    assert client.post("/realtor_reviews", json=review(score=5)).status_code == 200
+    rating = stats(client, 2)
+    assert rating["review_count"] == 3
+    assert rating["avg_score"] == pytest.approx(14 / 3)
+    assert rating["histogram"] == {"4": 1, "5": 2}
+    assert con.transactions == ["BEGIN", "COMMIT"] * 3
+
+
+def test_deleted_review_is_no_longer_counted(client, con):
+    client.post("/realtor_reviews", json=review(score=3))
+    client.post("/realtor_reviews", json=review(score=5))
+    assert client.delete("/realtor_reviews/1").status_code == 200
+    rating = stats(client, 2)
+    assert (rating["review_count"], rating["score_sum"]) == (1, 5)
+    assert rating["histogram"] == {"5": 1}  # no "3": 0
+
+    assert client.delete("/realtor_reviews/1").status_code == 404
+    assert stats(client, 2)["review_count"] == 1
+
+
+def test_moved_review_is_counted_for_its_new_realtor(client, con):
+    client.post("/realtor_reviews", json=review(realtor=2, score=2))
+    response = client.put("/realtor_reviews/1", json=review(realtor=3, score=5))
+    assert response.status_code == 200
+    assert stats(client, 2)["review_count"] == 0
+    assert stats(client, 3)["histogram"] == {"5": 1}
+
+    applied = con.ran(APPLY_REVIEW_TO_STATS_QUERY)
+    client.put(
+        "/realtor_reviews/1", json={**review(realtor=3, score=5), "comment": "!"}
+    )
+    assert con.ran(APPLY_REVIEW_TO_STATS_QUERY) == applied  # same realtor and score
+
+
+def test_review_that_fails_is_not_counted(client, con):
+    response = client.post("/realtor_reviews", json=review(realtor=9))
+    assert response.status_code == 409
+    assert con.ran(APPLY_REVIEW_TO_STATS_QUERY) == 0
+    assert con.transactions == ["BEGIN", "ROLLBACK"]
+
+
+def test_stats_upsert(scratch_dsn):
+    con = psycopg2.connect(scratch_dsn, cursor_factory=RealDictCursor)
+    try:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT id FROM realtor_profiles ORDER BY id LIMIT 1;")
+            realtor = cursor.fetchone()["id"]
+            cursor.execute("DELETE FROM realtor_stats WHERE realtor = %s;", (realtor,))
+            for score, delta in ((4, 1), (5, 1), (4, 1), (4, -1), (4, -1)):
+                cursor.execute(
+                    APPLY_REVIEW_TO_STATS_QUERY,
+                    {"realtor": realtor, "score": score, "delta": delta},
+                )
+            cursor.execute(REALTOR_STATS_QUERY, (realtor,))
+            rating = cursor.fetchone()
+        assert (rating["review_count"], rating["score_sum"]) == (1, 5)
+        assert rating["avg_score"] == 5
+        assert rating["histogram"] == {"5": 1}
+    finally:
+        con.rollback()
+        con.close()
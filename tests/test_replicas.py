@@ -0,0 +1,141 @@
+"""
+Read/write splitting: which replicas the lag check leaves in the read rotation (a replica
+whose WAL receiver stopped is out however current it looks), and that a client that wrote
+gets the db_primary_until cookie and reads from the primary until it expires.
+
+The replica and the primary are stub connections, the real get_async_db picks between them.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+import db_async
+import replicas
+from stubs import StubConnection
+
+
+class LagConnection(StubConnection):
+    """A replica answering LAG_QUERY with (lag, receiving)"""
+
+    def __init__(self, lag=0.0, receiving=True):
+        super().__init__()
+        self.lag = lag
+        self.receiving = receiving
+
+    def rows(self, query, params):
+        if query == replicas.LAG_QUERY:
+            return [(self.lag, self.receiving)]
+        return []
+
+
+class Acquired:
+    """What aiopg's pool.acquire() returns: awaitable, or an async context manager"""
+
+    def __init__(self, con):
+        self.con = con
+
+    def __await__(self):
+        yield from []
+        return self.con
+
+    async def __aenter__(self):
+        return self.con
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class StubPool:
+    size = 1
+    freesize = 1
+
+    def __init__(self, con):
+        self.con = con
+
+    def acquire(self):
+        return Acquired(self.con)
+
+    async def release(self, con):
+        pass
+
+
+def replica_on(con):
+    replica = replicas.Replica("host=replica port=5433 dbname=hemnet")
+    replica.pool = StubPool(con)
+    asyncio.run(replica.check())
+    return replica
+
+
+@pytest.mark.parametrize(
+    "lag, receiving, eligible",
+    [
+        (0.0, True, True),
+        (replicas.MAX_LAG, True, True),
+        (replicas.MAX_LAG + 1, True, False),
+        # replayed all it received, but it no longer receives anything
+        (0.0, False, False),
+        (None, True, False),
+    ],
+)
+def test_lag_check_decides_the_read_rotation(lag, receiving, eligible):
+    con = LagConnection(lag, receiving)
+    replica = replica_on(con)
+    assert con.params == [(replicas.RECEIVER_TIMEOUT,)]
+    assert replica.healthy
+    assert replica.eligible() is eligible
+    assert replica.stats()["receiving"] is receiving
+
+
+def test_replica_leaves_the_rotation_when_its_receiver_stops():
+    con = LagConnection()
+    replica = replica_on(con)
+    assert replica.eligible()
+    con.receiving = False
+    asyncio.run(replica.check())
+    assert not replica.eligible()
+    con.receiving = True
+    asyncio.run(replica.check())
+    assert replica.eligible()
+
+
+@pytest.fixture
+def primary(monkeypatch):
+    """The primary's connection, with one replica in the read rotation"""
+    primary = StubConnection()
+    monkeypatch.setattr(replicas, "_replicas", [replica_on(LagConnection())])
+
+    async def acquire():
+        return primary
+
+    async def release(con):
+        pass
+
+    monkeypatch.setattr(db_async, "acquire", acquire)
+    monkeypatch.setattr(db_async, "release", release)
+    return primary
+
+
+def test_reads_go_to_a_replica(client, primary):
+    assert client.get("/ads/").status_code == 200
+    assert not primary.executed
+    assert replicas._replicas[0].pool.con.executed[1:]  # after its lag check
+
+
+def test_a_write_pins_the_client_to_the_primary(client, primary):
+    # rejected, but a write all the same: the client may reload what it sent
+    response = client.post("/ads", json={})
+    assert response.status_code == 422
+    pinned_until = float(response.cookies[replicas.PIN_COOKIE])
+    assert pinned_until == pytest.approx(time.time() + replicas.PIN_SECONDS, abs=5)
+
+    assert client.get("/ads/").status_code == 200
+    assert primary.executed
+    assert not replicas._replicas[0].pool.con.executed[1:]
+
+
+def test_an_expired_pin_reads_from_a_replica_again(client, primary):
+    client.cookies.set(replicas.PIN_COOKIE, str(time.time() - 1))
+    assert client.get("/ads/").status_code == 200
+    assert not primary.executed
@@ -0,0 +1,161 @@
+"""
+EXPLAIN checks of GET /ads/search: the common filter combinations must be answered by the
+index made for them, and never by a sequential scan of ads or real_estates.
+
+The plans only mean something on a large table (on a handful of rows a sequential scan is
+the right plan), so the tests build a scratch database next to the one in DATABASE_URL,
+migrate it and fill it with datagen.generate() (PLAN_TEST_ADS ads, 100000 by default).
+They are skipped when DATABASE_URL is not set or the server can't be reached (see the
+scratch_dsn fixture of conftest.py).
+"""
+
+import json
+import os
+
+import psycopg2
+import pytest
+from psycopg2 import sql
+
+import datagen
+import lookups
+from db import ad_search_sort, build_ad_search_query
+from schemas import AdSearch
+
+PLAN_TEST_ADS = int(os.getenv("PLAN_TEST_ADS", "100000"))
+CHECKED_TABLES = ("ads", "real_estates")
+
+
+def walk(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from walk(child)
+
+
+def seq_scans(plan):
+    """Checked tables read by a sequential scan anywhere in the plan"""
+    return [
+        node["Relation Name"]
+        for node in walk(plan)
+        if node["Node Type"] == "Seq Scan" and node["Relation Name"] in CHECKED_TABLES
+    ]
+
+
+def index_names(plan):
+    """Indexes read anywhere in the plan (index, index only and bitmap index scans)"""
+    return {node["Index Name"] for node in walk(plan) if "Index Name" in node}
+
+
+@pytest.fixture(scope="module")
+def plan_db(scratch_dsn):
+    """A connection to the scratch database, holding a generated dataset"""
+    con = psycopg2.connect(scratch_dsn)
+    try:
+        datagen.generate(con, PLAN_TEST_ADS, seed=1, log=lambda message: None)
+        lookups.load_lookups(con)
+        yield con
+    finally:
+        con.close()
+
+
+@pytest.fixture(scope="module")
+def places(plan_db):
+    """
+    A small generated municipal (few real estates, so filtering on it is selective),
+    its name and a real estate type
+    """
+    with plan_db, plan_db.cursor() as cursor:
+        cursor.execute("""SELECT municipals.id, municipals.municipal
+            FROM real_estates JOIN municipals ON municipals.id = real_estates.municipal
+            GROUP BY municipals.id HAVING count(*) >= 10
+            ORDER BY count(*), municipals.id LIMIT 1;""")
+        municipal, name = cursor.fetchone()
+        cursor.execute("SELECT id FROM real_estate_types ORDER BY id LIMIT 1;")
+        (real_estate_type,) = cursor.fetchone()
+    return {"municipal": municipal, "name": name, "type": real_estate_type}
+
+
+def explain(con, criteria):
+    search = AdSearch(**criteria)
+    query, params = build_ad_search_query(search, ad_search_sort(search))
+    with con, con.cursor() as cursor:
+        cursor.execute(sql.SQL("EXPLAIN (FORMAT JSON) {}").format(query), params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+# (criteria, indexes the plan must read: all of them, or one of those in a tuple),
+# the placeholders are filled in from the places fixture
+SEARCHES = [
+    # a quarter of the ads are for sale, the first page by id walks the primary key
+    ({"status": "for sale"}, {"ads_pkey"}),
+    (
+        {
+            "status": "for sale",
+            "min_price": 2000000,
+            "max_price": 4000000,
+            "sort": "price",
+        },
+        {"ads_status_price_id_idx"},
+    ),
+    (
+        {"status": "for sale", "sort": "-publish_date"},
+        {"ads_for_sale_publish_date_id_idx"},
+    ),
+    (
+        {"municipal": "{municipal}"},
+        {
+            (
+                "real_estates_municipal_type_rooms_idx",
+                "real_estates_municipal_living_space_idx",
+            )
+        },
+    ),
+    (
+        {"municipal": "{municipal}", "real_estate_type": "{type}"},
+        {"real_estates_municipal_type_rooms_idx"},
+    ),
+    (
+        {"municipal": "{municipal}", "real_estate_type": "{type}", "min_rooms": 4},
+        {"real_estates_municipal_type_rooms_idx"},
+    ),
+    (
+        {"municipal": "{municipal}", "min_living_space": 100, "max_living_space": 150},
+        {"real_estates_municipal_living_space_idx"},
+    ),
+    # every description starts with the name of its municipal
+    ({"q": "{name}"}, {"ads_description_tsv_idx"}),
+    ({"q": "{name}", "status": "for sale"}, {"ads_description_tsv_idx"}),
+    (
+        {"q": "{name}", "sort": "-publish_date"},
+        {"ads_description_tsv_idx"},
+    ),
+]
+
+
+def fill(criteria, places):
+    """The criteria with their "{municipal}", "{type}" and "{name}" placeholders filled in"""
+    return {
+        key: (
+            places[value[1:-1]]
+            if isinstance(value, str) and value.startswith("{")
+            else value
+        )
+        for key, value in criteria.items()
+    }
+
+
+@pytest.mark.parametrize(
+    "criteria, expected", SEARCHES, ids=[str(criteria) for criteria, _ in SEARCHES]
+)
+def test_search_uses_its_index(plan_db, places, criteria, expected):
+    plan = explain(plan_db, fill(criteria, places))
+    scanned = seq_scans(plan)
+    assert not scanned, f"expected no seq scan, {scanned} read sequentially"
+    used = index_names(plan)
+    for index in expected:
+        if isinstance(index, tuple):
+            assert used & set(index), f"expected one of {index}, plan read {used}"
+        else:
+            assert index in used, f"expected {index}, plan read {used}"
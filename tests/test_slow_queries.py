@@ -0,0 +1,177 @@
+"""
+Slow query log: statements slower than SLOW_QUERY_MS are printed normalized (no literals
+or parameters), with their fingerprint and the function that ran them, prepared statements
+as the query they were prepared from. A sample of the slow SELECTs (never the writes) is
+queued for an EXPLAIN at most once per fingerprint and interval, and explain() runs it
+read only and stores the plan.
+
+Against a scratch database (skipped without DATABASE_URL, see conftest.py) explain() is
+checked to store a plan in slow_query_log.
+"""
+
+import json
+
+import psycopg2
+import pytest
+
+import prepared
+import slow_queries
+from db import AD_QUERY
+
+SELECT = "SELECT * FROM ads WHERE price > %s AND status = 'for sale';"
+
+
+class StubCursor:
+    """A psycopg2 cursor for check() (mogrify) and explain() (execute, fetchone)"""
+
+    def __init__(self, con=None):
+        self.con = con
+
+    def mogrify(self, query, vars=None):
+        return query.replace("%s", "{}").format(*(vars or ())).encode()
+
+    def execute(self, query, params=None):
+        self.con.executed.append((query, params))
+
+    def fetchone(self):
+        return [[{"Plan": {"Node Type": "Seq Scan"}}]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class StubConnection:
+    def __init__(self):
+        self.executed = []
+        self.transactions = 0
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def __enter__(self):
+        self.transactions += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class StubExplainer:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, normalized, site, duration_ms, query):
+        self.submitted.append((normalized, query))
+
+
+@pytest.fixture(autouse=True)
+def slow_after_100_ms(monkeypatch):
+    monkeypatch.setattr(slow_queries, "SLOW_QUERY_MS", 100)
+    monkeypatch.setattr(slow_queries, "_last_explained", {})
+
+
+@pytest.fixture
+def explainer(monkeypatch):
+    explainer = StubExplainer()
+    monkeypatch.setattr(slow_queries, "_explainer", explainer)
+    monkeypatch.setattr(slow_queries, "EXPLAIN_SAMPLE", 1.0)
+    return explainer
+
+
+def test_queries_are_normalized():
+    normalized = slow_queries.normalize(
+        "select *\n  from ads where id in (1, 2, 3) and description = 'it''s' and price > $1;"
+    )
+    assert normalized == (
+        "select * from ads where id in (?, ...) and description = ? and price > ?"
+    )
+    assert slow_queries.normalize("SELECT col2 FROM t2 LIMIT %s") == (
+        "SELECT col2 FROM t2 LIMIT ?"
+    )
+    assert slow_queries.fingerprint(normalized) == slow_queries.fingerprint(normalized)
+
+
+def test_only_slow_statements_are_logged(capsys):
+    slow_queries.check(StubCursor(), SELECT, (1000,), 0.05)
+    assert capsys.readouterr().out == ""
+
+    slow_queries.check(StubCursor(), SELECT, (1000,), 0.25)
+    normalized = "SELECT * FROM ads WHERE price > ? AND status = ?"
+    fingerprint = slow_queries.fingerprint(normalized)
+    logged = capsys.readouterr().out
+    assert logged.startswith(
+        f"slow-query: 250.0 ms [{fingerprint}] test_slow_queries.py:"
+    )
+    assert logged.rstrip().endswith(
+        f"test_only_slow_statements_are_logged: {normalized}"
+    )
+    assert "1000" not in logged
+
+
+def test_prepared_statement_is_logged_as_its_query(capsys):
+    name, prepare, execute = prepared.statement(AD_QUERY)
+    slow_queries.check(StubCursor(), execute, (5,), 0.25)
+    assert slow_queries.normalize(AD_QUERY) in capsys.readouterr().out
+
+
+def test_a_failing_log_does_not_fail_the_query(capsys):
+    slow_queries.check(StubCursor(), object(), None, 0.25)  # not a query at all
+    assert "slow-query: could not log a slow statement" in capsys.readouterr().out
+
+
+def test_slow_selects_are_sampled_once_per_interval(explainer):
+    slow_queries.check(StubCursor(), SELECT, (1000,), 0.25)
+    slow_queries.check(StubCursor(), SELECT, (2000,), 0.25)
+    assert explainer.submitted == [
+        (
+            "SELECT * FROM ads WHERE price > ? AND status = ?",
+            "SELECT * FROM ads WHERE price > 1000 AND status = 'for sale';",
+        )
+    ]
+
+
+def test_writes_are_not_explained(explainer):
+    slow_queries.check(StubCursor(), "UPDATE ads SET price = %s;", (1,), 0.25)
+    with_delete = (
+        "WITH gone AS (DELETE FROM ads RETURNING id) SELECT count(*) FROM gone;"
+    )
+    slow_queries.check(StubCursor(), with_delete, None, 0.25)
+    assert explainer.submitted == []
+
+
+def test_explain_runs_read_only_and_stores_the_plan():
+    con = StubConnection()
+    slow_queries.explain(con, "SELECT ?", "db_async.py:1 f", 250.0, "SELECT 1")
+    queries = [query for query, _ in con.executed]
+    assert queries[:3] == [
+        "SET TRANSACTION READ ONLY;",
+        "SET LOCAL statement_timeout = %s;",
+        "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT 1",
+    ]
+    query, params = con.executed[3]
+    assert query == slow_queries.INSERT_SLOW_QUERY
+    assert params[1:4] == ("SELECT ?", "db_async.py:1 f", 250.0)
+    assert json.loads(params[4]) == [{"Plan": {"Node Type": "Seq Scan"}}]
+    assert con.transactions == 2  # the insert isn't read only
+
+
+def test_explain_stores_the_plan(scratch_dsn):
+    con = psycopg2.connect(scratch_dsn)
+    try:
+        normalized = "SELECT count(*) FROM ads WHERE price > ?"
+        slow_queries.explain(
+            con, normalized, "test", 250.0, "SELECT count(*) FROM ads WHERE price > 0"
+        )
+        with con, con.cursor() as cursor:
+            cursor.execute(
+                "SELECT query, plan FROM slow_query_log WHERE fingerprint = %s;",
+                (slow_queries.fingerprint(normalized),),
+            )
+            query, plan = cursor.fetchone()
+        assert query == normalized
+        assert plan[0]["Plan"]["Node Type"] == "Aggregate"
+    finally:
+        con.close()